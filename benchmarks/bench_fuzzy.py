@@ -0,0 +1,97 @@
+"""
+Benchmark for search_utils.SearchEngine: latency and recall of typo queries
+against the substring scan of BookList.find_by_name.
+
+Queries are two words of a random book name with one typo in each word
+longer than three letters. The intended results are the books containing
+both words; recall@10 is the share of the first 10 results (or of all
+intended results, if fewer) that are intended.
+
+Usage: python benchmarks/bench_fuzzy.py [sizes...]   (defaults to 10k 100k 1M)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import BookList  # noqa: E402
+from search_utils import SearchEngine, tokenize  # noqa: E402
+from bench_search import make_books  # noqa: E402
+
+QUERY_COUNT = 50
+K = 10
+
+
+def add_typo(word: str, rng: random.Random) -> str:
+    """ Delete, replace, insert or swap one letter of a word """
+    if len(word) <= 3:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(['delete', 'replace', 'insert', 'swap'])
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'replace':
+        return word[:i] + letter + word[i + 1:]
+    if kind == 'insert':
+        return word[:i] + letter + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def make_queries(books: list, rng: random.Random) -> list:
+    """ Return (typo query, ids of the intended books) pairs """
+    words = [set(tokenize(book.name)) for book in books]
+    queries = []
+    while len(queries) < QUERY_COUNT:
+        name = tokenize(rng.choice(books).name)
+        phrase = rng.sample(name, 2) if len(set(name)) >= 2 else name
+        if len(set(phrase)) < 2:
+            continue
+        intended = {book.id for book, book_words in zip(books, words)
+                    if book_words.issuperset(phrase)}
+        queries.append((' '.join(add_typo(word, rng) for word in phrase), intended))
+    return queries
+
+
+def recall(result: list, intended: set) -> float:
+    """ The share of the results that are intended, out of at most K """
+    found = sum(1 for book in result[: K] if book.id in intended)
+    return found / min(K, len(intended))
+
+
+def measure(search, queries: list) -> tuple:
+    """ Return the mean and p95 latency in ms and the mean recall of search """
+    times, recalls = [], []
+    for query, intended in queries:
+        start = time.perf_counter()
+        result = search(query)
+        times.append((time.perf_counter() - start) * 1000)
+        recalls.append(recall(result, intended))
+    times.sort()
+    return (sum(times) / len(times), times[int(len(times) * 0.95)],
+            sum(recalls) / len(recalls))
+
+
+def main(sizes: list) -> None:
+    for n in sizes:
+        books = make_books(n)
+        books_list = BookList(books)
+        start = time.perf_counter()
+        engine = SearchEngine(books_list)
+        build = time.perf_counter() - start
+        queries = make_queries(books, random.Random(n))
+        print(f"{n} books, engine built in {build:.2f}s")
+        for label, search in (
+                ('substring', lambda query: books_list.find_by_name(query, limit=K)),
+                ('fuzzy', lambda query: engine.search(query, K))):
+            books_list.cache.clear()
+            mean, p95, hits = measure(search, queries)
+            print(f"  {label:10} mean {mean:8.2f} ms  p95 {p95:8.2f} ms  recall@{K} {hits:.2f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
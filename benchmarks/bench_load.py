@@ -0,0 +1,52 @@
+"""
+Benchmark for the load_books row -> Book conversion: compares the old
+df.iterrows() loader with Book.from_columns. Reading the xlsx file itself is
+the same for both and left out.
+
+Usage: python benchmarks/bench_load.py [rows]   (defaults to 1M)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+
+def iterrows_loader(df: pd.DataFrame) -> list:
+    """ The loader load_books used before Book.from_columns """
+    comments = [comment.replace("'", '"') for comment in df.comments]
+    df.comments = comments
+    data = []
+    for index, row in df.iterrows():
+        data.append(Book(row['id'], row['name'], row['author'],
+                         row['rating'], row['reviews'], row['genre'],
+                         row['intro'], row['comments']))
+    return data
+
+
+def columns_loader(df: pd.DataFrame) -> list:
+    """ The loader load_books uses now """
+    return Book.from_columns(df)
+
+
+def main(n: int) -> None:
+    times = {}
+    for loader in (iterrows_loader, columns_loader):
+        df = make_catalog(n)
+        start = time.perf_counter()
+        books = loader(df)
+        times[loader.__name__] = time.perf_counter() - start
+        assert len(books) == n
+        print(f"{loader.__name__:16} {times[loader.__name__]:7.2f}s"
+              f"  {n / times[loader.__name__]:12,.0f} rows/sec")
+    print(f"speedup x{times['iterrows_loader'] / times['columns_loader']:.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,61 @@
+"""
+Memory benchmark for Book: bytes per book measured with tracemalloc, for the
+original dict-based Book (eager comment parsing) and the slotted Book.
+
+Usage: python benchmarks/bench_memory.py [books]   (defaults to 100k)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book  # noqa: E402
+
+
+class DictBook:
+    """ Book as it was before __slots__ and lazy comments """
+
+    def __init__(self, id, name, author, rating, reviews, genre,
+                 intro='', comments='{}'):
+        self.id = id
+        self.name = name
+        self.author = author
+        self.rating = rating
+        self.reviews = reviews
+        self.genre = genre
+        self.intro = intro
+        self.comments = json.loads(comments)
+
+
+def make_rows(n: int) -> list:
+    """ Rows as the loader sees them: every row has its own strings """
+    return [(i, f"Book {i}", f"Author {i % 1000}", 4.5, i % 500,
+             ''.join(['Fic', 'tion']), f"Intro {i}",
+             '{"reader%d": "5 a good book", "critic": "3 too long"}' % i)
+            for i in range(n)]
+
+
+def bytes_per_book(cls, n: int) -> float:
+    """ Return the memory allocated per book when building n books of cls """
+    rows = make_rows(n)
+    tracemalloc.start()
+    books = [cls(*row) for row in rows]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(books) == n
+    return size / n
+
+
+def main(n: int) -> None:
+    before = bytes_per_book(DictBook, n)
+    after = bytes_per_book(Book, n)
+    print(f"dict Book    {before:8.1f} bytes/book")
+    print(f"slotted Book {after:8.1f} bytes/book  ({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
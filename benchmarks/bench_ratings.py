@@ -0,0 +1,49 @@
+"""
+Benchmark for rating imports: Book.change_rating one rate at a time against
+BookList.apply_ratings / ColumnarBookList.apply_ratings on an array of
+(book id, rate) pairs.
+
+Usage: python benchmarks/bench_ratings.py [ratings] [books]
+       (defaults to 10M ratings over 100k books; the one-at-a-time loop
+       runs on the first 1M ratings and is extrapolated)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book, BookList  # noqa: E402
+from columnar_utils import ColumnarBookList  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+LOOP_LIMIT = 1_000_000
+
+
+def main(n: int, books: int) -> None:
+    rng = np.random.default_rng(0)
+    pairs = np.column_stack([rng.integers(1, books + 1, n), rng.integers(1, 6, n)])
+    frame = make_catalog(books)
+
+    books_list = BookList(Book.from_columns(frame))
+    loop = pairs[:LOOP_LIMIT].tolist()
+    start = time.perf_counter()
+    for id, rate in loop:
+        books_list.index[id].change_rating(rate)
+    elapsed = time.perf_counter() - start
+    print(f"change_rating loop       {elapsed * n / len(loop):8.2f}s"
+          f"  (measured on {len(loop):,} ratings)")
+
+    for books_list in (BookList(Book.from_columns(frame)), ColumnarBookList.from_frame(frame)):
+        start = time.perf_counter()
+        books_list.apply_ratings(pairs)
+        elapsed = time.perf_counter() - start
+        print(f"{type(books_list).__name__:16} apply {elapsed:8.2f}s  {n / elapsed:14,.0f} ratings/sec")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
@@ -0,0 +1,83 @@
+"""
+Benchmark for recommend_utils.Recommender: build time and memory of the
+rating matrix, latency of recommendations with and without the similar
+books cached, and of incremental ratings.
+
+Ratings are random with a long tail of book popularity, about 10 per user.
+Users are numbered instead of named, the matrix is the same.
+
+Usage: python benchmarks/bench_recommend.py [users] [books]
+       (defaults to 1M users and 100k books)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from recommend_utils import Recommender  # noqa: E402
+
+RATES_PER_USER = 10
+QUERIES = 200
+
+
+def make_ratings(users: int, books: int, seed: int = 0) -> tuple:
+    """ Return user, book id and rate arrays, popular books get most rates """
+    rng = np.random.default_rng(seed)
+    n = users * RATES_PER_USER
+    user = rng.integers(0, users, n)
+    # the popularity of a book falls with its rank, like a Zipf law
+    weights = 1 / np.arange(1, books + 1) ** 0.8
+    book = rng.choice(np.arange(1, books + 1), n, p=weights / weights.sum())
+    # every user likes some kinds of books better
+    rate = np.clip(np.round(3 + (book % 5 - user % 5) * 0.4 + rng.normal(0, 1, n)), 1, 5)
+    return user, book, rate
+
+
+def percentiles(times: list) -> str:
+    times = sorted(times)
+    return (f"p50 {times[len(times) // 2] * 1000:8.2f} ms"
+            f"  p95 {times[int(len(times) * 0.95)] * 1000:8.2f} ms")
+
+
+def main(users: int, books: int) -> None:
+    user, book, rate = make_ratings(users, books)
+    print(f"{len(user)} ratings of {users} users on {books} books")
+    recommender = Recommender()
+    tracemalloc.start()
+    start = time.perf_counter()
+    recommender.load(user, book, rate)
+    build = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  build {build:.2f}s, memory {current / 2 ** 20:.0f} MB (peak {peak / 2 ** 20:.0f} MB)")
+
+    sample = np.random.default_rng(1).choice(users, QUERIES, replace=False).tolist()
+    for label in ('cold', 'warm'):
+        times = []
+        for name in sample:
+            start = time.perf_counter()
+            recommender.recommend(name)
+            times.append(time.perf_counter() - start)
+        print(f"  recommend {label:5} {percentiles(times)}")
+
+    times = []
+    for name, id in zip(sample, np.random.default_rng(2).integers(1, books + 1, QUERIES).tolist()):
+        start = time.perf_counter()
+        recommender.add_rating(name, id, 5)
+        times.append(time.perf_counter() - start)
+    print(f"  add_rating     {percentiles(times)}")
+    times = []
+    for name in sample:
+        start = time.perf_counter()
+        recommender.recommend(name)
+        times.append(time.perf_counter() - start)
+    print(f"  recommend after rating {percentiles(times)}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]] or [1_000_000, 100_000])
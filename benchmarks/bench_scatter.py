@@ -0,0 +1,84 @@
+"""
+Benchmark for ShardedBookList: the time to build the catalog and the
+queries per second of find_by_name / find_by_author, top_books and
+change_rating at 1, 2, 4 and 8 shards, against one BookList in this
+process. The query caches are off, every query reaches the shards.
+
+Searches are scattered to every shard, which each scan 1 / shards of the
+catalog in parallel, so they scale with the shards up to the number of
+CPUs. A change_rating goes to one shard, its throughput is bounded by the
+round trip to the worker.
+
+Usage: python benchmarks/bench_scatter.py [books] [shards...]
+       (defaults to 200000 books, 1 2 4 8 shards)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book, BookList  # noqa: E402
+from shard_utils import ShardedBookList  # noqa: E402
+import storage_utils  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+QUERIES = [('name', 'hunger game'), ('name', 'secret garden'), ('name', 'ter'),
+           ('author', 'suzanne'), ('author', 'westover')]
+# seconds each kind of query runs for
+DURATION = 2.0
+
+
+def throughput(function) -> float:
+    """ Return the calls per second of function over DURATION seconds """
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def run(books_list, ids: list) -> dict:
+    """ Return {query: queries per second} for a book list """
+    queries = iter(QUERIES * 10 ** 6)
+    rng = random.Random(0)
+
+    def search():
+        field, value = next(queries)
+        getattr(books_list, f"find_by_{field}")(value, limit=20)
+
+    def rate():
+        books_list.find_by_id(rng.choice(ids))[0].change_rating(rng.randint(1, 5))
+    return {'search': throughput(search),
+            'top_books': throughput(lambda: books_list.top_books('fiction', 10)),
+            'change_rating': throughput(rate)}
+
+
+def main(n: int, shard_counts: list) -> None:
+    df = make_catalog(n)
+    columns = {name: df[name].tolist() for name in storage_utils.COLUMNS}
+    ids = columns['id']
+    print(f"{n} books, {os.cpu_count()} CPUs, queries per second")
+    start = time.perf_counter()
+    books_list = BookList(Book.from_columns(columns), cache_size=0)
+    build = time.perf_counter() - start
+    base = run(books_list, ids)
+    print(f"  BookList    build {build:7.2f}s  " + '  '.join(
+        f"{name} {rate:9.1f}" for name, rate in base.items()))
+    del books_list
+    for shards in shard_counts:
+        start = time.perf_counter()
+        sharded = ShardedBookList.from_columns(columns, cache_size=0, shards=shards)
+        build = time.perf_counter() - start
+        rates = run(sharded, ids)
+        sharded.close()
+        print(f"  {shards:2} shards   build {build:7.2f}s  " + '  '.join(
+            f"{name} {rate:9.1f} x{rate / base[name]:4.2f}" for name, rate in rates.items()))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+         [int(shards) for shards in sys.argv[2:]] or [1, 2, 4, 8])
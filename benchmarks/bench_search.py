@@ -0,0 +1,69 @@
+"""
+Benchmark for BookList.find_by_name / find_by_author: compares the n-gram
+index against the old linear scan over every book, and one page of a query
+that matches most of the catalog against its full result list.
+
+Usage: python benchmarks/bench_search.py [sizes...]   (defaults to 10k 100k 1M)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book, BookList  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+QUERIES = [('name', 'hunger game'), ('name', 'secret garden'),
+           ('author', 'suzanne'), ('author', 'westover')]
+# queries matching most books, e.g. "search author a"
+BROAD_QUERIES = [('author', 'a'), ('name', 'ter')]
+PAGE_SIZE = 20
+
+
+def make_books(n: int, seed: int = 0) -> list:
+    """ Build the books of a synthetic catalog, see catalog.py """
+    return Book.from_columns(make_catalog(n, seed))
+
+
+def linear_search(books: list, field: str, value: str) -> list:
+    """ The search loop BookList used before the n-gram index """
+    return [book for book in books if value.lower() in getattr(book, field).lower()]
+
+
+def best_of(function, repeat: int = 5) -> float:
+    """ Return the fastest of repeat runs of function, in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes: list) -> None:
+    for n in sizes:
+        books = make_books(n)
+        start = time.perf_counter()
+        books_list = BookList(books)
+        build = time.perf_counter() - start
+        print(f"{n} books, index built in {build:.2f}s")
+        for field, value in QUERIES:
+            search = getattr(books_list, f"find_by_{field}")
+            assert search(value) == linear_search(books, field, value)
+            old = best_of(lambda: linear_search(books, field, value))
+            new = best_of(lambda: search(value))
+            print(f"  {field:6} {value!r:16} scan {old * 1000:9.2f} ms"
+                  f"  index {new * 1000:9.2f} ms  x{old / new:.1f}")
+        for field, value in BROAD_QUERIES:
+            search = getattr(books_list, f"find_by_{field}")
+            full = best_of(lambda: search(value))
+            page = best_of(lambda: search(value, limit=PAGE_SIZE))
+            print(f"  {field:6} {value!r:16} all  {full * 1000:9.2f} ms"
+                  f"  page  {page * 1000:9.2f} ms  ({len(search(value))} matches)")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,72 @@
+"""
+Benchmark for load_books with a catalog split into shards: the time to parse
+the shards and to load the whole BookList, with 1 worker process up to one
+per CPU. Parsing runs in the workers, the merge and the BookList indexes are
+built in this process, so the parse time is the one that scales with cores.
+
+The shards are written once to a temporary folder, in sqlite by default.
+
+Usage: python benchmarks/bench_shards.py [books] [shards] [format]
+       (defaults to 200000 books, 8 shards, sqlite)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import load_books  # noqa: E402
+import storage_utils  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+
+def write_shards(folder: str, n: int, shards: int, format: str) -> str:
+    """ Write a catalog of n books split into shards, return their glob pattern """
+    df = make_catalog(n)
+    size = -(-n // shards)
+    for i in range(shards):
+        part = df.iloc[i * size: (i + 1) * size]
+        storage_utils.write_columns(os.path.join(folder, f"books_{i:03}.{format}"),
+                                    {name: part[name].tolist() for name in storage_utils.COLUMNS})
+    return os.path.join(folder, f"books_*.{format}")
+
+
+def parse(pattern: str, workers: int) -> None:
+    """ Parse the shards like load_books, without building the BookList """
+    shards = storage_utils.find_shards(pattern)
+    if workers == 1:
+        for shard in shards:
+            storage_utils.read_columns(shard)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers, mp_context=storage_utils.worker_context()) as executor:
+        for packed in executor.map(storage_utils.read_packed_columns, shards):
+            storage_utils.unpack_columns(packed)
+
+
+def main(n: int, shards: int, format: str) -> None:
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as folder:
+        pattern = write_shards(folder, n, shards, format)
+        print(f"{n} books in {shards} {format} shards, {cpus} CPUs")
+        base = None
+        for workers in sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1))):
+            start = time.perf_counter()
+            parse(pattern, workers)
+            parsed = time.perf_counter() - start
+            base = base or parsed
+            start = time.perf_counter()
+            books_list = load_books(pattern, workers=workers)
+            loaded = time.perf_counter() - start
+            assert len(books_list.books) == n
+            print(f"  {workers:2} workers  parse {parsed:7.2f}s  x{base / parsed:4.1f}"
+                  f"  load_books {loaded:7.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+         sys.argv[3] if len(sys.argv) > 3 else 'sqlite')
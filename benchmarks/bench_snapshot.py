@@ -0,0 +1,70 @@
+"""
+Benchmark for snapshot_utils: opening a mmap snapshot against parsing the
+same catalog from the fastest books files, and the first queries on it.
+
+The snapshot is read from the page cache, as it is by every process after
+the first one. "Memory" is the growth of the resident set of the process
+while loading (Linux only). For a snapshot it is the mapped pages touched,
+which every process mapping the file shares.
+
+Usage: python benchmarks/bench_snapshot.py [books]   (defaults to 1M)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book, BookList, load_books, save_books  # noqa: E402
+from snapshot_utils import load_snapshot, write_snapshot  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+
+def resident() -> int:
+    """ The resident set size of this process in bytes """
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def timed(function) -> tuple:
+    """ Return the result of function, its time in seconds and the growth of
+        the resident set """
+    before = resident()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    return result, elapsed, resident() - before
+
+
+def main(n: int) -> None:
+    books_list = BookList(Book.from_columns(make_catalog(n)))
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot = os.path.join(folder, 'books.snapshot')
+        start = time.perf_counter()
+        write_snapshot(snapshot, books_list)
+        print(f"{n} books, snapshot written in {time.perf_counter() - start:.2f}s, "
+              f"{os.path.getsize(snapshot) / 2 ** 20:.0f} MB")
+        for format in ('parquet', 'sqlite'):
+            filename = os.path.join(folder, f"books.{format}")
+            save_books(filename, books_list)
+            loaded, elapsed, memory = timed(lambda: load_books(filename))
+            del loaded
+            print(f"  load_books {format:8} {elapsed * 1000:9.1f} ms  "
+                  f"memory {memory / 2 ** 20:7.1f} MB")
+        loaded, elapsed, memory = timed(lambda: load_snapshot(snapshot))
+        print(f"  load_snapshot       {elapsed * 1000:9.1f} ms  "
+              f"memory {memory / 2 ** 20:7.1f} MB")
+        for label, query in (('top_books fiction', lambda: loaded.top_books('fiction')),
+                             ('find_by_id', lambda: loaded.find_by_id(n // 2)),
+                             ('find_by_author page', lambda: loaded.find_by_author('collins', 20)),
+                             ('find_by_name miss', lambda: loaded.find_by_name('no such book'))):
+            start = time.perf_counter()
+            query()
+            print(f"  {label:19} {(time.perf_counter() - start) * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,101 @@
+"""
+Startup benchmark for run.py:
+- the import time of run, from python -X importtime, with the slowest
+  modules it imports;
+- the time from launching "python run.py" to the user name prompt;
+- the time from answering that prompt to the command prompt, once the
+  catalog is loaded. It is measured with an answer right away, and after
+  TYPING seconds like a user typing their name, which the catalog
+  loads behind.
+
+The session runs in a temporary folder with a copy of data/books.xlsx. The
+first launch compiles the snapshot of the catalog, the other launches map
+it, like every launch after the first one.
+
+Usage: python benchmarks/bench_startup.py [launches]   (defaults to 5)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+USER_PROMPT = b'user name: '
+COMMAND_PROMPT = b'What would you like to do? '
+TYPING = 1.0
+# modules that should not be imported before the first prompt
+HEAVY = ['numpy', 'pandas', 'openpyxl']
+
+
+def import_times() -> dict:
+    """ Return {module: cumulative microseconds} of "import run" """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import run'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def read_until(process: subprocess.Popen, marker: bytes) -> None:
+    """ Read the output of process until marker """
+    output = b''
+    while marker not in output:
+        data = os.read(process.stdout.fileno(), 4096)
+        if not data:
+            raise RuntimeError(f"run.py exited before {marker!r}: {output[-200:]!r}")
+        output += data
+
+
+def launch(folder: str, typing: float = 0) -> tuple:
+    """ Run one session, return the seconds to the user name prompt and from
+        the user name to the command prompt """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'run.py')], cwd=folder,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    read_until(process, USER_PROMPT)
+    first = time.perf_counter() - start
+    time.sleep(typing)
+    start = time.perf_counter()
+    process.stdin.write(b'bench\n')
+    process.stdin.flush()
+    read_until(process, COMMAND_PROMPT)
+    ready = time.perf_counter() - start
+    process.communicate(b'exit\n')
+    return first, ready
+
+
+def main(launches: int) -> None:
+    times = [import_times() for _ in range(launches)]
+    total = statistics.median(t['run'] for t in times) / 1000
+    print(f"import run          {total:8.1f} ms (python -X importtime, median)")
+    slowest = sorted(times[-1].items(), key=lambda item: -item[1])[1:6]
+    for name, cumulative in slowest:
+        print(f"  {name:30} {cumulative / 1000:8.1f} ms")
+    imported = [name for name in HEAVY if name in times[-1]]
+    print(f"  heavy modules imported: {', '.join(imported) or 'none'}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.mkdir(os.path.join(folder, 'data'))
+        shutil.copy(os.path.join(ROOT, 'data', 'books.xlsx'), os.path.join(folder, 'data'))
+        first, ready = launch(folder)
+        print(f"first launch        {first * 1000:8.1f} ms to the user name prompt, "
+              f"{ready * 1000:8.1f} ms to the command prompt (imports the catalog and compiles the snapshot)")
+        for typing in (0, TYPING):
+            runs = [launch(folder, typing) for _ in range(launches)]
+            print(f"later launches      {statistics.median(run[0] for run in runs) * 1000:8.1f} ms "
+                  f"to the user name prompt, {statistics.median(run[1] for run in runs) * 1000:8.1f} ms "
+                  f"to the command prompt, name typed in {typing:.1f}s (median of {launches})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,38 @@
+"""
+Benchmark for load_books / save_books with every storage format.
+
+Usage: python benchmarks/bench_storage.py [books] [formats...]
+       (defaults to 100k books and xlsx sqlite parquet feather)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import BookList, Book, load_books, save_books  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+
+def main(n: int, formats: list) -> None:
+    books_list = BookList(Book.from_columns(make_catalog(n)))
+    with tempfile.TemporaryDirectory() as folder:
+        for format in formats:
+            filename = os.path.join(folder, f"books.{format}")
+            start = time.perf_counter()
+            save_books(filename, books_list)
+            save = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = load_books(filename)
+            load = time.perf_counter() - start
+            assert len(loaded.books) == n
+            size = os.path.getsize(filename) / 2 ** 20
+            print(f"{format:8} save {save:7.2f}s  load {load:7.2f}s  {size:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         sys.argv[2:] or ['xlsx', 'sqlite', 'parquet', 'feather'])
@@ -0,0 +1,58 @@
+"""
+Benchmark for users_utils.UserStore: the time to load one user's rates,
+comments and bookshelf as the number of users grows.
+
+Usage: python benchmarks/bench_users.py [sizes...]   (defaults to 10k 100k 1M users)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from users_utils import UserStore  # noqa: E402
+
+BOOKS = 100_000
+ROWS_PER_USER = 5
+LOADS = 1000
+
+
+def fill(store: UserStore, users: int, rng: random.Random) -> None:
+    """ Give every user ROWS_PER_USER rates, comments and collects """
+    connection = store._connection
+    with connection:
+        for table in ('rates', 'comments', 'collects'):
+            connection.executemany(
+                f"INSERT OR IGNORE INTO {table} VALUES (?, ?, ?)",
+                ((f"user{user}", rng.randrange(BOOKS), rng.randrange(1, 6) if table == 'rates'
+                  else f"text {user}") for user in range(users) for _ in range(ROWS_PER_USER)))
+
+
+def main(sizes: list) -> None:
+    for users in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'users.sqlite')
+            store = UserStore(filename)
+            rng = random.Random(users)
+            start = time.perf_counter()
+            fill(store, users, rng)
+            build = time.perf_counter() - start
+            times = []
+            for _ in range(LOADS):
+                name = f"user{rng.randrange(users)}"
+                start = time.perf_counter()
+                store.load(name)
+                times.append(time.perf_counter() - start)
+            times.sort()
+            print(f"{users:>9} users, filled in {build:6.1f}s, "
+                  f"{os.path.getsize(filename) / 2 ** 20:6.0f} MB  load p50 "
+                  f"{times[len(times) // 2] * 1000:.3f} ms  p99 {times[int(len(times) * 0.99)] * 1000:.3f} ms")
+            store.close()
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
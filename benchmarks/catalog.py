@@ -0,0 +1,162 @@
+"""
+A synthetic catalog generator for the benchmarks: books.xlsx-like catalogs
+of any size (10k to 10M books) with realistic columns.
+
+- Names are 2 to 5 words, some of them a volume of a series.
+- Authors write a long tail of books: most one or a few, some hundreds.
+- Ratings sit around 4.5 like the bestsellers in data/books.xlsx.
+- Review counts follow a log-normal distribution (median about 20).
+- Every book has about 5% of its reviews as comments, by readers from a
+  pool where some comment a lot more than others. Their rates follow the
+  book's rating.
+- Comments are JSON, as save_books writes them.
+
+Intros are drawn from a pool of INTRO_POOL texts, so they are full size in
+the files but shared in memory. The same seed gives the same catalog.
+
+Usage: python benchmarks/catalog.py books filename [seed]
+       e.g. python benchmarks/catalog.py 1000000 /tmp/books_1m.parquet
+
+Functions included: make_catalog, write_catalog
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import storage_utils  # noqa: E402
+
+WORDS = ['harry', 'potter', 'hunger', 'games', 'memoir', 'secret', 'garden',
+         'night', 'silent', 'patient', 'girl', 'train', 'wonder', 'educated',
+         'becoming', 'house', 'dragon', 'winter', 'summer', 'ocean', 'river',
+         'stone', 'fire', 'shadow', 'light', 'empire', 'story', 'history',
+         'midnight', 'library', 'kingdom', 'island', 'crown', 'mountain', 'city',
+         'daughter', 'wild', 'forest', 'storm', 'glass', 'golden', 'lost',
+         'last', 'letters', 'journey', 'queen', 'road', 'song', 'war', 'heart']
+NAMES = ['Suzanne', 'Michelle', 'Tara', 'Margaret', 'Laura', 'Stephen',
+         'Rick', 'Jeff', 'Dav', 'Veronica', 'John', 'Delia', 'Gillian']
+SURNAMES = ['Collins', 'Obama', 'Westover', 'Atwood', 'Hillenbrand', 'King',
+            'Riordan', 'Kinney', 'Pilkey', 'Roth', 'Green', 'Owens', 'Flynn']
+GENRES = ['Fiction', 'Non Fiction']
+# the share of Fiction in data/books.xlsx
+FICTION = 0.68
+PHRASES = ['a good book', 'could not put it down', 'too long', 'loved the ending',
+           'not for me', 'a classic', 'read it twice', 'slow start', 'great for kids',
+           'beautifully written', 'the best of the series', 'boring']
+INTRO_POOL = 1000
+INTRO_LENGTH = 700
+# the share of reviews that come with a comment
+COMMENT_RATE = 0.05
+MAX_COMMENTS = 100
+
+
+def _intros(rng: np.random.Generator, length: int) -> list:
+    """ Return INTRO_POOL texts of about length characters """
+    intros = []
+    for size in rng.normal(length, length / 3, INTRO_POOL).clip(length / 4).astype(int):
+        words = rng.choice(WORDS, size // 6 + 1).tolist()
+        intros.append((' '.join(words)[: size].capitalize() + '.'))
+    return intros
+
+
+def _authors(rng: np.random.Generator, n: int) -> np.ndarray:
+    """ Return the author number of n books. Authors write log-normal numbers
+        of books: most one or a few, some a hundred or more """
+    counts = np.ceil(rng.lognormal(0.5, 1.2, n // 2 + 1)).astype(np.int64)
+    counts = counts[: np.searchsorted(np.cumsum(counts), n) + 1]
+    return rng.permutation(np.repeat(np.arange(len(counts)), counts)[: n])
+
+
+def _author_name(number: int) -> str:
+    """ Return a distinct author name for every number """
+    first, rest = NAMES[number % len(NAMES)], number // len(NAMES)
+    surname, rest = SURNAMES[rest % len(SURNAMES)], rest // len(SURNAMES)
+    initials = ''
+    while rest:
+        rest -= 1
+        initials += chr(ord('A') + rest % 26) + '. '
+        rest //= 26
+    return f"{first} {initials}{surname}"
+
+
+def make_catalog(n: int, seed: int = 0, intro_length: int = INTRO_LENGTH,
+                 comment_rate: float = COMMENT_RATE) -> pd.DataFrame:
+    """ Build a catalog of n books
+
+    Args:
+        n (int): the number of books
+        seed (int): the random seed
+        intro_length (int): the average length of an intro
+        comment_rate (float): the share of reviews that come with a comment
+
+    Return:
+        df (pd.DataFrame): the columns of storage_utils.COLUMNS, ids 1 to n
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 6, n)
+    words = rng.integers(0, len(WORDS), (n, 5))
+    volumes = np.where(rng.random(n) < 0.1, rng.integers(1, 8, n), 0)
+    titles = [word.title() for word in WORDS]
+    names = [' '.join(titles[word] for word in row[: length])
+             + (f" (Book {volume})" if volume else '')
+             for row, length, volume in zip(words.tolist(), lengths.tolist(), volumes.tolist())]
+    author_numbers = _authors(rng, n)
+    unique, inverse = np.unique(author_numbers, return_inverse=True)
+    author_names = [_author_name(number) for number in unique.tolist()]
+    authors = [author_names[i] for i in inverse.tolist()]
+    ratings = np.round(np.clip(rng.normal(4.5, 0.3, n), 1, 5), 1)
+    reviews = np.minimum(rng.lognormal(3, 1.5, n), 10 ** 6).astype(np.int64)
+    genres = np.where(rng.random(n) < FICTION, 0, 1)
+    intro_pool = _intros(rng, intro_length)
+    intros = [intro_pool[i] for i in rng.integers(0, INTRO_POOL, n).tolist()]
+
+    counts = np.minimum(rng.binomial(reviews, comment_rate), MAX_COMMENTS)
+    total = int(counts.sum())
+    activity = rng.lognormal(0, 1.5, max(n // 2, 100))
+    users = rng.choice(len(activity), total, p=activity / activity.sum()).tolist()
+    rates = np.clip(np.round(np.repeat(ratings, counts) + rng.normal(0, 1, total)),
+                    1, 5).astype(np.int64).tolist()
+    phrases = rng.integers(0, len(PHRASES), total).tolist()
+    comments = []
+    start = 0
+    for count in counts.tolist():
+        if count == 0:
+            comments.append('{}')
+            continue
+        end = start + count
+        comments.append(json.dumps({f"reader{user}": f"{rate} {PHRASES[phrase]}"
+                                    for user, rate, phrase in zip(users[start: end],
+                                                                  rates[start: end],
+                                                                  phrases[start: end])}))
+        start = end
+    return pd.DataFrame({'id': np.arange(1, n + 1), 'name': names, 'author': authors,
+                         'rating': ratings, 'reviews': reviews,
+                         'genre': [GENRES[genre] for genre in genres.tolist()],
+                         'intro': intros, 'comments': comments},
+                        columns=storage_utils.COLUMNS)
+
+
+def write_catalog(filename: str, n: int, seed: int = 0) -> None:
+    """ Write a catalog of n books to a books file, in any storage_utils format """
+    df = make_catalog(n, seed)
+    storage_utils.write_columns(filename, {name: df[name].tolist()
+                                           for name in storage_utils.COLUMNS})
+
+
+def main(n: int, filename: str, seed: int) -> None:
+    start = time.perf_counter()
+    write_catalog(filename, n, seed)
+    print(f"{n} books written to {filename} in {time.perf_counter() - start:.1f}s, "
+          f"{os.path.getsize(filename) / 2 ** 20:.0f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("Usage: python benchmarks/catalog.py books filename [seed]")
+    main(int(sys.argv[1]), sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 0)
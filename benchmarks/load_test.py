@@ -0,0 +1,84 @@
+"""
+Load test for server.py: many client threads send a mix of search,
+recommend, rate and bookshelf requests, then requests/sec and latency
+percentiles are reported. It also checks that no rating was lost on the
+most rated book.
+
+Usage: python benchmarks/load_test.py [clients] [requests per client]
+       (defaults to 16 clients x 500 requests, against an in-process server
+       on data/books.xlsx that is not saved)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import books_utils  # noqa: E402
+import server  # noqa: E402
+
+HOT_BOOK = 1
+
+
+def client(port: int, count: int, seed: int, latencies: list, rated: list) -> None:
+    """ Send count random requests over one keep-alive connection """
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    user = f"user{seed}"
+    for _ in range(count):
+        choice = rng.random()
+        start = time.perf_counter()
+        if choice < 0.4:
+            connection.request('GET', f"/search?type=name&value={rng.choice(['the', 'harry', 'a'])}")
+        elif choice < 0.7:
+            connection.request('GET', f"/recommend?genre={rng.choice(['fiction', 'non%20fiction'])}")
+        elif choice < 0.9:
+            body = json.dumps({'user': user, 'id': HOT_BOOK, 'rate': '5', 'comment': 'good'})
+            connection.request('POST', '/rate', body, {'Content-Type': 'application/json'})
+            rated.append(1)
+        else:
+            connection.request('GET', f"/shelf?user={user}")
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def main(clients: int, count: int) -> None:
+    books_list = books_utils.load_books('data/books.xlsx')
+    reviews = books_list.find_by_id(HOT_BOOK)[0].reviews
+    httpd = server.make_server(server.BookService(books_list), port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+
+    latencies, rated = [], []
+    threads = [threading.Thread(target=client, args=(port, count, seed, latencies, rated))
+               for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    httpd.shutdown()
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.2f}s"
+          f"  {len(latencies) / elapsed:,.0f} req/s")
+    print(f"latency p50 {percentile(0.5):.2f} ms  p95 {percentile(0.95):.2f} ms"
+          f"  p99 {percentile(0.99):.2f} ms")
+    lost = reviews + len(rated) - books_list.find_by_id(HOT_BOOK)[0].reviews
+    print(f"{len(rated)} ratings of book {HOT_BOOK}, {lost} lost")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 500)
@@ -0,0 +1,438 @@
+"""
+The benchmark suite, in the spirit of asv: times every BookList operation
+and the load / save paths on synthetic catalogs (see catalog.py), and
+stores the results per commit so runs can be compared.
+
+A benchmark is a function registered with @benchmark. It gets the Catalog
+of one size, does its setup, and returns the function to time with the
+number of operations one call does. Results are seconds per operation, the
+best and the median of the repeats, with garbage collection off like
+timeit. Benchmarks with params run once per param, e.g. against every
+BookList implementation.
+
+Results go to benchmarks/results/<commit>.json (<commit>-dirty with
+uncommitted changes), merged with the earlier runs of the same commit.
+--compare prints the ratio of two runs and exits with 1 when a benchmark
+got slower by more than --factor.
+
+Usage: python benchmarks/run_benchmarks.py [-s SIZE ...] [-k PATTERN ...] [-r REPEAT]
+       python benchmarks/run_benchmarks.py --list
+       python benchmarks/run_benchmarks.py --compare OLD [NEW]   (commits or result files)
+
+Sizes default to 10k and 100k books; building the indexes of 1M books takes
+about 2 minutes and 3 GB, 10M more memory than most machines have.
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from books_utils import Book, BookList, bayesian_score, load_books, save_books  # noqa: E402
+from columnar_utils import ColumnarBookList  # noqa: E402
+from snapshot_utils import load_snapshot, write_snapshot  # noqa: E402
+import storage_utils  # noqa: E402
+from catalog import make_catalog  # noqa: E402
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SIZES = [10_000, 100_000]
+# every BookList implementation, and the ones books can be added to / removed from
+LISTS = ['BookList', 'ColumnarBookList', 'SnapshotBookList']
+MUTABLE_LISTS = ['BookList', 'ColumnarBookList']
+FORMATS = ['xlsx', 'sqlite', 'parquet', 'feather']
+# xlsx takes minutes above this size
+XLSX_LIMIT = 100_000
+QUERIES = 100
+PAGE_SIZE = 20
+
+# name -> (function, param, repeat, max_size), in registration order
+BENCHMARKS = {}
+
+
+def benchmark(params: list = None, repeat: int = 5, max_size: dict = None):
+    """ Register a benchmark, see the module docstring
+
+    Args:
+        params (list): run the benchmark once per param, named "function[param]"
+        repeat (int): the number of timed calls
+        max_size (dict): {param: the largest size to run it for}
+    """
+    def register(function):
+        for param in params or [None]:
+            name = function.__name__ if param is None else f"{function.__name__}[{param}]"
+            BENCHMARKS[name] = (function, param, repeat, (max_size or {}).get(param))
+        return function
+    return register
+
+
+class Catalog:
+    """ The synthetic catalog of one size and what the benchmarks build from
+        it, built on first use and shared by the benchmarks
+
+    Attributes:
+        n (int): the number of books
+        folder (str): a temporary folder for books files
+    """
+
+    def __init__(self, n: int, folder: str):
+        self.n = n
+        self.folder = folder
+        self.rng = np.random.default_rng(n)
+
+    @functools.cached_property
+    def frame(self):
+        return make_catalog(self.n)
+
+    @functools.cached_property
+    def books(self) -> dict:
+        """ {list class name: a list of the catalog} """
+        books_list = BookList(Book.from_columns(self.frame))
+        snapshot = self.file('snapshot')
+        write_snapshot(snapshot, books_list)
+        return {'BookList': books_list,
+                'ColumnarBookList': ColumnarBookList.from_frame(self.frame.copy()),
+                'SnapshotBookList': load_snapshot(snapshot)}
+
+    def file(self, format: str) -> str:
+        """ Return the name of a books file of the catalog, written on first use """
+        filename = os.path.join(self.folder, f"books_{self.n}.{format}")
+        if format != 'snapshot' and not os.path.exists(filename):
+            storage_utils.write_columns(filename, {name: self.frame[name].tolist()
+                                                   for name in storage_utils.COLUMNS})
+        return filename
+
+    def ids(self, count: int) -> list:
+        """ Return count random book ids """
+        return self.rng.integers(1, self.n + 1, count).tolist()
+
+    def names(self, count: int) -> list:
+        """ Return count queries: the first two words of random book names """
+        return [' '.join(self.frame.name[id - 1].split()[:2]).lower() for id in self.ids(count)]
+
+    def authors(self, count: int) -> list:
+        """ Return count author names of random books """
+        return [self.frame.author[id - 1] for id in self.ids(count)]
+
+    def readers(self, count: int) -> list:
+        """ Return count user names of readers who commented """
+        users = []
+        for comments in self.frame.comments:
+            users.extend(json.loads(comments))
+            if len(users) >= count:
+                return users[:count]
+        return users
+
+
+@benchmark(params=LISTS, repeat=3)
+def build(catalog: Catalog, kind: str):
+    if kind == 'BookList':
+        return lambda: BookList(Book.from_columns(catalog.frame)), 1
+    if kind == 'ColumnarBookList':
+        return lambda: ColumnarBookList.from_frame(catalog.frame.copy()), 1
+    catalog.books
+    return lambda: load_snapshot(catalog.file('snapshot')), 1
+
+
+@benchmark(params=LISTS)
+def find_by_id(catalog: Catalog, kind: str):
+    books_list, ids = catalog.books[kind], catalog.ids(1000)
+    return lambda: [books_list.find_by_id(id) for id in ids], len(ids)
+
+
+def _uncached(books_list, search, values: list):
+    """ Return a function running search for every value with an empty cache """
+    def run():
+        for value in values:
+            books_list.cache.clear()
+            search(value)
+    return run
+
+
+@benchmark(params=LISTS)
+def find_by_name(catalog: Catalog, kind: str):
+    books_list, names = catalog.books[kind], catalog.names(QUERIES)
+    return _uncached(books_list, books_list.find_by_name, names), len(names)
+
+
+@benchmark(params=LISTS)
+def find_by_name_cached(catalog: Catalog, kind: str):
+    books_list, names = catalog.books[kind], catalog.names(QUERIES)
+    for name in names:
+        books_list.find_by_name(name)
+    return lambda: [books_list.find_by_name(name) for name in names], len(names)
+
+
+@benchmark(params=LISTS)
+def find_by_name_page(catalog: Catalog, kind: str):
+    """ A query matching most books, one page of it """
+    books_list = catalog.books[kind]
+    search = functools.partial(books_list.find_by_name, limit=PAGE_SIZE)
+    return _uncached(books_list, search, ['a'] * 10), 10
+
+
+@benchmark(params=LISTS)
+def find_by_author(catalog: Catalog, kind: str):
+    books_list, authors = catalog.books[kind], catalog.authors(QUERIES)
+    return _uncached(books_list, books_list.find_by_author, authors), len(authors)
+
+
+@benchmark(params=LISTS)
+def top_books(catalog: Catalog, kind: str):
+    books_list = catalog.books[kind]
+    return _uncached(books_list, books_list.top_books, ['fiction', 'non fiction'] * 5), 10
+
+
+@benchmark(params=LISTS)
+def top_books_bayesian(catalog: Catalog, kind: str):
+    """ top_books with another scorer than the kept leaderboard, and a long board """
+    books_list = catalog.books[kind]
+    search = functools.partial(books_list.top_books, rank=100, scorer=bayesian_score)
+    return _uncached(books_list, search, ['fiction', 'non fiction'] * 5), 10
+
+
+@benchmark(params=LISTS)
+def top_books_cached(catalog: Catalog, kind: str):
+    books_list = catalog.books[kind]
+    books_list.top_books('fiction')
+    return lambda: [books_list.top_books('fiction') for _ in range(100)], 100
+
+
+@benchmark(params=LISTS, repeat=1)
+def comments_index(catalog: Catalog, kind: str):
+    """ Building the user -> books index """
+    books_list = catalog.books[kind]
+
+    def run():
+        books_list._commenters = None
+        books_list._user_books()
+    return run, 1
+
+
+@benchmark(params=LISTS)
+def comments_by_user(catalog: Catalog, kind: str):
+    books_list, readers = catalog.books[kind], catalog.readers(QUERIES)
+    books_list._user_books()
+    return lambda: [books_list.comments_by_user(reader) for reader in readers], len(readers)
+
+
+@benchmark(params=LISTS)
+def change_rating(catalog: Catalog, kind: str):
+    books_list, ids = catalog.books[kind], catalog.ids(1000)
+    books = [books_list.find_by_id(id)[0] for id in ids]
+    return lambda: [book.change_rating(5) for book in books], len(books)
+
+
+@benchmark(params=LISTS)
+def add_comment(catalog: Catalog, kind: str):
+    books_list, ids = catalog.books[kind], catalog.ids(1000)
+    books = [books_list.find_by_id(id)[0] for id in ids]
+    return lambda: [book.add_comment('bench', '4', 'a good book') for book in books], len(books)
+
+
+@benchmark(params=LISTS)
+def apply_ratings(catalog: Catalog, kind: str):
+    books_list = catalog.books[kind]
+    pairs = np.column_stack([catalog.ids(100_000), catalog.rng.integers(1, 6, 100_000)])
+    return lambda: books_list.apply_ratings(pairs), len(pairs)
+
+
+@benchmark(params=MUTABLE_LISTS)
+def add_remove_book(catalog: Catalog, kind: str):
+    books_list = catalog.books[kind]
+    books = [Book(catalog.n + i, f"New Book {i}", 'New Author', 4.5, 10, 'Fiction')
+             for i in range(1, 11)]
+
+    def run():
+        for book in books:
+            books_list.add_book(book)
+        for book in books:
+            books_list.remove_book(book.id)
+    return run, 2 * len(books)
+
+
+@benchmark(params=FORMATS, repeat=3, max_size={'xlsx': XLSX_LIMIT})
+def load_books_file(catalog: Catalog, format: str):
+    filename = catalog.file(format)
+    return lambda: load_books(filename), 1
+
+
+@benchmark(params=FORMATS, repeat=3, max_size={'xlsx': XLSX_LIMIT})
+def save_books_file(catalog: Catalog, format: str):
+    books_list = catalog.books['BookList']
+    filename = os.path.join(catalog.folder, f"saved_{catalog.n}.{format}")
+
+    def run():
+        # a full write, not an update of the file it was saved to
+        books_list.source = None
+        save_books(filename, books_list)
+    return run, 1
+
+
+@benchmark()
+def save_books_changes(catalog: Catalog, _):
+    """ Saving 100 changed books to the SQLite file the list was loaded from """
+    filename = os.path.join(catalog.folder, f"changes_{catalog.n}.sqlite")
+    storage_utils.write_columns(filename, storage_utils.read_columns(catalog.file('sqlite')))
+    books_list = load_books(filename)
+    books = [books_list.find_by_id(id)[0] for id in catalog.ids(100)]
+
+    def run():
+        for book in books:
+            book.change_rating(5)
+        save_books(filename, books_list)
+    return run, 1
+
+
+@benchmark(repeat=3)
+def snapshot_write(catalog: Catalog, _):
+    books_list = catalog.books['BookList']
+    filename = os.path.join(catalog.folder, f"saved_{catalog.n}.snapshot")
+    return lambda: write_snapshot(filename, books_list), 1
+
+
+def measure(function, ops: int, repeat: int) -> dict:
+    """ Time repeat calls of function, return seconds per operation """
+    times = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append((time.perf_counter() - start) / ops)
+    finally:
+        if enabled:
+            gc.enable()
+    return {'best': min(times), 'median': statistics.median(times),
+            'repeat': repeat, 'ops': ops}
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit:2}"
+    return f"{seconds / 1e-9:8.0f} ns"
+
+
+def commit_id() -> str:
+    """ Return the short id of the checked out commit, -dirty with
+        uncommitted changes """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                 cwd=root, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + '-dirty' if changes else commit
+
+
+def results_file(name: str) -> str:
+    """ Return the results file of a commit id, or name if it is a file """
+    return name if os.path.isfile(name) else os.path.join(RESULTS, f"{name}.json")
+
+
+def run(sizes: list, patterns: list, repeat: int = None) -> dict:
+    """ Run the benchmarks whose name contains one of patterns, print and
+        return the results, {name: {size: result}} """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for n in sizes:
+            catalog = Catalog(n, folder)
+            print(f"{n} books")
+            for name, (function, param, runs, max_size) in BENCHMARKS.items():
+                if patterns and not any(pattern in name for pattern in patterns):
+                    continue
+                if max_size is not None and n > max_size:
+                    continue
+                timed, ops = function(catalog, param)
+                result = measure(timed, ops, repeat or runs)
+                results.setdefault(name, {})[str(n)] = result
+                print(f"  {name:40} best {format_time(result['best'])}"
+                      f"  median {format_time(result['median'])}")
+            del catalog
+            gc.collect()
+    return results
+
+
+def save(results: dict) -> str:
+    """ Merge results into the results file of the checked out commit """
+    commit = commit_id()
+    filename = results_file(commit)
+    saved = {'results': {}}
+    if os.path.exists(filename):
+        with open(filename) as file:
+            saved = json.load(file)
+    for name, sizes in results.items():
+        saved['results'].setdefault(name, {}).update(sizes)
+    saved.update({'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                              'processor': platform.processor(), 'cpus': os.cpu_count()}})
+    os.makedirs(RESULTS, exist_ok=True)
+    with open(filename, 'w') as file:
+        json.dump(saved, file, indent=1, sort_keys=True)
+    return filename
+
+
+def compare(old: str, new: str, factor: float) -> bool:
+    """ Print the ratio new / old of the best times of two runs
+
+    Return:
+        slower (bool): True if a benchmark got slower by more than factor
+    """
+    runs = []
+    for name in (old, new):
+        with open(results_file(name)) as file:
+            runs.append(json.load(file))
+    print(f"{'':52} {runs[0]['commit']:>11} {runs[1]['commit']:>11}")
+    slower = False
+    for name, sizes in runs[1]['results'].items():
+        for n, result in sizes.items():
+            before = runs[0]['results'].get(name, {}).get(n)
+            if before is None:
+                continue
+            ratio = result['best'] / before['best']
+            mark = 'slower' if ratio > factor else 'faster' if ratio < 1 / factor else ''
+            slower = slower or ratio > factor
+            print(f"  {name:40} {n:>9} {format_time(before['best'])} {format_time(result['best'])}"
+                  f"  x{ratio:5.2f} {mark}")
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run or compare the benchmark suite")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('-k', '--filter', nargs='+', default=[],
+                        help="run the benchmarks whose name contains one of these")
+    parser.add_argument('-r', '--repeat', type=int, help="timed calls per benchmark")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks")
+    parser.add_argument('--compare', nargs='+', metavar='RUN',
+                        help="compare two runs, the second one defaults to this commit")
+    parser.add_argument('--factor', type=float, default=1.1,
+                        help="the ratio reported as slower or faster")
+    args = parser.parse_args()
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+    elif args.compare:
+        old, new = (args.compare + [commit_id()])[:2]
+        sys.exit(1 if compare(old, new, args.factor) else 0)
+    else:
+        results = run(args.sizes, args.filter, args.repeat)
+        print(f"results saved to {save(results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,239 @@ books_utils handles multiple book related classes and functions,
 we can use them to load and update books info, search rate and comment 
 a book.
 
-Classes included: Book, BookList, BookShelf
-Functions included: load_books, save_books
+Classes included: QueryCache, Book, CommentIndex, BookList, BookShelf
+Functions included: make_grams, sum_ratings, paginate, parse_rate, weighted_score, 
+                    bayesian_score, top_k, top_rows, unique_books, unique_columns, load_books, 
+                    save_books
 
 NAME: Tianzi Qin
 SEMESTER: Spring 23
 """
-import pandas as pd 
+import heapq
 import json
-from typing import List
+import os
+import sys
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, namedtuple
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Set, Union
+import storage_utils
+from storage_utils import COLUMNS
+
+# length of the n-grams used by the name / author search index
+GRAM_SIZE = 3
+# locks shared by all books, a book uses the one picked by its id
+BOOK_LOCKS = [threading.Lock() for _ in range(64)]
+# Book events that change a rating, the others ("comment", "remove_comment") 
+# leave scores as they are 
+RATING_EVENTS = ('rate', 'ratings')
+# statistics returned by QueryCache.info, like functools.lru_cache
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+# the Bayesian average rates a book as if it also had PRIOR_REVIEWS reviews 
+# of PRIOR_RATING, so a few high rates do not top a well reviewed book 
+PRIOR_RATING = 4.5
+PRIOR_REVIEWS = 20
+
+
+def make_grams(text: str) -> Set[str]:
+    """ Return the set of n-grams (GRAM_SIZE characters) in a lowercased text 
+
+    Args: 
+        text (str): any text, e.g. a book name 
+
+    Return: 
+        grams (Set[str]): the distinct n-grams of the text 
+    """
+    text = text.lower()
+    return {text[i: i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def sum_ratings(ratings, chunk_size: int = 1_000_000): 
+    """ Group (book id, rate) pairs by book id, chunk by chunk 
+
+    Args: 
+        ratings: an array of shape (n, 2) or any iterable of (book id, rate) pairs 
+        chunk_size (int): pairs read from an iterable at a time 
+
+    Yields: 
+        (ids, totals, counts): NumPy arrays, the distinct book ids of a chunk with 
+                               the sum and the number of their rates 
+    """
+    import numpy as np
+    if isinstance(ratings, np.ndarray): 
+        chunks = [ratings]
+    else: 
+        ratings = iter(ratings)
+        chunks = (np.array(chunk, dtype=np.float64) for chunk in 
+                  iter(lambda: list(islice(ratings, chunk_size)), []))
+    for pairs in chunks: 
+        if len(pairs) == 0: 
+            continue
+        ids, inverse = np.unique(pairs[:, 0].astype(np.int64), return_inverse=True)
+        yield ids, np.bincount(inverse, weights=pairs[:, 1]), np.bincount(inverse)
+
+
+def paginate(books: Iterable['Book'], limit: int = None, offset: int = 0) -> List['Book']: 
+    """ Return one page of books, reading no further than the page's end 
+
+    Args: 
+        books (Iterable[Book]): e.g. BookList.iter_by_name 
+        limit (int): the page size, defaults to everything after offset 
+        offset (int): the number of books before the page 
+    """
+    return list(islice(books, offset, None if limit is None else offset + limit))
+
+
+def parse_rate(comment: str) -> int: 
+    """ Return the rate of a Book.comments value, "rate comment", or None 
+        if the user only commented """
+    rate = comment.split(' ', 1)[0]
+    return int(rate) if rate.isnumeric() else None
+
+
+def weighted_score(rating, reviews): 
+    """ The score top_books ranks books by, Book.score. Like every scorer it 
+        takes a rating and a number of reviews, or NumPy arrays of them """
+    return 0.7 * rating + 0.3 * reviews
+
+
+def bayesian_score(rating, reviews): 
+    """ A scorer ranking books by the Bayesian average of their rating, see 
+        PRIOR_RATING """
+    return (PRIOR_RATING * PRIOR_REVIEWS + rating * reviews) / (PRIOR_REVIEWS + reviews)
+
+
+# the scorers top_books accepts, by name
+SCORERS = {'score': weighted_score, 'bayesian': bayesian_score}
+
+
+def top_k(books: Iterable['Book'], k: int, scorer=weighted_score) -> List['Book']: 
+    """ Return the k books with the highest scores, ties in the order of books. 
+        heapq.nlargest keeps k of them at a time, O(n log k) 
+
+    Args: 
+        books (Iterable[Book]): the candidates 
+        k (int): the number of books 
+        scorer: a scorer, e.g. weighted_score 
+    """
+    if k <= 0: 
+        return []
+    return heapq.nlargest(k, books, key=lambda book: scorer(book.rating, book.reviews))
+
+
+def top_rows(scores, k: int): 
+    """ Return the positions of the k highest scores, ties by position. 
+        np.argpartition's selection finds them in O(n), only they are sorted 
+
+    Args: 
+        scores (np.ndarray): one score per row 
+        k (int): the number of rows 
+
+    Return: 
+        rows (np.ndarray): the best first 
+    """
+    import numpy as np
+    if k <= 0: 
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores): 
+        # the k-th highest score, rows tied with it are all kept for the sort
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        rows = np.flatnonzero(scores >= threshold)
+    else: 
+        rows = np.arange(len(scores))
+    return rows[np.lexsort((rows, -scores[rows]))][: k]
+
+
+def unique_books(books: List['Book']) -> List['Book']: 
+    """ Return books with one book per id: an id listed several times keeps 
+        its first position and its last book, like the shards of load_books 
+
+    Args: 
+        books (List[Book]): the books of a list, returned as they are 
+                            when no id is repeated 
+    """
+    if len({book.id for book in books}) == len(books): 
+        return books
+    return list({book.id: book for book in books}.values())
+
+
+def unique_columns(columns): 
+    """ Return columns with one row per id, the rows unique_books would keep 
+
+    Args: 
+        columns: {column name: list of values} or a DataFrame, returned as 
+                 they are when no id is repeated 
+    """
+    ids = list(columns['id'])
+    if len(set(ids)) == len(ids): 
+        return columns
+    rows = list({id: row for row, id in enumerate(ids)}.values())
+    if isinstance(columns, dict): 
+        return {name: [values[row] for row in rows] for name, values in columns.items()}
+    return columns.iloc[rows].reset_index(drop=True)
+
+
+class QueryCache: 
+    """ A bounded least-recently-used cache of query results. Every entry is 
+    stored with the version of the data it was computed from, and a lookup 
+    with another version is a miss, so callers invalidate entries by bumping 
+    a version instead of searching the cache. 
+
+    Attributes: 
+        maxsize (int): the number of results kept, 0 disables the cache 
+        hits (int): lookups answered from the cache 
+        misses (int): lookups that had to be computed 
+    """
+
+    def __init__(self, maxsize: int = 128): 
+        """ Constructor of the QueryCache object. """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, version: int, compute) -> list: 
+        """ Return the cached result of a query, or compute and cache it 
+
+        Args: 
+            key (tuple): the query, e.g. ("name", "harry", None, 0) 
+            version (int): the version of the data the query reads 
+            compute: a callable returning the result as a list 
+
+        Return: 
+            result (list): a copy, callers may change it 
+        """
+        with self._lock: 
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version: 
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+        result = compute()
+        if self.maxsize > 0: 
+            with self._lock: 
+                self._entries[key] = (version, list(result))
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.maxsize: 
+                    self._entries.popitem(last=False)
+        return result
+
+    def info(self) -> CacheInfo: 
+        """ Return the hits, misses, maxsize and current size of the cache """
+        with self._lock: 
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self) -> None: 
+        """ Drop every entry and reset the statistics """
+        with self._lock: 
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
 
 
 class Book:
@@ -21,13 +245,17 @@ class Book:
         id (int) - an unique book id
         name (str) - a name for the book
         author (str) - author for the book  
-        rating (float) - the rating for the book rated by users 
+        rating (float) - the rating for the book rated by users, rounded to one decimal 
         reviews (int) - the number of reviews 
+        total (float) - the exact sum of all ratings, rating is total / reviews 
         genre (str) - book genre Fiction / Non Fiction 
         intro (str) - An introduction for the book 
-        comments (str) - detailed comments for the book, a json string format,  
-                         used as dictionary, {'user name': 'rate comment'}
+        comments (dict) - detailed comments for the book, {'user name': 'rate comment'}, 
+                          given as a json string and decoded on first access
     """
+    # no per-book __dict__, a large catalog holds millions of these
+    __slots__ = ('id', 'name', 'author', 'rating', 'reviews', 'total', 'genre', 'intro', 
+                 '_raw_comments', '_comments', '_owner')
 
     def __init__(self, id: int, name: str, author: str,
                  rating: float, reviews: int, genre: str,
@@ -38,14 +266,115 @@ class Book:
         self.author = author
         self.rating = rating
         self.reviews = reviews
-        self.genre = genre
+        # rating is only rounded for display, new ratings are added to the total
+        self.total = rating * reviews
+        # only a handful of genres, share one string object per genre
+        self.genre = sys.intern(genre) if isinstance(genre, str) else genre
         self.intro = intro  
-        self.comments = json.loads(comments)
+        # comments stay a json string until they are first used, see comments
+        self._raw_comments = comments
+        self._comments = None
+        # weak reference to the BookList that indexes this book, see _notify
+        self._owner = None
+
+    def _notify(self, event: str, *args) -> None: 
+        """ Tell the owning BookList (if any) that this book has changed, 
+            so it can keep its indexes up to date 
+
+        Args: 
+            event (str): "rate", "ratings", "comment" or "remove_comment" 
+            args: the arguments of the change 
+        """
+        owner = self._owner() if self._owner is not None else None
+        if owner is not None: 
+            owner._book_changed(self, event, args)
+
+    @classmethod
+    def from_columns(cls, columns) -> List['Book']: 
+        """ Build books in bulk from column data, e.g. a DataFrame read from 
+            a books file 
+
+        Args: 
+            columns: a mapping (dict, DataFrame) from every name in COLUMNS 
+                     to a sequence of values, and optionally from "total" 
+
+        Return: 
+            books (List[Book]): one book per row 
+        """
+        values = []
+        for name in COLUMNS: 
+            column = columns[name]
+            # plain python values instead of boxed numpy scalars
+            values.append(column.tolist() if hasattr(column, 'tolist') else column)
+        books = [cls(*row) for row in zip(*values)]
+        if 'total' in columns: 
+            totals = columns['total']
+            for book, total in zip(books, totals.tolist() if hasattr(totals, 'tolist') else totals): 
+                # rows saved before the column existed have none (NULL / NaN)
+                if total is not None and total == total: 
+                    book.total = total
+        return books
+
+    @classmethod
+    def to_columns(cls, books: List['Book']) -> Dict[str, list]: 
+        """ The reverse of from_columns, returns books as columns 
+
+        Args: 
+            books (List[Book]): the books to convert 
+
+        Return: 
+            columns (Dict[str, list]): {column name: values} for every name in COLUMNS 
+                                       and "total" 
+        """
+        rows = [book.to_dict() for book in books]
+        columns = {name: [row[name] for row in rows] for name in COLUMNS}
+        columns['total'] = [book.total for book in books]
+        return columns
+
+    def _decode_comments(self) -> dict: 
+        """ Return the comments, decoding the json string if they are not yet, 
+            called with the book's lock held """
+        if self._comments is None: 
+            try: 
+                self._comments = json.loads(self._raw_comments)
+            except json.JSONDecodeError: 
+                # older files hold str(dict), with single quotes
+                self._comments = json.loads(self._raw_comments.replace("'", '"'))
+        return self._comments
+
+    @property
+    def comments(self) -> dict: 
+        """ The comments as a dictionary, {'user name': 'rate comment'}, 
+            decoded from the json string on first access """
+        comments = self._comments
+        if comments is None: 
+            # a decode racing add_comment must not replace the new comment
+            with BOOK_LOCKS[hash(self.id) % len(BOOK_LOCKS)]: 
+                comments = self._decode_comments()
+        return comments
+
+    @property
+    def comments_json(self) -> str: 
+        """ The comments as a json string, the original string is reused until 
+            add_comment changes them """
+        raw = self._raw_comments
+        if raw is None: 
+            with BOOK_LOCKS[hash(self.id) % len(BOOK_LOCKS)]: 
+                if self._raw_comments is None: 
+                    self._raw_comments = json.dumps(self._comments, ensure_ascii=False)
+                raw = self._raw_comments
+        return raw
+
+    def to_dict(self) -> dict: 
+        """ Returns the book as a row of a books file, {column: value} """
+        return {'id': self.id, 'name': self.name, 'author': self.author, 
+                'rating': self.rating, 'reviews': self.reviews, 'genre': self.genre, 
+                'intro': self.intro, 'comments': self.comments_json}
 
     @property
     def score(self) -> float: 
         """ Returns a score of the book which is used for book recommend """
-        return 0.7 * self.rating + 0.3 * self.reviews
+        return weighted_score(self.rating, self.reviews)
 
     def change_rating(self, rate: int) -> None: 
         """ When a user rates, increase the number of reviews and change 
@@ -54,9 +383,25 @@ class Book:
         Args:
             rate (int): user rate 
         """        
-        total_rating = self.rating * self.reviews
-        self.reviews += 1
-        self.rating = round((total_rating + rate)/self.reviews, 1)
+        self._add(rate, 1)
+        self._notify('rate', rate)
+
+    def add_ratings(self, total: float, count: int) -> None: 
+        """ Add many ratings at once, see BookList.apply_ratings 
+
+        Args: 
+            total (float): the sum of the new ratings 
+            count (int): the number of new ratings 
+        """
+        self._add(total, count)
+        self._notify('ratings', total, count)
+
+    def _add(self, total: float, count: int) -> None: 
+        """ Add count ratings summing to total and update the displayed rating """
+        with BOOK_LOCKS[hash(self.id) % len(BOOK_LOCKS)]: 
+            self.total += total
+            self.reviews += count
+            self.rating = round(self.total / self.reviews, 1)
 
     def add_comment(self, user: str = "", rate: str = "", comment: str = "") -> None:   
         """ When a user comments, add value to the comments: {'user name': 'rate comment'} 
@@ -66,7 +411,29 @@ class Book:
             rate (str): user rate 
             comment (str): user comment
         """    
-        self.comments[user] = rate + " " + comment
+        with BOOK_LOCKS[hash(self.id) % len(BOOK_LOCKS)]: 
+            self._decode_comments()[user] = rate + " " + comment
+            self._raw_comments = None
+        self._notify('comment', user, rate, comment)
+
+    def remove_comment(self, user: str) -> str: 
+        """ Delete the comment of a user, e.g. when the user asks to be forgotten. 
+        A rate in it stays part of the rating, which does not record who rated. 
+
+        Args: 
+            user (str): user name 
+
+        Return: 
+            comment (str): the removed "rate comment", None if the user had 
+                           not commented 
+        """
+        with BOOK_LOCKS[hash(self.id) % len(BOOK_LOCKS)]: 
+            comment = self._decode_comments().pop(user, None)
+            if comment is not None: 
+                self._raw_comments = None
+        if comment is not None: 
+            self._notify('remove_comment', user)
+        return comment
 
     def __str__(self) -> str:
         """ Returns a nicely formatted string of the book with name, author, rating, 
@@ -75,31 +442,350 @@ class Book:
         return string 
     
 
-class BookList:
+class CommentIndex: 
+    """ A reverse index from user names to the books they commented, shared by 
+    the book lists. It is built from the comments of every book on the first 
+    query, then kept up to date as comments are added and removed, so a query 
+    reads only the user's books. 
+
+    A list calls _start_comment_index when it is created, _index_comment from 
+    _book_changed and _index_comments from add_book / remove_book. 
+    """
+
+    def _start_comment_index(self) -> None: 
+        """ Set up an index that is not built yet """
+        self._commenters = None
+        self._commenters_lock = threading.RLock()
+
+    def _user_books(self) -> Dict[str, Set[int]]: 
+        """ Return the index, format: {user name: set of book ids}, built on 
+            first use """
+        with self._commenters_lock: 
+            if self._commenters is None: 
+                commenters = {}
+                for book in list(self.books): 
+                    for user in book.comments: 
+                        commenters.setdefault(user, set()).add(book.id)
+                self._commenters = commenters
+            return self._commenters
+
+    def _index_comment(self, book: Book, event: str, args: tuple) -> None: 
+        """ Follow a "comment" or "remove_comment" event of a book """
+        with self._commenters_lock: 
+            if self._commenters is None: 
+                return
+            if event == 'comment': 
+                self._commenters.setdefault(args[0], set()).add(book.id)
+            elif event == 'remove_comment': 
+                self._discard(args[0], book.id)
+
+    def _index_comments(self, book: Book, added: bool) -> None: 
+        """ Add or remove all comments of a book added to / removed from the list """
+        with self._commenters_lock: 
+            if self._commenters is None: 
+                return
+            for user in book.comments: 
+                if added: 
+                    self._commenters.setdefault(user, set()).add(book.id)
+                else: 
+                    self._discard(user, book.id)
+
+    def _discard(self, user: str, id: int) -> None: 
+        """ Remove one book of a user from the index """
+        ids = self._commenters.get(user)
+        if ids is not None: 
+            ids.discard(id)
+            if len(ids) == 0: 
+                del self._commenters[user]
+
+    def books_commented_by(self, user: str) -> List[Book]: 
+        """ Return the books a user commented on 
+
+        Args: 
+            user (str): user name 
+
+        Return: 
+            result (List[Book]): the books, by id 
+        """
+        with self._commenters_lock: 
+            ids = sorted(self._user_books().get(user, ()))
+        return [book for id in ids for book in self.find_by_id(id)]
+
+    def comments_by_user(self, user: str) -> Dict[int, str]: 
+        """ Return the comments of a user, format: {book id: 'rate comment'} """
+        comments = {}
+        for book in self.books_commented_by(user): 
+            comment = book.comments.get(user)
+            if comment is not None: 
+                comments[book.id] = comment
+        return comments
+
+    def average_rate(self, user: str) -> float: 
+        """ Return the average of the rates in a user's comments, None if the 
+            user has not rated anything """
+        rates = [parse_rate(comment) for comment in self.comments_by_user(user).values()]
+        rates = [rate for rate in rates if rate is not None]
+        return sum(rates) / len(rates) if rates else None
+
+    def remove_user_comments(self, user: str) -> int: 
+        """ Delete every comment of a user across the catalog 
+
+        Args: 
+            user (str): user name 
+
+        Return: 
+            count (int): the number of comments deleted 
+        """
+        return sum(book.remove_comment(user) is not None 
+                   for book in self.books_commented_by(user))
+
+
+class BookList(CommentIndex):
     """ The BookList class is a collection of Book objects. It has the following properties:
 
     Attributes: 
         books (List[Book]): A list of book objects 
+        index (dict): books keyed by id, format: {book id: Book}, 
+                      kept in step with books by add_book / remove_book 
+        name_grams (dict): inverted index of lowercased names, 
+                           format: {n-gram: array of book ids in list order} 
+        author_grams (dict): inverted index of lowercased authors, same format 
+        boards (dict): per-genre leaderboards, format: {genre lower: sorted list of 
+                       (-score, position, book id)}, position keeps ties in list order. 
+                       A key is found by bisection, but moving it shifts the list, 
+                       so a score change costs O(n) memory moves 
+        source (str): the books file this list was last loaded from / saved to 
+        dirty (set): ids of books added or changed since then 
+        removed (set): ids of books removed since then 
+        listeners (list): callables listener(book, event, args), called after an 
+                          owned book changes, e.g. journal_utils.Journal.record 
+        lock (threading.RLock): guards the indexes when several threads share the 
+                                list, see server.py 
+        cache (QueryCache): recent results of top_books, find_by_name and 
+                            find_by_author 
+        versions (dict): {genre lower: version}, bumped when a score in the genre 
+                         changes or a book of the genre is added / removed 
+        catalog_version (int): bumped when a book is added or removed 
+
+    The first BookList a book is added to owns it: Book.change_rating on an owned 
+    book updates that list's leaderboard. Lists built from books that already have 
+    an owner (e.g. search results) keep a snapshot of the scores instead. 
+
+    Cached results hold the Book objects themselves, so comments and ratings 
+    read from them are always current: a name / author search only changes when 
+    the catalog does, and a leaderboard only when a score of its genre does. 
     """
 
-    def __init__(self, books: List[Book]):
-        """ Constructor of the BookList object. """
-        self.books = books 
+    def __init__(self, books: List[Book], cache_size: int = 128):
+        """ Constructor of the BookList object. 
+
+        Args: 
+            books (List[Book]): the books of the list, see unique_books for 
+                                repeated ids 
+            cache_size (int): the number of query results cached, 0 disables it 
+        """
+        self.books = unique_books(books)
+        self.index = {}
+        self.name_grams = {}
+        self.author_grams = {}
+        self.boards = {}
+        self._board_keys = {}
+        self._position = 0
+        self.source = None
+        self.dirty = set()
+        self.removed = set()
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.cache = QueryCache(cache_size)
+        self.versions = {}
+        self.catalog_version = 0
+        self._start_comment_index()
+        for book in self.books: 
+            self._index_book(book, False)
+        # sorted once, inserting every key in order would be O(n ** 2)
+        for board in self.boards.values(): 
+            board.sort()
+
+    def _index_book(self, book: Book, keep_sorted: bool = True) -> None: 
+        """ Add a book to the id index, the n-gram indexes and its leaderboard 
+
+        Args: 
+            book (Book): the book to index 
+            keep_sorted (bool): insert its key in order, False appends it and 
+                                leaves the leaderboard to be sorted 
+        """
+        if book._owner is None or book._owner() is None: 
+            book._owner = weakref.ref(self)
+        self.index[book.id] = book
+        key = (-book.score, self._position, book.id)
+        self._position += 1
+        self._board_keys[book.id] = key
+        board = self.boards.setdefault(book.genre.lower(), [])
+        if keep_sorted: 
+            insort(board, key)
+        else: 
+            board.append(key)
+        self._bump(book.genre)
+        for gram in make_grams(book.name): 
+            self.name_grams.setdefault(gram, array('q')).append(book.id)
+        for gram in make_grams(book.author): 
+            self.author_grams.setdefault(gram, array('q')).append(book.id)
+
+    def _unindex_book(self, book: Book) -> None: 
+        """ Remove a book from the id index, the n-gram indexes and its leaderboard """
+        if book._owner is not None and book._owner() is self: 
+            book._owner = None
+        del self.index[book.id]
+        board = self.boards[book.genre.lower()]
+        del board[bisect_left(board, self._board_keys.pop(book.id))]
+        if len(board) == 0: 
+            del self.boards[book.genre.lower()]
+        self._bump(book.genre)
+        for grams, text in ((self.name_grams, book.name), 
+                            (self.author_grams, book.author)): 
+            for gram in make_grams(text): 
+                ids = grams[gram]
+                ids.remove(book.id)
+                if len(ids) == 0: 
+                    del grams[gram]
+
+    def _bump(self, genre: str) -> None: 
+        """ Invalidate the cached results that depend on the books of a genre 
+            and on the catalog, called when a book is added or removed """
+        genre = genre.lower()
+        self.versions[genre] = self.versions.get(genre, 0) + 1
+        self.catalog_version += 1
+
+    def _book_changed(self, book: Book, event: str, args: tuple) -> None: 
+        """ Called by an owned book after it changes, see Book._notify 
+
+        Args: 
+            book (Book): the changed book 
+            event (str): "rate", "ratings", "comment" or "remove_comment" 
+            args (tuple): the arguments of the change 
+        """
+        with self.lock: 
+            self.dirty.add(book.id)
+            self._index_comment(book, event, args)
+            if event in RATING_EVENTS: 
+                old = self._board_keys[book.id]
+                board = self.boards[book.genre.lower()]
+                del board[bisect_left(board, old)]
+                key = (-book.score, old[1], book.id)
+                self._board_keys[book.id] = key
+                insort(board, key)
+                self.versions[book.genre.lower()] += 1
+        for listener in self.listeners: 
+            listener(book, event, args)
+
+    def _search(self, grams: Dict[str, array], field: str, value: str) -> Iterator[Book]: 
+        """ Case-insensitive substring search on a book field, using the n-gram 
+        index to narrow down candidates. Results are generated lazily in the 
+        order of self.books, so a caller that needs one page stops early. 
+
+        Args: 
+            grams (dict): name_grams or author_grams 
+            field (str): "name" or "author" 
+            value (str): the substring to look for 
+
+        Yields: 
+             book (Book): the matching books 
+        """
+        value = value.lower()
+        query = make_grams(value)
+        if len(query) == 0: 
+            # shorter than one n-gram, nothing to narrow down with
+            candidates = iter(self.books)
+        else: 
+            postings = [grams.get(gram) for gram in query]
+            if None in postings: 
+                return
+            # every match contains every gram, so the shortest posting list 
+            # holds all of them, in list order. Books removed while a caller 
+            # is still reading are skipped. 
+            candidates = (self.index.get(id) for id in min(postings, key=len))
+        for book in candidates: 
+            if book is not None and value in getattr(book, field).lower(): 
+                yield book
+
+    def add_book(self, book: Book) -> None: 
+        """ Add a book to the list and the indexes 
+
+        Args: 
+            book (Book): the book to add, its id must not be in the list yet 
+        """
+        with self.lock: 
+            if book.id in self.index: 
+                raise ValueError(f"Book {book.id} is already in the list")
+            self.books.append(book)
+            self._index_book(book)
+            self._index_comments(book, True)
+            self.dirty.add(book.id)
+            self.removed.discard(book.id)
+
+    def remove_book(self, id: int) -> Book: 
+        """ Remove a book from the list and the indexes 
+
+        Args: 
+            id (int): unique book id 
+
+        Return: 
+            book (Book): the removed book 
+        """
+        with self.lock: 
+            book = self.index[int(id)]
+            self._unindex_book(book)
+            self._index_comments(book, False)
+            self.books.remove(book)
+            self.dirty.discard(book.id)
+            self.removed.add(book.id)
+        return book
     
-    def top_books(self, genre: str, rank: int = 10) -> List[Book]:  
+    def apply_ratings(self, ratings, chunk_size: int = 1_000_000) -> int: 
+        """ Apply many ratings at once, e.g. a historical import. Ratings are 
+        summed per book with NumPy (see sum_ratings) and each book is updated 
+        once per chunk. 
+
+        Args: 
+            ratings: an array of shape (n, 2) or any iterable of (book id, rate) pairs 
+            chunk_size (int): pairs read from an iterable at a time 
+
+        Return: 
+            count (int): the number of ratings applied, pairs with an unknown 
+                         book id are skipped 
+        """
+        applied = 0
+        for ids, totals, counts in sum_ratings(ratings, chunk_size): 
+            for id, total, count in zip(ids.tolist(), totals.tolist(), counts.tolist()): 
+                book = self.index.get(id)
+                if book is not None: 
+                    book.add_ratings(total, count)
+                    applied += count
+        return applied
+
+    def top_books(self, genre: str, rank: int = 10, scorer=None) -> List[Book]:  
         """ Return a recommend list of top 10 books in different genres, 
-        rank books by scores  
+        rank books by scores. The leaderboard of Book.score is read as it is, 
+        another scorer selects the top books of the genre with top_k. 
         
         Args:  
             genre (str): Fiction/Non Fiction 
             rank (int): top X books, defaults to top 10 
+            scorer: a scorer such as bayesian_score, defaults to Book.score 
             
         Return: 
-             board (List[Book]): A list of book objects 
+             board (List[Book]): A list of book objects, ties in list order 
         """
-        books_genre = [book for book in self.books if book.genre.lower() == genre.lower()] 
-        board = sorted(books_genre, key = lambda book: book.score, reverse=True)[: rank] 
-        return board    
+        genre = genre.lower()
+
+        def compute() -> List[Book]: 
+            with self.lock: 
+                if scorer is None: 
+                    board = self.boards.get(genre, [])
+                    return [self.index[id] for _, _, id in board[: max(rank, 0)]]
+                return top_k((book for book in self.books if book.genre.lower() == genre), 
+                             rank, scorer)
+        return self.cache.get(('top', genre, rank, scorer), self.versions.get(genre, 0), compute)
 
     def find_by_id(self, id: str) -> List[Book]:
         """ Search books by id 
@@ -110,41 +796,65 @@ class BookList:
         Return: 
              result (List[Book]): A list of book objects 
         """
-        result = []
-        for book in self.books: 
-            if book.id == int(id): 
-                result.append(book) 
-        return result 
+        book = self.index.get(int(id))
+        if book is None: 
+            return []
+        return [book]
     
-    def find_by_name(self, short_name: str) -> List[Book]:   
+    def iter_by_name(self, short_name: str) -> Iterator[Book]: 
+        """ Search books by short name, lazily 
+
+        Args: 
+            short name (str): short name of books 
+
+        Yields: 
+             book (Book): the matching books, in list order 
+        """
+        return self._search(self.name_grams, 'name', short_name)
+
+    def iter_by_author(self, author: str) -> Iterator[Book]: 
+        """ Search books by author name, lazily 
+
+        Args: 
+            author (str): short author name of books 
+
+        Yields: 
+             book (Book): the matching books, in list order 
+        """
+        return self._search(self.author_grams, 'author', author)
+
+    def find_by_name(self, short_name: str, limit: int = None, offset: int = 0) -> List[Book]:   
         """ Search books by short name 
         
         Args:  
             short name (str): short name of books
+            limit (int): return at most limit books, defaults to all 
+            offset (int): skip the first offset matches, for the next pages 
             
         Return: 
              result (List[Book]): A list of book objects 
         """    
-        result = [] 
-        for book in self.books: 
-            if short_name.lower() in book.name.lower(): 
-                result.append(book) 
-        return result  
+        return self.cache.get(('name', short_name.lower(), limit, offset), self.catalog_version, 
+                              lambda: paginate(self.iter_by_name(short_name), limit, offset))
     
-    def find_by_author(self, author: str) -> List[Book]:   
+    def find_by_author(self, author: str, limit: int = None, offset: int = 0) -> List[Book]:   
         """ Search books by author name 
         
         Args:  
             author (str): short author name of books
+            limit (int): return at most limit books, defaults to all 
+            offset (int): skip the first offset matches, for the next pages 
             
         Return: 
              result (List[Book]): A list of book objects 
         """  
-        result = [] 
-        for book in self.books: 
-            if author.lower() in book.author.lower(): 
-                result.append(book) 
-        return result 
+        return self.cache.get(('author', author.lower(), limit, offset), self.catalog_version, 
+                              lambda: paginate(self.iter_by_author(author), limit, offset))
+
+    def cache_info(self) -> CacheInfo: 
+        """ Return the statistics of the query cache: hits, misses, maxsize and 
+            currsize, see QueryCache """
+        return self.cache.info()
 
 
 class BookShelf:  
@@ -154,7 +864,11 @@ class BookShelf:
         name (str): The name of the bookshelf, usually user's name 
         collects (dict): An empty dict, save books users add to the bookshelf, 
                          format: {book id: book name} 
+        listeners (list): callables listener(shelf, "collect", (book id, book name)), 
+                          called after a book is added 
     """
+    __slots__ = ('name', 'collects', 'listeners')
+
     def __init__(self, name):   
         """ Constructor of the BookShelf object. 
         
@@ -163,6 +877,7 @@ class BookShelf:
         """ 
         self.name = name
         self.collects = {}
+        self.listeners = []
     
     def add_collect(self, book: Book) -> None:   
         """ Add books to the bookshelf 
@@ -172,43 +887,77 @@ class BookShelf:
         """
         id = book.id
         self.collects[id] = book.name 
+        for listener in self.listeners: 
+            listener(self, 'collect', (id, book.name))
     
 
-def load_books(filename: str) -> BookList:
-    """  Read the file specified by filename, and return a BookList object.  
+def load_books(filename: Union[str, Iterable[str]], format: str = None, 
+               workers: int = None) -> BookList:
+    """  Read the file specified by filename, and return a BookList object. 
+    A catalog split into shards is read from a list of files or a glob pattern, 
+    the shards are parsed in parallel by worker processes and merged. An id in 
+    several shards keeps the book of the last one, shards of a pattern are 
+    sorted by name. 
 
     Args: 
-        filename (str): an excel file name
+        filename: a books file name, .xlsx, .sqlite / .db, .parquet or .feather, 
+                  a glob pattern such as "data/books_*.xlsx" or a list of names 
+        format (str): forces a storage format instead of using the extension 
+        workers (int): the number of worker processes for shards, defaults to 
+                       the number of CPUs, 1 reads them in this process 
     """
-    df = pd.read_excel(filename)  
-    comments = [comment.replace("'", '"') for comment in df.comments] 
-    df.comments = comments
-    data = []
-    for index, row in df.iterrows():
-        # create a Book instance with data from the row
-        book = Book(row['id'], row['name'], row['author'],
-                    row['rating'], row['reviews'], row['genre'],
-                    row['intro'], row['comments'])
-        # add the Book instance to the list
-        data.append(book) 
-    return BookList(data)   
-
-
-def save_books(filename: str, books_list: BookList) -> None:
-    """  Read the file specified by filename, and return a TodoList object.  
+    shards = storage_utils.find_shards(filename)
+    if len(shards) == 1: 
+        books_list = BookList(Book.from_columns(storage_utils.read_columns(shards[0], format)))
+        # only a single file can be saved back to in place
+        if isinstance(filename, str): 
+            books_list.source = os.path.abspath(shards[0])
+        return books_list
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    if workers == 1: 
+        parts = [storage_utils.read_columns(shard, format) for shard in shards]
+    else: 
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers, mp_context=storage_utils.worker_context()) as executor: 
+            parts = [storage_utils.unpack_columns(packed) for packed in executor.map(
+                storage_utils.read_packed_columns, shards, [format] * len(shards))]
+    names = COLUMNS + [name for name in storage_utils.OPTIONAL_COLUMNS 
+                       if any(name in part for part in parts)]
+    # a shard written before an optional column existed has none of its values
+    columns = {name: list(chain.from_iterable(part.get(name, [None] * len(part['id'])) 
+                                              for part in parts)) for name in names}
+    # an id in several shards is merged by BookList, see unique_books
+    return BookList(Book.from_columns(columns))
+
+
+def save_books(filename: str, books_list: BookList, format: str = None, 
+               checkpoint: int = None) -> None:
+    """  Write the books of books_list to the file specified by filename. 
+    If the list was loaded from / saved to this file before, only the changes 
+    since then are written: nothing if there are none, and only the changed rows 
+    for formats that support it (SQLite). 
 
     Args: 
-        filename (str): an excel file name
+        filename (str): a books file name, .xlsx, .sqlite / .db, .parquet or .feather 
+        books_list (BookList): the books to save 
+        format (str): forces a storage format instead of using the extension 
+        checkpoint (int): the last journal event the books include, stored 
+                          with them, see storage_utils.read_checkpoint 
     """ 
-    df = pd.DataFrame([vars(book) for book in books_list.books]) 
-    df.to_excel(filename, index = False)     
-    
-    
-
-
-
-
-
-
-
-
+    path = os.path.abspath(filename)
+    in_sync = books_list.source == path and os.path.exists(path)
+    if in_sync and not books_list.dirty and not books_list.removed: 
+        # the file is left untouched when nothing changed, see snapshot_utils.load_catalog
+        if checkpoint is not None and checkpoint != storage_utils.read_checkpoint(filename, format): 
+            storage_utils.write_checkpoint(filename, checkpoint, format)
+        return
+    if in_sync and storage_utils.get_format(filename, format) in storage_utils.INCREMENTAL_FORMATS: 
+        changed = [books_list.find_by_id(id)[0] for id in sorted(books_list.dirty)]
+        storage_utils.update_columns(filename, Book.to_columns(changed), 
+                                     books_list.removed, format, checkpoint)
+    else: 
+        storage_utils.write_columns(filename, Book.to_columns(books_list.books), format, 
+                                    checkpoint)
+    books_list.source = path
+    books_list.dirty.clear()
+    books_list.removed.clear()
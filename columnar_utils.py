@@ -0,0 +1,365 @@
+"""
+columnar_utils keeps the book catalog as columns instead of one Book object
+per row: NumPy arrays for id / rating / reviews and a categorical for genre.
+Queries run as vectorized operations, and Book objects are only created for
+the rows a query returns.
+
+Classes included: ColumnarBookList
+Functions included: load_columnar
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import os
+import weakref
+import numpy as np
+import pandas as pd
+from typing import Iterator, List
+import storage_utils
+from books_utils import (RATING_EVENTS, Book, CacheInfo, CommentIndex, QueryCache, paginate,
+                         sum_ratings, top_rows, unique_books, unique_columns, weighted_score)
+
+
+class ColumnarBookList(CommentIndex):
+    """ A drop-in replacement for books_utils.BookList backed by columns.
+
+    Attributes:
+        ids (np.ndarray): book ids, int64
+        names (np.ndarray): book names
+        authors (np.ndarray): book authors
+        ratings (np.ndarray): book ratings rounded to one decimal, float64
+        reviews (np.ndarray): number of reviews, int64
+        totals (np.ndarray): exact sums of the ratings, float64
+        genres (pd.Categorical): lowercased genres
+        intros (np.ndarray): book introductions
+        comments (np.ndarray): comments as json strings
+        source (str): the books file this list was last loaded from / saved to
+        dirty (set): ids of books added or changed since then
+        removed (set): ids of books removed since then
+        listeners (list): callables listener(book, event, args), called after
+                          an owned book changes
+        cache (QueryCache): recent query results, invalidated by versions and
+                            catalog_version like in BookList
+
+    Book objects handed out are cached by id and owned by this list, so
+    Book.change_rating on them is written back to the columns.
+    """
+
+    def __init__(self, books: List[Book], cache_size: int = 128):
+        """ Constructor of the ColumnarBookList object.
+
+        Args:
+            books (List[Book]): the books to store, they are kept as the
+                                cached objects for their rows, see
+                                unique_books for repeated ids
+            cache_size (int): the number of query results cached, 0 disables it
+        """
+        self._start_tracking(cache_size)
+        books = unique_books(books)
+        frame = pd.DataFrame(Book.to_columns(books))
+        self._set_columns(frame)
+        for book in books:
+            self._claim(book)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, cache_size: int = 128) -> 'ColumnarBookList':
+        """ Build a ColumnarBookList straight from a DataFrame with the
+            books.xlsx columns, without creating any Book object
+
+        Args:
+            df (pd.DataFrame): id, name, author, rating, reviews, genre,
+                               intro and comments columns, see unique_columns
+                               for repeated ids
+            cache_size (int): the number of query results cached
+        """
+        books_list = cls.__new__(cls)
+        books_list._start_tracking(cache_size)
+        books_list._set_columns(unique_columns(df))
+        return books_list
+
+    def _start_tracking(self, cache_size: int) -> None:
+        """ Set up the Book cache, the query cache and the change tracking
+            used by save_books """
+        self._cache = {}
+        self.source = None
+        self.dirty = set()
+        self.removed = set()
+        self.listeners = []
+        self.cache = QueryCache(cache_size)
+        self.versions = {}
+        self.catalog_version = 0
+        self._start_comment_index()
+
+    def _set_columns(self, df: pd.DataFrame) -> None:
+        """ Store the columns of df and rebuild the lookup structures """
+        self.ids = df['id'].to_numpy(dtype=np.int64)
+        self.names = df['name'].to_numpy(dtype=object)
+        self.authors = df['author'].to_numpy(dtype=object)
+        self.ratings = df['rating'].to_numpy(dtype=np.float64, copy=True)
+        self.reviews = df['reviews'].to_numpy(dtype=np.int64, copy=True)
+        self.totals = self.ratings * self.reviews
+        if 'total' in df:
+            # rows saved before the column existed have none
+            totals = pd.to_numeric(df['total']).to_numpy(dtype=np.float64)
+            known = ~np.isnan(totals)
+            self.totals[known] = totals[known]
+        self._genres = df['genre'].to_numpy(dtype=object)
+        self.genres = pd.Categorical(df['genre'].str.lower())
+        self.intros = df['intro'].to_numpy(dtype=object)
+        self.comments = df['comments'].to_numpy(dtype=object, copy=True)
+        self._lower_names = pd.Series(self.names, dtype=object).str.lower()
+        self._lower_authors = pd.Series(self.authors, dtype=object).str.lower()
+        self._rows = pd.Index(self.ids)
+        # the rows changed, every cached result is stale
+        for genre in set(self.versions).union(self.genres.categories):
+            self._bump(genre)
+        self.catalog_version += 1
+
+    def _bump(self, genre: str) -> None:
+        """ Invalidate the cached top_books of a lowercased genre """
+        self.versions[genre] = self.versions.get(genre, 0) + 1
+
+    def _frame(self) -> pd.DataFrame:
+        """ Return the columns as a DataFrame, comments of cached books
+            are taken from the Book objects """
+        comments = self.comments.copy()
+        for id, book in self._cache.items():
+            comments[self._rows.get_loc(id)] = book.comments_json
+        return pd.DataFrame({
+            'id': self.ids, 'name': self.names, 'author': self.authors,
+            'rating': self.ratings, 'reviews': self.reviews, 'genre': self._genres,
+            'intro': self.intros, 'comments': comments, 'total': self.totals})
+
+    def _claim(self, book: Book) -> Book:
+        """ Cache a book and take ownership of it, see Book._notify """
+        if book._owner is None or book._owner() is None:
+            book._owner = weakref.ref(self)
+        self._cache[book.id] = book
+        return book
+
+    def _book(self, row: int) -> Book:
+        """ Return the Book object for a row, creating it on first access """
+        id = int(self.ids[row])
+        book = self._cache.get(id)
+        if book is None:
+            book = self._claim(Book(id, self.names[row], self.authors[row],
+                                    float(self.ratings[row]), int(self.reviews[row]),
+                                    self._genres[row], self.intros[row],
+                                    self.comments[row]))
+            book.total = float(self.totals[row])
+        return book
+
+    def _book_changed(self, book: Book, event: str, args: tuple) -> None:
+        """ Called by an owned book after it changes, see Book._notify """
+        self.dirty.add(book.id)
+        self._index_comment(book, event, args)
+        if event in RATING_EVENTS:
+            row = self._rows.get_loc(book.id)
+            self.ratings[row] = book.rating
+            self.reviews[row] = book.reviews
+            self.totals[row] = book.total
+            self._bump(self.genres[row])
+        for listener in self.listeners:
+            listener(book, event, args)
+
+    @property
+    def books(self) -> List[Book]:
+        """ All books as Book objects, in list order """
+        return [self._book(row) for row in range(len(self.ids))]
+
+    def text_column(self, field: str) -> List[str]:
+        """ Return the names or the authors of every row, without creating
+            Book objects, see search_utils.SearchEngine
+
+        Args:
+            field (str): "name" or "author"
+        """
+        return {'name': self.names, 'author': self.authors}[field].tolist()
+
+    @property
+    def scores(self) -> np.ndarray:
+        """ Book.score for every row, computed in one vectorized pass """
+        return weighted_score(self.ratings, self.reviews)
+
+    def add_book(self, book: Book) -> None:
+        """ Add a book to the end of the columns
+
+        Args:
+            book (Book): the book to add, its id must not be in the list yet
+        """
+        if book.id in self._rows:
+            raise ValueError(f"Book {book.id} is already in the list")
+        frame = pd.concat([self._frame(), pd.DataFrame([{
+            'id': book.id, 'name': book.name, 'author': book.author,
+            'rating': book.rating, 'reviews': book.reviews, 'genre': book.genre,
+            'intro': book.intro, 'comments': book.comments_json, 'total': book.total}])],
+            ignore_index=True)
+        self._set_columns(frame)
+        self._claim(book)
+        self._index_comments(book, True)
+        self.dirty.add(book.id)
+        self.removed.discard(book.id)
+
+    def remove_book(self, id: int) -> Book:
+        """ Remove a book from the columns
+
+        Args:
+            id (int): unique book id
+
+        Return:
+            book (Book): the removed book
+        """
+        book = self._book(self._rows.get_loc(int(id)))
+        frame = self._frame()
+        self._set_columns(frame[frame['id'] != book.id].reset_index(drop=True))
+        del self._cache[book.id]
+        self._index_comments(book, False)
+        self.dirty.discard(book.id)
+        self.removed.add(book.id)
+        if book._owner is not None and book._owner() is self:
+            book._owner = None
+        return book
+
+    def apply_ratings(self, ratings, chunk_size: int = 1_000_000) -> int:
+        """ Apply many ratings at once, the columns are updated with vectorized
+            sums, Book objects only for the rows that have one
+
+        Args:
+            ratings: an array of shape (n, 2) or any iterable of (book id, rate) pairs
+            chunk_size (int): pairs read from an iterable at a time
+
+        Return:
+            count (int): the number of ratings applied, pairs with an unknown
+                         book id are skipped
+        """
+        applied = 0
+        for ids, totals, counts in sum_ratings(ratings, chunk_size):
+            rows = self._rows.get_indexer(ids)
+            known = rows >= 0
+            rows, totals, counts = rows[known], totals[known], counts[known]
+            self.totals[rows] += totals
+            self.reviews[rows] += counts
+            # python round, like Book.rating
+            self.ratings[rows] = [round(mean, 1) for mean in
+                                  (self.totals[rows] / self.reviews[rows]).tolist()]
+            self.dirty.update(self.ids[rows].tolist())
+            for genre in set(self.genres[rows]):
+                self._bump(genre)
+            applied += int(counts.sum())
+            for row, total, count in zip(rows.tolist(), totals.tolist(), counts.tolist()):
+                book = self._cache.get(int(self.ids[row]))
+                if book is not None:
+                    book.total = float(self.totals[row])
+                    book.reviews = int(self.reviews[row])
+                    book.rating = float(self.ratings[row])
+                if self.listeners:
+                    book = self._book(row)
+                    for listener in self.listeners:
+                        listener(book, 'ratings', (total, count))
+        return applied
+
+    def top_books(self, genre: str, rank: int = 10, scorer=None) -> List[Book]:
+        """ Return a recommend list of top books in a genre, rank books by scores
+            selected with top_rows
+
+        Args:
+            genre (str): Fiction/Non Fiction
+            rank (int): top X books, defaults to top 10
+            scorer: a scorer such as bayesian_score, defaults to Book.score
+
+        Return:
+             board (List[Book]): A list of book objects
+        """
+        genre = genre.lower()
+
+        def compute() -> List[Book]:
+            if genre not in self.genres.categories:
+                return []
+            code = self.genres.categories.get_loc(genre)
+            rows = np.flatnonzero(self.genres.codes == code)
+            scores = (scorer or weighted_score)(self.ratings[rows], self.reviews[rows])
+            # highest score first, ties in list order like a stable sort
+            return [self._book(row) for row in rows[top_rows(scores, rank)]]
+        return self.cache.get(('top', genre, rank, scorer), self.versions.get(genre, 0), compute)
+
+    def find_by_id(self, id: str) -> List[Book]:
+        """ Search books by id
+
+        Args:
+            id (int): unique book id
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        rows = self._rows.get_indexer([int(id)])
+        return [self._book(row) for row in rows if row >= 0]
+
+    def iter_by_name(self, short_name: str) -> Iterator[Book]:
+        """ Search books by short name, matching runs vectorized over all rows
+            and Book objects are created as the results are read
+
+        Args:
+            short name (str): short name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        mask = self._lower_names.str.contains(short_name.lower(), regex=False)
+        return (self._book(row) for row in np.flatnonzero(mask.to_numpy()))
+
+    def iter_by_author(self, author: str) -> Iterator[Book]:
+        """ Search books by author name, see iter_by_name
+
+        Args:
+            author (str): short author name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        mask = self._lower_authors.str.contains(author.lower(), regex=False)
+        return (self._book(row) for row in np.flatnonzero(mask.to_numpy()))
+
+    def find_by_name(self, short_name: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by short name
+
+        Args:
+            short name (str): short name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('name', short_name.lower(), limit, offset), self.catalog_version,
+                              lambda: paginate(self.iter_by_name(short_name), limit, offset))
+
+    def find_by_author(self, author: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by author name
+
+        Args:
+            author (str): short author name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('author', author.lower(), limit, offset), self.catalog_version,
+                              lambda: paginate(self.iter_by_author(author), limit, offset))
+
+    def cache_info(self) -> CacheInfo:
+        """ Return the statistics of the query cache, see QueryCache """
+        return self.cache.info()
+
+
+def load_columnar(filename: str, format: str = None) -> ColumnarBookList:
+    """ Read the file specified by filename, and return a ColumnarBookList object.
+
+    Args:
+        filename (str): a books file name, see storage_utils.FORMATS
+        format (str): forces a storage format instead of using the extension
+    """
+    df = pd.DataFrame(storage_utils.read_columns(filename, format))
+    books_list = ColumnarBookList.from_frame(df)
+    books_list.source = os.path.abspath(filename)
+    return books_list
@@ -4,20 +4,42 @@ Semester: Spring 23
 
 A file to test every function and class
 """
-from books_utils import Book, BookList, BookShelf, load_books, save_books
-from users_utils import User
+import books_utils
+from books_utils import (Book, BookList, BookShelf, bayesian_score, load_books, parse_rate,
+                         save_books, top_k, top_rows, weighted_score)
+from columnar_utils import ColumnarBookList, load_columnar
+from journal_utils import Journal
+import metrics_utils
+from recommend_utils import Recommender
+from search_utils import SearchEngine, edit_distance, tokenize
+from shard_utils import ShardedBookList, load_sharded
+from snapshot_utils import SnapshotBookList, load_catalog, load_snapshot, write_snapshot
+from users_utils import User, UserStore
 from io import StringIO
+import http.client
+import functools
+import importlib.util
+import json
+import os
+import server
+import storage_utils
+import tempfile
+import threading
 from unittest.mock import patch
 import sys
 import view
 import run
 import unittest
+import numpy as np
 import pandas as pd
 
 
 class Test_books_utils(unittest.TestCase):
     """ Test all functions in books_utils """
 
+    # the BookList implementation under test
+    booklist = BookList
+
     def test_Book_init(self):
         """ Test Book.__init__  with 
              id: 1 
@@ -40,6 +62,17 @@ class Test_books_utils(unittest.TestCase):
         # json_load
         self.assertEqual(case.comments, {'sophie': '5 test'})
 
+    def test_Book_from_columns(self):
+        """ Test Book.from_columns with a dict of two rows """
+        columns = {'id': [1, 2], 'name': ['book1', 'book2'], 'author': ['any', 'any'],
+                   'rating': [5, 4.5], 'reviews': [10, 2], 'genre': ['Fiction', 'Fiction'],
+                   'intro': ['', 'test'], 'comments': ['{}', '{"sophie": "5 test"}']}
+        case = Book.from_columns(pd.DataFrame(columns))
+        self.assertEqual(len(case), 2)
+        self.assertIs(type(case[0].id), int)
+        self.assertEqual(str(case[1]), "Id: 2 Name: book2\nAuthor: any\nRating: 4.5  Reviews: 2")
+        self.assertEqual(case[1].comments, {'sophie': '5 test'})
+
     def test_Book_score(self):
         """ Test Book.score """
         case = Book(1, 'book1', 'any', 5, 10, 'Fiction')
@@ -57,6 +90,27 @@ class Test_books_utils(unittest.TestCase):
         case.add_comment("sophie", "5", "test")
         self.assertAlmostEqual(case.comments, {'sophie': '5 test'})
 
+    def test_Book_comments_json(self):
+        """ Test Book.comments decoding and Book.comments_json """
+        raw = '{"sophie": "5 it\'s a test"}'
+        case = Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test', raw)
+        self.assertIsNone(case._comments)
+        self.assertEqual(case.comments, {'sophie': "5 it's a test"})
+        self.assertIs(case.comments_json, raw)
+        case.add_comment("amy", "4", "nice")
+        self.assertEqual(case.comments_json, raw[:-1] + ', "amy": "4 nice"}')
+        # str(dict) written by older versions
+        legacy = Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test', "{'sophie': '5 test'}")
+        self.assertEqual(legacy.comments, {'sophie': '5 test'})
+
+    def test_Book_to_dict(self):
+        """ Test Book.to_dict, books have no __dict__ for vars() """
+        case = Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test', '{"sophie": "5 test"}')
+        self.assertFalse(hasattr(case, '__dict__'))
+        expect = {'id': 1, 'name': 'book1', 'author': 'any', 'rating': 5, 'reviews': 10,
+                  'genre': 'Fiction', 'intro': 'test', 'comments': '{"sophie": "5 test"}'}
+        self.assertEqual(case.to_dict(), expect)
+
     def test_Book_str(self):
         """ Test Book.__str__ """
         case = Book(1, 'book1', 'any', 5, 10, 'Fiction')
@@ -79,7 +133,7 @@ class Test_books_utils(unittest.TestCase):
                           4.8, 30, 'Non Fiction', 'test')
         self.items = [self.book1, self.book2, self.book3,
                       self.book4, self.book5, self.book6]
-        self.sample = BookList(self.items)
+        self.sample = self.booklist(self.items)
 
     def test_BookList_init(self):
         """ Test BookList.__init__  with self.sample """
@@ -92,6 +146,116 @@ class Test_books_utils(unittest.TestCase):
         board = self.sample.top_books("fiction", 3)
         expect = [self.book4, self.book3, self.book5]
         self.assertEqual(board, expect)
+        for scorer in (None, bayesian_score):
+            self.assertEqual(self.sample.top_books("fiction", -1, scorer), [])
+
+    def test_BookList_top_books_scorer(self):
+        """ Test BookList.top_books with a scorer, any rank, ties in list order """
+        self.assertEqual(self.sample.top_books("fiction", 3, weighted_score),
+                         self.sample.top_books("fiction", 3))
+        self.assertEqual(self.sample.top_books("fiction", 3, bayesian_score),
+                         [self.book5, self.book4, self.book3])
+        self.assertEqual(self.sample.top_books("fiction", 100, bayesian_score),
+                         [self.book5, self.book4, self.book3])
+        self.assertEqual(self.sample.top_books("fiction", 0, bayesian_score), [])
+        for _ in range(40):
+            self.book3.change_rating(5)
+        self.assertEqual(self.sample.top_books("fiction", 1, bayesian_score), [self.book3])
+        ties = [Book(id, 'tie', 'any', 4.0, 10, 'Fiction') for id in (15, 13, 19)]
+        self.assertEqual(self.booklist(ties).top_books("fiction", 2, bayesian_score), ties[:2])
+        self.assertEqual(self.booklist(ties).top_books("fiction", 3), ties)
+
+    def test_top_k(self):
+        """ Test top_k and top_rows select like a stable sort """
+        self.assertEqual(top_k(self.items, 2), [self.book1, self.book4])
+        self.assertEqual(top_k(self.items, 3, bayesian_score), [self.book1, self.book6, self.book5])
+        self.assertEqual(top_k(self.items, -1), [])
+        rng = np.random.default_rng(0)
+        for k in (0, 1, 5, 50, 200):
+            scores = rng.integers(0, 20, 100).astype(float)
+            expect = sorted(range(100), key=lambda row: -scores[row])[: k]
+            self.assertEqual(top_rows(scores, k).tolist(), expect)
+
+    def test_BookList_top_books_update(self):
+        """ Test BookList.top_books after Book.change_rating,
+            search results do not take over the books
+        """
+        BookList([self.book5])
+        for _ in range(13):
+            self.book5.change_rating(5)
+        self.assertEqual(self.book5.reviews, 30)
+        board = self.sample.top_books("Fiction")
+        self.assertEqual(board, [self.book4, self.book5, self.book3])
+        self.book3.change_rating(5)
+        self.book3.change_rating(5)
+        board = self.sample.top_books("Fiction", 3)
+        self.assertEqual(board, [self.book4, self.book3, self.book5])
+
+    def test_BookList_cache(self):
+        """ Test the query cache: repeated queries are hits, a rating only
+            invalidates its genre, a comment nothing, a new book everything
+        """
+        self.assertEqual(self.sample.top_books("fiction", 3), [self.book4, self.book3, self.book5])
+        self.assertEqual(self.sample.top_books("Fiction", 3), [self.book4, self.book3, self.book5])
+        self.sample.top_books("non fiction", 3)
+        self.sample.find_by_author("collins")
+        self.assertEqual(self.sample.find_by_author("Collins"), [self.book4, self.book5])
+        self.assertEqual(tuple(self.sample.cache_info()), (2, 3, 128, 3))
+        self.book3.change_rating(5)
+        self.book3.change_rating(5)
+        self.book1.add_comment('sophie', '5', 'great')
+        self.assertEqual(self.sample.top_books("fiction", 3), [self.book4, self.book3, self.book5])
+        self.sample.top_books("non fiction", 3)
+        self.sample.find_by_author("collins")
+        self.assertEqual(tuple(self.sample.cache_info()), (4, 4, 128, 3))
+        book = Book(7, 'Catching Fire', 'Suzanne Collins', 5.0, 100, 'Fiction', 'test')
+        self.sample.add_book(book)
+        self.assertEqual(self.sample.find_by_author("collins"), [self.book4, self.book5, book])
+        self.assertEqual(self.sample.top_books("fiction", 1), [book])
+        self.sample.remove_book(7)
+        self.assertEqual(self.sample.top_books("fiction", 1), [self.book4])
+        # results are copies, and a size of 0 turns the cache off
+        self.sample.top_books("fiction").clear()
+        self.assertEqual(len(self.sample.top_books("fiction")), 3)
+        uncached = self.booklist([Book(8, 'Becoming', 'Michelle Obama', 4.8, 62, 'Fiction', 'test')],
+                                 cache_size=0)
+        uncached.top_books("fiction")
+        self.assertEqual(tuple(uncached.cache_info()), (0, 1, 0, 0))
+
+    def test_BookList_comments_by_user(self):
+        """ Test the user -> books index follows new, removed and deleted
+            comments, and the books added to and removed from the list
+        """
+        self.book3.add_comment('sophie', '5', 'great')
+        self.book1.add_comment('sophie', '', 'not rated')
+        self.assertEqual(self.sample.books_commented_by('sophie'), [self.book1, self.book3])
+        self.book4.add_comment('sophie', '2', 'too long')
+        self.book4.add_comment('tianzi', '4', 'fun')
+        self.assertEqual(self.sample.comments_by_user('sophie'),
+                         {1: ' not rated', 3: '5 great', 4: '2 too long'})
+        self.assertEqual(self.sample.average_rate('sophie'), 3.5)
+        self.assertEqual(self.sample.average_rate('nobody'), None)
+        book = Book(7, 'Catching Fire', 'Suzanne Collins', 5.0, 100, 'Fiction', 'test',
+                    '{"sophie": "4 ok"}')
+        self.sample.add_book(book)
+        self.assertEqual(self.sample.comments_by_user('sophie')[7], '4 ok')
+        self.sample.remove_book(7)
+        self.assertEqual(self.sample.remove_user_comments('sophie'), 3)
+        self.assertEqual(self.sample.comments_by_user('sophie'), {})
+        self.assertEqual(self.book4.comments, {'tianzi': '4 fun'})
+        self.assertEqual(self.book3.comments, {})
+        self.assertEqual(self.sample.dirty, {1, 3, 4})
+
+    def test_BookList_apply_ratings(self):
+        """ Test BookList.apply_ratings with a stream and an array of pairs """
+        ratings = ((3, 5 - i % 2) for i in range(1000))
+        self.assertEqual(self.sample.apply_ratings(iter([(9, 5)] + list(ratings)), 64), 1000)
+        self.assertEqual(self.book3.reviews, 1030)
+        self.assertAlmostEqual(self.book3.total, 4.3 * 30 + 4500)
+        self.assertEqual(self.book3.rating, 4.5)
+        self.assertEqual(self.sample.top_books('fiction', 1), [self.book3])
+        self.assertEqual(self.sample.apply_ratings(np.array([[2, 1], [2, 2]])), 2)
+        self.assertEqual(self.sample.find_by_id(2)[0].reviews, 31)
 
     def test_BookList_find_by_id(self):
         """ Test BookList.find_by_id with  
@@ -100,6 +264,35 @@ class Test_books_utils(unittest.TestCase):
         result = self.sample.find_by_id('1')
         expect = [self.book1]
         self.assertEqual(result, expect)
+        self.assertEqual(self.sample.find_by_id(7), [])
+
+    def test_BookList_add_book(self):
+        """ Test BookList.add_book with a new book id: 7 """
+        book7 = Book(7, 'Wonder', 'R. J. Palacio', 4.8, 21, 'Fiction')
+        self.sample.add_book(book7)
+        self.assertEqual(self.sample.books[-1], book7)
+        self.assertEqual(self.sample.find_by_id('7'), [book7])
+
+    def test_BookList_duplicate_ids(self):
+        """ Test a repeated id keeps its first position and its last book,
+            and add_book rejects an id already in the list
+        """
+        again = Book(1, 'Becoming', 'Michelle Obama', 4.0, 10, 'Non Fiction')
+        books_list = self.booklist([self.book1, self.book2, again])
+        self.assertEqual(books_list.books, [again, self.book2])
+        self.assertEqual(books_list.top_books("non fiction"), [self.book2, again])
+        with self.assertRaises(ValueError):
+            self.sample.add_book(Book(2, 'Educated', 'Tara Westover', 4.7, 29, 'Non Fiction'))
+        self.assertEqual(len(self.sample.books), 6)
+        self.sample.remove_book(2)
+        self.assertEqual(self.sample.find_by_id(2), [])
+
+    def test_BookList_remove_book(self):
+        """ Test BookList.remove_book with id: 1 """
+        book = self.sample.remove_book(1)
+        self.assertEqual(book, self.book1)
+        self.assertEqual(len(self.sample.books), 5)
+        self.assertEqual(self.sample.find_by_id('1'), [])
 
     def test_BookList_find_by_name(self):
         """ Test BookList.find_by_name with  
@@ -117,6 +310,29 @@ class Test_books_utils(unittest.TestCase):
         expect = [self.book4, self.book5]
         self.assertEqual(result, expect)
 
+    def test_BookList_pagination(self):
+        """ Test BookList.iter_by_* and the limit / offset of find_by_* """
+        result = self.sample.iter_by_author('s')
+        self.assertEqual(next(result), self.book2)
+        self.assertEqual(next(result), self.book4)
+        self.assertEqual(self.sample.find_by_name('e', limit=2), [self.book1, self.book2])
+        self.assertEqual(self.sample.find_by_name('e', 2, 4), [self.book5, self.book6])
+        self.assertEqual(self.sample.find_by_author('collins', offset=1), [self.book5])
+
+    def test_BookList_search_index(self):
+        """ Test the n-gram index with short queries, misses and
+            books added / removed after construction
+        """
+        self.assertEqual(self.sample.find_by_name('Br'), [self.book6])
+        self.assertEqual(self.sample.find_by_name('hunger gamez'), [])
+        book7 = Book(7, 'Catching Fire (The Hunger Games)',
+                     'Suzanne Collins', 4.8, 20, 'Fiction')
+        self.sample.add_book(book7)
+        self.sample.remove_book(4)
+        result = self.sample.find_by_name('HUNGER game')
+        self.assertEqual(result, [self.book5, book7])
+        self.assertEqual(self.sample.find_by_author('collins'), [self.book5, book7])
+
     def test_BookShelf_init(self):
         """ Test BookShelf.__init__ with name: test """
         case = BookShelf('test')
@@ -153,6 +369,735 @@ class Test_books_utils(unittest.TestCase):
         self.assertEqual(diff.shape[0], 0)
 
 
+class Test_columnar_utils(Test_books_utils):
+    """ Run the books_utils tests against ColumnarBookList """
+
+    booklist = ColumnarBookList
+
+    def test_load_columnar(self):
+        """ Test load_columnar with test_file.xlsx """
+        data = load_columnar('data/test_file.xlsx')
+        self.assertEqual(len(data.books), len(self.items))
+        for book, expect in zip(data.books, self.items):
+            self.assertEqual(str(book), str(expect))
+        board = data.top_books("fiction", 3)
+        self.assertEqual([book.id for book in board], [4, 3, 5])
+        self.assertIs(data.find_by_id(4)[0], board[0])
+
+    def test_ColumnarBookList_change_rating(self):
+        """ Test Book.change_rating is written back to the columns """
+        self.book3.change_rating(5)
+        self.assertEqual(self.sample.reviews[2], 31)
+        self.assertEqual(self.sample.ratings[2], self.book3.rating)
+
+
+class Test_shard_utils(Test_books_utils):
+    """ Run the books_utils tests against ShardedBookList """
+
+    booklist = functools.partial(ShardedBookList, shards=2)
+
+    def tearDown(self):
+        self.sample.close()
+
+    def test_load_sharded(self):
+        """ Test load_sharded with test_file.xlsx, changes of books that were
+            not handed out before go to their shard """
+        data = load_sharded('data/test_file.xlsx', shards=3)
+        try:
+            self.assertEqual([str(book) for book in data.books], [str(book) for book in self.items])
+            self.assertEqual(data.source, os.path.abspath('data/test_file.xlsx'))
+            self.assertEqual([book.id for book in data.top_books('fiction', 3)], [4, 3, 5])
+            self.assertEqual([book.id for book in data.find_by_name('e', 2, 2)], [3, 4])
+        finally:
+            data.close()
+        data = load_sharded('data/test_file.xlsx', shards=3)
+        try:
+            book = data.find_by_id(3)[0]
+            for _ in range(20):
+                book.change_rating(5)
+            self.assertEqual([book.id for book in data.top_books('fiction', 1)], [3])
+            self.assertEqual(data.remove_book(3).reviews, 50)
+            with self.assertRaises(KeyError):
+                data.remove_book(3)
+            self.assertEqual(data.apply_ratings([(4, 5), (3, 5)]), 1)
+            self.assertEqual(data.dirty, {4})
+        finally:
+            data.close()
+
+
+class Test_snapshot_utils(unittest.TestCase):
+    """ Test all functions in snapshot_utils """
+
+    def setUp(self):
+        """ Compile test_file.xlsx into a temporary snapshot """
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'books.snapshot')
+        self.books_list = load_books('data/test_file.xlsx')
+        write_snapshot(self.filename, self.books_list)
+        self.snapshot = load_snapshot(self.filename)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_write_load_snapshot(self):
+        """ Test a snapshot holds the same books and answers like a BookList """
+        self.assertEqual([book.to_dict() for book in self.snapshot.books],
+                         [book.to_dict() for book in self.books_list.books])
+        self.assertEqual(self.snapshot.source, os.path.abspath('data/test_file.xlsx'))
+        for name in ('hunger', 'E', ''):
+            self.assertEqual([book.id for book in self.snapshot.find_by_name(name)],
+                             [book.id for book in self.books_list.find_by_name(name)])
+        self.assertEqual([book.id for book in self.snapshot.find_by_author('collins', 1, 1)], [5])
+        self.assertEqual([book.id for book in self.snapshot.top_books('Fiction', 3)], [4, 3, 5])
+        self.assertIs(self.snapshot.find_by_id(4)[0], self.snapshot.top_books('fiction')[0])
+        self.assertEqual(self.snapshot.find_by_id(9), [])
+        self.assertFalse(self.snapshot.ratings.flags.writeable)
+        with self.assertRaises(TypeError):
+            self.snapshot.remove_book(1)
+
+    def test_SnapshotBookList_change_rating(self):
+        """ Test ratings change in memory, the file stays as it was """
+        book = self.snapshot.find_by_id(3)[0]
+        for _ in range(20):
+            book.change_rating(5)
+        self.assertEqual(self.snapshot.reviews[2], 50)
+        self.assertEqual([book.id for book in self.snapshot.top_books('fiction', 1)], [3])
+        self.assertEqual(self.snapshot.apply_ratings(np.array([[4, 5], [9, 5]])), 1)
+        self.assertEqual(self.snapshot.find_by_id(4)[0].reviews, 34)
+        self.assertEqual(self.snapshot.dirty, {3, 4})
+        self.assertEqual(load_snapshot(self.filename).reviews[2], 30)
+        save_books(os.path.join(self.folder.name, 'books.sqlite'), self.snapshot)
+        self.assertEqual(load_books(os.path.join(self.folder.name, 'books.sqlite'))
+                         .find_by_id(3)[0].reviews, 50)
+
+    def test_load_catalog(self):
+        """ Test load_catalog uses the snapshot only while it is up to date """
+        books_file = os.path.join(self.folder.name, 'books.sqlite')
+        snapshot_file = books_file + '.snapshot'
+        save_books(books_file, self.books_list)
+        self.assertIsInstance(load_catalog(books_file, snapshot_file), BookList)
+        self.assertIsInstance(load_catalog(books_file, snapshot_file), SnapshotBookList)
+        future = os.path.getmtime(snapshot_file) + 10
+        os.utime(books_file, (future, future))
+        self.assertIsInstance(load_catalog(books_file, snapshot_file), BookList)
+        os.utime(books_file, (future - 20, future - 20))
+        # sessions compact the journal into the books file on every exit, a
+        # checkpoint is compared instead of the time
+        journal = Journal(os.path.join(self.folder.name, 'journal.jsonl'))
+        for _ in range(3):
+            books_list = load_catalog(books_file, snapshot_file)
+            self.assertIsInstance(books_list, SnapshotBookList)
+            journal.replay(books_list)
+            journal.compact(books_list, books_file)
+        journal.attach(books_list)
+        books_list.find_by_id(1)[0].change_rating(1)
+        journal.compact(books_list, books_file)
+        journal.close()
+        books_list = load_catalog(books_file, snapshot_file)
+        self.assertIsInstance(books_list, BookList)
+        self.assertEqual(books_list.find_by_id(1)[0].reviews, self.books_list.find_by_id(1)[0].reviews + 1)
+        books_list = load_catalog(books_file, snapshot_file)
+        self.assertIsInstance(books_list, SnapshotBookList)
+        self.assertEqual(books_list.checkpoint, 1)
+
+
+class Test_storage_utils(unittest.TestCase):
+    """ Test all functions in storage_utils """
+
+    def setUp(self):
+        """ Read test_file.xlsx and make a temporary folder """
+        self.columns = storage_utils.read_columns('data/test_file.xlsx')
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_get_format(self):
+        """ Test storage_utils.get_format by extension and by option """
+        self.assertEqual(storage_utils.get_format('books.XLSX'), 'xlsx')
+        self.assertEqual(storage_utils.get_format('books.db'), 'sqlite')
+        self.assertEqual(storage_utils.get_format('books.bin', 'feather'), 'feather')
+        with self.assertRaises(ValueError):
+            storage_utils.get_format('books.csv')
+
+    def test_read_columns(self):
+        """ Test storage_utils.read_columns with test_file.xlsx """
+        self.assertEqual(list(self.columns), storage_utils.COLUMNS)
+        self.assertEqual(self.columns['id'], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.columns['name'][5], 'Unbroken')
+
+    def test_write_columns(self):
+        """ Test a round trip through every format that can run here """
+        formats = ['sqlite', 'xlsx']
+        if importlib.util.find_spec('pyarrow'):
+            formats += ['parquet', 'feather']
+        for format in formats:
+            filename = os.path.join(self.folder.name, f"books.{format}")
+            storage_utils.write_columns(filename, self.columns)
+            self.assertEqual(storage_utils.read_columns(filename), self.columns)
+
+    def test_total_column(self):
+        """ Test Book.total is saved exactly, and files without the column
+            get it when they are next updated """
+        filename = os.path.join(self.folder.name, 'books.sqlite')
+        storage_utils.write_columns(filename, self.columns)
+        self.assertNotIn('total', storage_utils.read_columns(filename))
+        books_list = load_books(filename)
+        for rate in (5, 5, 4):
+            books_list.find_by_id(1)[0].change_rating(rate)
+        total = books_list.find_by_id(1)[0].total
+        save_books(filename, books_list)
+        columns = storage_utils.read_columns(filename)
+        self.assertEqual(columns['total'][:2], [total, None])
+        self.assertEqual(load_books(filename).find_by_id(1)[0].total, total)
+        self.assertEqual(load_books(filename).find_by_id(2)[0].total, 4.7 * 29)
+        xlsx = os.path.join(self.folder.name, 'books.xlsx')
+        save_books(xlsx, books_list)
+        self.assertEqual(list(storage_utils.read_columns(xlsx)), storage_utils.COLUMNS)
+
+    def test_checkpoint(self):
+        """ Test the checkpoint is stored with the rows, in the file or next to it """
+        for format in ('sqlite', 'xlsx'):
+            filename = os.path.join(self.folder.name, f"books.{format}")
+            self.assertEqual(storage_utils.read_checkpoint(filename), 0)
+            storage_utils.write_columns(filename, self.columns, checkpoint=5)
+            self.assertEqual(storage_utils.read_checkpoint(filename), 5)
+            storage_utils.write_checkpoint(filename, 7)
+            self.assertEqual(storage_utils.read_checkpoint(filename), 7)
+            storage_utils.write_columns(filename, self.columns)
+            self.assertEqual(storage_utils.read_checkpoint(filename), 0)
+
+    def test_load_save_sqlite(self):
+        """ Test load_books / save_books with an .sqlite file """
+        filename = os.path.join(self.folder.name, 'books.sqlite')
+        save_books(filename, load_books('data/test_file.xlsx'))
+        data = load_books(filename)
+        self.assertEqual(str(data.find_by_id(4)[0]),
+                         "Id: 4 Name: The Hunger Games (Book 1)\n"
+                         "Author: Suzanne Collins\nRating: 4.7  Reviews: 33")
+
+
+    def test_pack_columns(self):
+        """ Test columns survive pack_columns / unpack_columns, including values
+            that cannot be packed """
+        packed = storage_utils.pack_columns(self.columns)
+        self.assertIsInstance(packed['name'], tuple)
+        self.assertEqual(storage_utils.unpack_columns(packed), self.columns)
+        odd = {'id': [], 'name': ['a\x00b', 'c'], 'reviews': [1, None], 'intro': ['']}
+        self.assertEqual(storage_utils.unpack_columns(storage_utils.pack_columns(odd)), odd)
+
+    def test_unique_columns(self):
+        """ Test every loader keeps one book per id of a file with a repeated
+            id, its first position and its last row """
+        columns = {name: values + values[:1] for name, values in self.columns.items()}
+        columns['rating'][-1] = 1.0
+        self.assertEqual(books_utils.unique_columns(columns)['rating'][0], 1.0)
+        # SQLite files cannot repeat an id
+        filename = os.path.join(self.folder.name, 'books.xlsx')
+        storage_utils.write_columns(filename, columns)
+        for loader in (load_books, load_columnar, functools.partial(load_sharded, shards=2)):
+            data = loader(filename)
+            self.assertEqual([book.id for book in data.books], [1, 2, 3, 4, 5, 6])
+            self.assertEqual(data.find_by_id(1)[0].rating, 1.0)
+            self.assertEqual(sorted(book.id for book in data.top_books('non fiction')), [1, 2, 6])
+            if hasattr(data, 'close'):
+                data.close()
+
+    def test_load_books_shards(self):
+        """ Test load_books merges shards from a pattern or a list, the last
+            shard of an id wins """
+        for i, rows in enumerate([slice(0, 2), slice(2, 4), slice(3, 6)]):
+            shard = {name: values[rows] for name, values in self.columns.items()}
+            if i == 2:
+                shard['rating'][0] = 1.0
+            storage_utils.write_columns(os.path.join(self.folder.name, f"books_{i}.sqlite"), shard)
+        pattern = os.path.join(self.folder.name, 'books_*.sqlite')
+        for data in (load_books(pattern, workers=2),
+                     load_books(storage_utils.find_shards(pattern), workers=1)):
+            self.assertEqual([book.id for book in data.books], [1, 2, 3, 4, 5, 6])
+            self.assertEqual(data.find_by_id(4)[0].rating, 1.0)
+            self.assertEqual([book.id for book in data.top_books('fiction')], [3, 4, 5])
+            self.assertIsNone(data.source)
+        # run.py loads the catalog in a thread, whose workers are not forked
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(
+            method=storage_utils.worker_context().get_start_method(),
+            data=load_books(pattern, workers=2)))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(result['method'], 'fork')
+        self.assertEqual([book.id for book in result['data'].books], [1, 2, 3, 4, 5, 6])
+        with self.assertRaises(FileNotFoundError):
+            load_books(os.path.join(self.folder.name, 'none_*.xlsx'))
+
+    def test_save_books_incremental(self):
+        """ Test save_books only writes the books changed since loading """
+        filename = os.path.join(self.folder.name, 'books.sqlite')
+        save_books(filename, load_books('data/test_file.xlsx'))
+        data = load_books(filename)
+        with patch('storage_utils.write_columns') as write:
+            save_books(filename, data)
+            data.find_by_id(2)[0].change_rating(1)
+            data.remove_book(6)
+            data.add_book(Book(7, 'Wonder', 'R. J. Palacio', 4.8, 21, 'Fiction'))
+            self.assertEqual(data.dirty, {2, 7})
+            save_books(filename, data)
+            write.assert_not_called()
+        self.assertEqual(len(data.dirty), 0)
+        result = load_books(filename)
+        self.assertEqual([book.id for book in result.books], [1, 2, 3, 4, 5, 7])
+        self.assertEqual(result.find_by_id(2)[0].reviews, 30)
+
+class Test_journal_utils(unittest.TestCase):
+    """ Test all functions in journal_utils """
+
+    def setUp(self):
+        """ Copy test_file.xlsx to a temporary sqlite books file """
+        self.folder = tempfile.TemporaryDirectory()
+        self.books_file = os.path.join(self.folder.name, 'books.sqlite')
+        self.filename = self.books_file + '.journal'
+        save_books(self.books_file, load_books('data/test_file.xlsx'))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_Journal_record_replay(self):
+        """ Test events journaled in a session that crashed are replayed """
+        books_list = load_books(self.books_file)
+        shelf = BookShelf('sophie')
+        journal = Journal(self.filename)
+        journal.attach(books_list, shelf)
+        book = books_list.find_by_id(1)[0]
+        book.change_rating(1)
+        book.add_comment('sophie', '1', 'not for me')
+        books_list.find_by_id(3)[0].add_comment('sophie', '5', 'great')
+        books_list.remove_user_comments('sophie')
+        book.add_comment('sophie', '1', 'not for me')
+        shelf.add_collect(books_list.find_by_id(2)[0])
+        journal.close()
+        with open(self.filename, 'a') as file:
+            file.write('{"event": "rate", "id"')
+
+        books_list = load_books(self.books_file)
+        shelf = BookShelf('sophie')
+        journal = Journal(self.filename)
+        self.assertEqual(journal.replay(books_list, shelf), 7)
+        self.assertEqual(books_list.find_by_id(3)[0].comments, {})
+        book = books_list.find_by_id(1)[0]
+        self.assertEqual(book.reviews, 63)
+        self.assertEqual(book.comments, {'sophie': '1 not for me'})
+        self.assertEqual(shelf.collects, {2: 'Educated: A Memoir'})
+
+        journal.compact(books_list, self.books_file)
+        journal.close()
+        self.assertEqual(load_books(self.books_file).find_by_id(1)[0].reviews, 63)
+        # the bookshelf is kept by UserStore, collects are dropped too
+        with open(self.filename) as file:
+            self.assertEqual(file.readlines(), [])
+
+    def test_Journal_checkpoint(self):
+        """ Test events saved before a crash skipped the truncation are not
+            applied twice, and numbers go on after the journal is emptied
+        """
+        books_list = load_books(self.books_file)
+        journal = Journal(self.filename)
+        journal.attach(books_list)
+        books_list.find_by_id(1)[0].change_rating(1)
+        books_list.find_by_id(2)[0].add_comment('sophie', '5', 'great')
+        journal.sync()
+        # the books file is saved, the crash comes before the journal is emptied
+        save_books(self.books_file, books_list, checkpoint=2)
+        books_list.find_by_id(1)[0].change_rating(5)
+        journal.close()
+        self.assertEqual(storage_utils.read_checkpoint(self.books_file), 2)
+
+        books_list = load_books(self.books_file)
+        journal = Journal(self.filename)
+        self.assertEqual(journal.replay(books_list), 1)
+        self.assertEqual(books_list.find_by_id(1)[0].reviews, 64)
+        self.assertEqual(books_list.find_by_id(2)[0].comments, {'sophie': '5 great'})
+        journal.compact(books_list, self.books_file)
+        journal.attach(books_list)
+        books_list.find_by_id(3)[0].change_rating(5)
+        journal.close()
+        self.assertEqual(storage_utils.read_checkpoint(self.books_file), 3)
+        journal = Journal(self.filename)
+        self.assertEqual(journal.replay(load_books(self.books_file)), 1)
+        journal.close()
+
+    def test_Journal_torn_first_line(self):
+        """ Test a line torn by a crash is cut off even when nothing is
+            replayed, so the events of the next session are kept """
+        with open(self.filename, 'w') as file:
+            file.write('{"event": "rate", "id"')
+        journal = Journal(self.filename)
+        books_list = load_books(self.books_file)
+        self.assertEqual(journal.replay(books_list), 0)
+        journal.attach(books_list)
+        books_list.find_by_id(1)[0].change_rating(1)
+        journal.close()
+        journal = Journal(self.filename)
+        books_list = load_books(self.books_file)
+        self.assertEqual(journal.replay(books_list), 1)
+        self.assertEqual(books_list.find_by_id(1)[0].reviews, 63)
+        journal.close()
+
+
+class Test_search_utils(unittest.TestCase):
+    """ Test all functions in search_utils """
+
+    def setUp(self):
+        """ Index the names of a few books """
+        self.book1 = Book(1, 'Becoming', 'Michelle Obama', 4.8, 62, 'Non Fiction', 'test')
+        self.book2 = Book(2, 'Educated: A Memoir', 'Tara Westover', 4.7, 29, 'Non Fiction', 'test')
+        self.book4 = Book(4, 'The Hunger Games (Book 1)', 'Suzanne Collins', 4.7, 33, 'Fiction', 'test')
+        self.book5 = Book(5, 'The Hunger Games Trilogy Boxed Set', 'Suzanne Collins',
+                          4.8, 17, 'Fiction', 'test')
+        self.sample = BookList([self.book1, self.book2, self.book4, self.book5])
+        self.engine = SearchEngine(self.sample)
+
+    def test_tokenize(self):
+        """ Test tokenize splits on punctuation and lowercases """
+        self.assertEqual(tokenize('Educated: A Memoir'), ['educated', 'a', 'memoir'])
+
+    def test_edit_distance(self):
+        """ Test edit_distance with typos, swaps and the limit """
+        self.assertEqual(edit_distance('hary', 'harry', 2), 1)
+        self.assertEqual(edit_distance('hugner', 'hunger', 2), 1)
+        self.assertEqual(edit_distance('gmes', 'games', 2), 1)
+        self.assertEqual(edit_distance('abc', 'xyz', 1), 2)
+
+    def test_SearchEngine_search(self):
+        """ Test typos are found and results are ranked by match, then score """
+        self.assertEqual(self.engine.search('hungr gmes'), [self.book4, self.book5])
+        self.assertEqual(self.engine.search('trilogy hunger'), [self.book5, self.book4])
+        self.assertEqual(self.engine.search('educatd'), [self.book2])
+        self.assertEqual(self.engine.search('memo'), [self.book2])
+        self.assertEqual(self.engine.search('hunger games', 1), [self.book4])
+        self.assertEqual(self.engine.search('zzzz'), [])
+        authors = SearchEngine(self.sample, 'author')
+        self.assertEqual(authors.search('suzane colins'), [self.book4, self.book5])
+
+    def test_SearchEngine_update(self):
+        """ Test the engine follows ratings and catalog changes """
+        self.book5.add_ratings(5 * 100, 100)
+        self.assertEqual(self.engine.search('hunger games'), [self.book5, self.book4])
+        book = Book(7, 'Catching Fire', 'Suzanne Collins', 4.5, 10, 'Fiction', 'test')
+        self.sample.add_book(book)
+        self.assertEqual(self.engine.search('catchng fire'), [book])
+        self.sample.remove_book(7)
+        self.assertEqual(self.engine.search('catchng fire'), [])
+
+    def test_SearchEngine_columns(self):
+        """ Test catalogs with columns are indexed on the first search, only
+            the results become Book objects """
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'books.snapshot')
+            write_snapshot(filename, self.sample)
+            snapshot = load_snapshot(filename)
+            columnar = ColumnarBookList.from_frame(pd.DataFrame(Book.to_columns(self.sample.books)))
+            for books_list in (snapshot, columnar):
+                engine = SearchEngine(books_list)
+                self.assertEqual(books_list._cache, {})
+                self.assertEqual([book.id for book in engine.search('hungr gmes')], [4, 5])
+                self.assertEqual(sorted(books_list._cache), [4, 5])
+
+
+class Test_recommend_utils(unittest.TestCase):
+    """ Test all functions in recommend_utils """
+
+    def setUp(self):
+        """ Rates of four users on four books: sophie and tom like 1 and 2,
+            ann likes 1 and 4, 3 is rated low with 1 """
+        self.recommender = Recommender(merge_every=3)
+        self.recommender.load(['sophie', 'sophie', 'sophie', 'tom', 'tom', 'ann', 'ann', 'bob'],
+                              [1, 2, 3, 1, 2, 1, 4, 3], [5, 5, 1, 5, 4, 5, 2, 5])
+
+    def test_parse_rate(self):
+        """ Test parse_rate with and without a rate """
+        self.assertEqual(parse_rate('5 A good book'), 5)
+        self.assertEqual(parse_rate(' only a comment'), None)
+
+    def test_Recommender_from_books(self):
+        """ Test the rates are read from Book.comments """
+        book1 = Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test', '{"sophie": "5 good", "tom": " ok"}')
+        book2 = Book(2, 'book2', 'any', 5, 10, 'Fiction', 'test', '{"tom": "4 nice"}')
+        recommender = Recommender.from_books([book1, book2])
+        self.assertEqual(recommender.user_names, ['sophie', 'tom'])
+        self.assertEqual(recommender.book_ids, [1, 2])
+
+    def test_Recommender_from_store(self):
+        """ Test the rates are read from a UserStore """
+        with tempfile.TemporaryDirectory() as folder:
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            self.assertEqual(Recommender.from_store(store).user_names, [])
+            for name, id, rate in (('sophie', 1, 5), ('sophie', 2, 5), ('tom', 1, 5)):
+                user = User(name)
+                user.add_rate(id, rate)
+                store.save(user)
+            recommender = Recommender.from_store(store)
+            store.close()
+        self.assertEqual(recommender.user_names, ['sophie', 'tom'])
+        self.assertEqual(recommender.recommend('tom'), [2])
+
+    def test_Recommender_recommend(self):
+        """ Test similar books and recommendations leave out rated books """
+        self.assertEqual([id for id, _ in self.recommender.similar_books(1)], [2, 4, 3])
+        self.assertAlmostEqual(self.recommender.similar_books(1)[0][1], 45 / (75 ** 0.5 * 41 ** 0.5))
+        self.assertEqual(self.recommender.recommend('ann'), [2, 3])
+        self.assertEqual(self.recommender.recommend('tom', 1), [4])
+        self.assertEqual(self.recommender.recommend('nobody'), [])
+
+    def test_Recommender_add_rating(self):
+        """ Test new ratings are learned incrementally and merged """
+        self.recommender.add_rating('ann', 2, 5)
+        self.assertEqual(self.recommender.recommend('ann'), [3])
+        self.recommender.add_rating('tom', 1, 1)
+        self.assertEqual(self.recommender._extra_count, 1)
+        book = Book(9, 'book9', 'any', 5, 10, 'Fiction', 'test')
+        books_list = BookList([book])
+        books_list.listeners.append(self.recommender.record)
+        book.add_comment('eve', '5', 'great')
+        book.add_comment('eve', '', 'no rate')
+        self.recommender.add_rating('eve', 1, 5)
+        # the third new rating merged them into the arrays
+        self.assertEqual(self.recommender._extra_count, 0)
+        self.assertEqual(self.recommender.similar_books(9), [(1, 5 / 76 ** 0.5)])
+        self.assertEqual(self.recommender.recommend('sophie'), [4, 9])
+
+
+    def test_Recommender_remove_rating(self):
+        """ Test removed comments take their rates out of the arrays and the new ratings """
+        self.assertEqual(self.recommender.recommend('tom'), [4, 3])
+        book = Book(4, 'book4', 'any', 5, 10, 'Fiction', 'test', '{"ann": "2 meh"}')
+        books_list = BookList([book])
+        books_list.listeners.append(self.recommender.record)
+        books_list.remove_user_comments('ann')
+        self.assertEqual(self.recommender.similar_books(4), [])
+        self.assertEqual(self.recommender.recommend('tom'), [3])
+        self.recommender.add_rating('eve', 4, 5)
+        self.recommender.remove_rating('eve', 4)
+        self.recommender.remove_rating('nobody', 4)
+        self.assertEqual(self.recommender._extra_count, 0)
+        self.assertEqual(self.recommender._norms[self.recommender.books[4]], 0)
+        self.recommender.compact()
+        self.assertEqual(self.recommender.recommend('ann'), [2, 3])
+        self.assertEqual(self.recommender.recommend('tom'), [3])
+
+
+class Test_metrics_utils(unittest.TestCase):
+    """ Test all functions in metrics_utils """
+
+    def tearDown(self):
+        metrics_utils.disable()
+        metrics_utils.METRICS.clear()
+
+    def test_Histogram_quantile(self):
+        """ Test percentiles are within a bucket of the exact ones """
+        histogram = metrics_utils.Histogram()
+        self.assertTrue(np.isnan(histogram.quantile(0.5)))
+        for i in range(1, 1001):
+            histogram.observe(i / 1000)
+        self.assertEqual(histogram.count, 1000)
+        for q in (0.5, 0.95, 0.99):
+            self.assertLess(abs(histogram.quantile(q) / q - 1), 0.34)
+        self.assertEqual(histogram.quantile(1), 1)
+
+    def test_enable_disable(self):
+        """ Test functions are wrapped while enabled only, and counted """
+        original = BookList.find_by_id
+        self.assertIs(metrics_utils.timer('nothing').__class__, metrics_utils.contextlib.nullcontext)
+        metrics_utils.enable()
+        self.assertTrue(metrics_utils.enabled())
+        self.assertIsNot(BookList.find_by_id, original)
+        books_list = books_utils.load_books('data/test_file.xlsx')
+        self.assertEqual(books_list.find_by_id(4)[0].name, 'The Hunger Games (Book 1)')
+        books_list.find_by_id(9)
+        with metrics_utils.timer('command help'):
+            pass
+        metrics_utils.disable()
+        self.assertIs(BookList.find_by_id, original)
+        books_list.find_by_id(4)
+        histograms = metrics_utils.METRICS.histograms
+        self.assertEqual(histograms['BookList.find_by_id'].count, 2)
+        self.assertEqual(histograms['load_books'].count, 1)
+        self.assertEqual(histograms['command help'].count, 1)
+        self.assertEqual(metrics_utils.METRICS.summary()[0][0], 'load_books')
+
+    def test_write_metrics(self):
+        """ Test the Prometheus and text output, and the cProfile samples """
+        metrics_utils.enable({'books_utils': ['load_books']}, profile_rate=1)
+        books_utils.load_books('data/test_file.xlsx')
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'metrics.prom')
+            metrics_utils.write_metrics(filename)
+            with open(filename) as file:
+                text = file.read()
+            self.assertIn('# TYPE books_call_duration_seconds histogram', text)
+            self.assertIn('books_call_duration_seconds_bucket{name="load_books",le="+Inf"} 1', text)
+            self.assertIn('books_call_duration_seconds_count{name="load_books"} 1', text)
+            self.assertTrue(os.path.exists(filename + '.pstats'))
+            metrics_utils.write_metrics(os.path.join(folder, 'metrics.txt'))
+            with open(os.path.join(folder, 'metrics.txt')) as file:
+                self.assertTrue(file.readlines()[1].startswith('load_books'))
+
+
+class Test_server(unittest.TestCase):
+    """ Test all functions in server """
+
+    def setUp(self):
+        """ Serve test_file.xlsx on a free port """
+        self.books_list = load_books('data/test_file.xlsx')
+        self.service = server.BookService(self.books_list)
+        self.httpd = server.make_server(self.service, port=0)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def request(self, method, path, body=None):
+        """ Send one request, return the status and the decoded json """
+        connection = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1])
+        connection.request(method, path, body and json.dumps(body))
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    def test_BookService(self):
+        """ Test BookService search, recommend, rate, collect and shelf """
+        self.assertEqual([book['id'] for book in self.service.search('name', 'hunger')], [4, 5])
+        self.assertEqual([book['id'] for book in self.service.recommend('fiction', 2)], [4, 3])
+        self.assertEqual([book['id'] for book in self.service.recommend('fiction', 2, 'bayesian')],
+                         [5, 4])
+        with self.assertRaises(ValueError):
+            self.service.recommend('fiction', 2, 'nobody')
+        book = self.service.rate('sophie', '1', '5', 'A good book')
+        self.assertEqual(book['reviews'], 63)
+        self.assertEqual(book['comments'], {'sophie': '5 A good book'})
+        self.service.collect('sophie', 1)
+        self.assertEqual(self.service.shelf('sophie'), [{'id': 1, 'name': 'Becoming', 'rate': 5}])
+        with self.assertRaises(KeyError):
+            self.service.get_book(9)
+
+    def test_BookService_store(self):
+        """ Test users are loaded from and saved to the store """
+        with tempfile.TemporaryDirectory() as folder:
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            service = server.BookService(self.books_list, store=store)
+            service.rate('sophie', 1, '5')
+            service.collect('sophie', 1)
+            service = server.BookService(self.books_list, store=store)
+            self.assertEqual(service.shelf('sophie'), [{'id': 1, 'name': 'Becoming', 'rate': 5}])
+            store.close()
+
+    def test_BookService_remove_user_comments(self):
+        """ Test removing the comments of a user purges the store and the recommender """
+        with tempfile.TemporaryDirectory() as folder:
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            service = server.BookService(self.books_list, recommender=Recommender(), store=store)
+            service.rate('sophie', 1, '5', 'A good book')
+            service.rate('sophie', 2, '5')
+            service.rate('tom', 1, '5')
+            self.assertEqual(self.books_list.remove_user_comments('sophie'), 2)
+            self.assertEqual(service.get_user('sophie')[0].rates, {})
+            self.assertEqual(store.load('sophie')[0].comments, {})
+            self.assertEqual(store.all_rates(), (['tom'], [1], [5]))
+            self.assertEqual(service.recommend_for('tom'), [])
+            store.close()
+
+    def test_BookService_recommend_for(self):
+        """ Test recommendations learn from the rates made through the service """
+        service = server.BookService(self.books_list, recommender=Recommender())
+        self.assertEqual(service.recommend_for('sophie'), [])
+        service.rate('sophie', 1, '5')
+        service.rate('sophie', 2, '5')
+        service.rate('tom', 1, '5')
+        self.assertEqual([book['id'] for book in service.recommend_for('tom')], [2])
+
+    def test_http_api(self):
+        """ Test the HTTP routes and errors """
+        status, result = self.request('GET', '/search?type=author&value=westover')
+        self.assertEqual((status, result[0]['name']), (200, 'Educated: A Memoir'))
+        status, result = self.request('POST', '/rate', {'user': 'amy', 'id': 2, 'rate': '1'})
+        self.assertEqual((status, result['reviews']), (200, 30))
+        self.assertEqual(self.request('GET', '/book?id=9')[0], 404)
+        self.assertEqual(self.request('GET', '/search?type=isbn&value=1')[0], 400)
+
+    def test_metrics_route(self):
+        """ Test requests are timed while metrics are enabled, and served as text """
+        metrics_utils.enable({})
+        self.addCleanup(metrics_utils.METRICS.clear)
+        self.addCleanup(metrics_utils.disable)
+        self.request('GET', '/search?type=name&value=hunger')
+        connection = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1])
+        connection.request('GET', '/metrics')
+        text = connection.getresponse().read().decode()
+        connection.close()
+        self.assertIn('books_call_duration_seconds_count{name="GET /search"} 1', text)
+
+    def test_concurrent_change_rating(self):
+        """ Test no rating is lost when many threads rate the same book """
+        book = self.books_list.find_by_id(3)[0]
+        threads = [threading.Thread(target=lambda: [book.change_rating(5) for _ in range(500)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(book.reviews, 30 + 8 * 500)
+        self.assertEqual(self.books_list.top_books('fiction', 1), [book])
+
+    def test_concurrent_snapshot(self):
+        """ Test threads rating the snapshot catalog that server.main serves
+            share one Book per id and lose no rating """
+        with tempfile.TemporaryDirectory() as folder:
+            books_file = os.path.join(folder, 'books.sqlite')
+            save_books(books_file, BookList([Book(id, f"book {id}", 'any', 4.0, 10, 'Fiction')
+                                             for id in range(1, 3001)]))
+            load_catalog(books_file, books_file + '.snapshot')
+            books_list = load_catalog(books_file, books_file + '.snapshot')
+            self.assertIsInstance(books_list, SnapshotBookList)
+            service = server.BookService(books_list)
+            errors = []
+
+            def rate_all():
+                try:
+                    for id in range(1, 3001):
+                        service.get_book(id).change_rating(5)
+                except ValueError as error:
+                    errors.append(error)
+            # switch threads often, every Book is created and rated by all of them at once
+            self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+            sys.setswitchinterval(1e-6)
+            threads = [threading.Thread(target=rate_all) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(books_list.reviews.tolist(), [18] * 3000)
+            self.assertEqual([book.reviews for book in books_list.books], [18] * 3000)
+
+    def test_concurrent_comments(self):
+        """ Test a first read of the comments racing a new comment, like
+            GET /book and POST /rate, does not lose the comment """
+        books = [Book(id, f"book {id}", 'any', 4.0, 10, 'Fiction', '', '{"amy": "4 ok"}')
+                 for id in range(1, 3001)]
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        threads = [threading.Thread(target=lambda: [book.comments for book in books]),
+                   threading.Thread(target=lambda: [book.add_comment('sophie', '5', 'great')
+                                                    for book in books])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([len(book.comments) for book in books], [2] * 3000)
+        self.assertIn('sophie', json.loads(books[-1].comments_json))
+
+
 class Test_users_utils(unittest.TestCase):
     """ Test all functions in users_utils """
 
@@ -182,6 +1127,32 @@ class Test_users_utils(unittest.TestCase):
         case.add_comment(1, 'test')
         self.assertEqual(case.comments[1], 'test')
 
+    def test_UserStore(self):
+        """ Test UserStore saves changes as they happen and loads one user """
+        with tempfile.TemporaryDirectory() as folder:
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            user, shelf = store.load('sophie')
+            self.assertEqual((user.rates, user.comments, shelf.collects), ({}, {}, {}))
+            store.attach(user, shelf)
+            user.add_rate(2, 4)
+            user.add_rate(2, 5)
+            user.add_comment(2, 'A good book')
+            shelf.add_collect(Book(2, 'book2', 'any', 5, 10, 'Fiction', 'test'))
+            shelf.add_collect(Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test'))
+            shelf.add_collect(Book(2, 'book2', 'any', 5, 10, 'Fiction', 'test'))
+            other = User('tom')
+            other.add_rate(1, 3)
+            store.save(other)
+            store.close()
+
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            user, shelf = store.load('sophie')
+            self.assertEqual(user.rates, {2: 5})
+            self.assertEqual(user.comments, {2: 'A good book'})
+            self.assertEqual(list(shelf.collects.items()), [(2, 'book2'), (1, 'book1')])
+            self.assertEqual(store.load('tom')[0].rates, {1: 3})
+            store.close()
+
 
 class Test_view_run(unittest.TestCase):
     """ Test all functions in view and run """
@@ -241,6 +1212,7 @@ class Test_view_run(unittest.TestCase):
         expect = 'Type any of the following commands, or you can type the number.\n'
         expect += '1. Search - search your target book by id, author or name. For example - search name harry potter\n'
         expect += '2. Recommend - show books with best reviews in non fiction and fiction genres. For example - recommend fiction)\n'
+        expect += '   Type "recommend me" for books picked from your rates.\n'
         expect += '3. Bookshelf - show books you collect.\n'
         expect += '4. Help - Type "help" to get a list of commands.\n'
         expect += '5. Exit - exit the program. It will automatically update books info.'
@@ -344,6 +1316,16 @@ class Test_view_run(unittest.TestCase):
         sys.stdout = sys.__stdout__
         self.assertEqual(output, expect)
 
+    def test_display_search_page(self):
+        """ Test view.display_search with the first page of more results """
+        buffer = StringIO()
+        sys.stdout = buffer
+        view.display_search([self.book4], True)
+        output = buffer.getvalue().strip()
+        sys.stdout = sys.__stdout__
+        expect = 'Showing the first 1 results, refine your search to see more\n'
+        self.assertEqual(output, expect + str(self.book4))
+
     def test_display_shelf(self):
         """ Test view.display_shelf"""
         buffer = StringIO()
@@ -389,6 +1371,80 @@ class Test_view_run(unittest.TestCase):
         book2 = run.run_search(self.sample, ('id', '1'))
         self.assertEqual(str(book2), str(self.book1))
 
+    @patch('builtins.input', side_effect=['5'])
+    def test_run_search_fuzzy(self, mock_input):
+        """ Test run.run_search shows the closest matches when nothing matches """
+        engines = {'name': SearchEngine(self.sample)}
+        self.assertIsNone(run.run_search(self.sample, ('name', 'hungr gmes')))
+        book = run.run_search(self.sample, ('name', 'hungr gmes'), engines)
+        self.assertEqual(book, self.book5)
+
+    @patch('view.PAGE_SIZE', 2)
+    @patch('builtins.input', side_effect=['2'])
+    def test_run_search_page(self, mock_input):
+        """ Test run.run_search only shows the first page """
+        buffer = StringIO()
+        sys.stdout = buffer
+        book = run.run_search(self.sample, ('author', 'e'))
+        output = buffer.getvalue()
+        sys.stdout = sys.__stdout__
+        self.assertEqual(book, self.book2)
+        self.assertIn('Showing the first 2 results', output)
+        self.assertNotIn(str(self.book3), output)
+
+    def test_run_recommend(self):
+        """ Test run.run_recommend with a genre and with "me" """
+        recommender = Recommender()
+        buffer = StringIO()
+        sys.stdout = sys.stderr = buffer
+        run.run_recommend(self.sample, recommender, User('sophie'), 'fiction')
+        self.assertIn(str(self.book4), buffer.getvalue())
+        buffer = StringIO()
+        sys.stdout = sys.stderr = buffer
+        run.run_recommend(self.sample, recommender, User('sophie'), 'me')
+        recommender.load(['sophie', 'tom', 'tom'], [1, 1, 2], [5, 5, 4])
+        run.run_recommend(self.sample, recommender, User('sophie'), 'me')
+        output = buffer.getvalue()
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        self.assertIn('Rate a few books first', output)
+        self.assertIn(str(self.book2), output)
+        self.assertNotIn(str(self.book4), output)
+
+    def test_load_session(self):
+        """ Test run.load_session loads the catalog, its search engines and a
+            recommender learning from new comments """
+        with tempfile.TemporaryDirectory() as folder:
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            books_list, engines, recommender = run.load_session(
+                'data/test_file.xlsx', os.path.join(folder, 'books.snapshot'), store)
+            store.close()
+        self.assertEqual(len(books_list.books), 6)
+        self.assertEqual([book.id for book in engines['name'].search('hungr')][0], 4)
+        books_list.find_by_id(1)[0].add_comment('sophie', '5', 'great')
+        books_list.find_by_id(2)[0].add_comment('sophie', '5', 'great')
+        books_list.find_by_id(1)[0].add_comment('tom', '5', 'great')
+        self.assertEqual(recommender.recommend('tom'), [2])
+
+    def test_import_catalog(self):
+        """ Test run.import_catalog creates the books file once, with the
+            rates of its comments saved by user """
+        with tempfile.TemporaryDirectory() as folder:
+            books_file = os.path.join(folder, 'books.sqlite')
+            catalog = os.path.join(folder, 'books.xlsx')
+            save_books(catalog, BookList([
+                Book(1, 'book1', 'any', 5, 10, 'Fiction', 'test', '{"sophie": "5 good", "tom": " ok"}'),
+                *load_books('data/test_file.xlsx').books[1:]]))
+            store = UserStore(os.path.join(folder, 'users.sqlite'))
+            run.import_catalog(books_file, catalog, store)
+            self.assertEqual(store.all_rates(), (['sophie'], [1], [5]))
+            store.close()
+            books_list = load_books(books_file)
+            self.assertEqual(len(books_list.books), 6)
+            books_list.find_by_id(1)[0].change_rating(1)
+            save_books(books_file, books_list)
+            run.import_catalog(books_file, 'data/test_file.xlsx')
+            self.assertEqual(load_books(books_file).find_by_id(1)[0].reviews, 11)
+
     @patch('builtins.input', side_effect=['5', 'A good book', 'y'])
     def test_run_bookinfo(self, mockinput):
         """ Test run.bookinfo """
@@ -405,4 +1461,6 @@ def run_tests():
     unittest.main(verbosity=3)
 
 
-run_tests()
+# the shard workers of shard_utils import this module again, without running it
+if __name__ == "__main__":
+    run_tests()
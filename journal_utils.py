@@ -0,0 +1,196 @@
+"""
+journal_utils keeps a write-ahead journal of the ratings, comments and
+bookshelf collects made in a session, so a crash does not lose them before
+save_books runs. Every event is appended to the journal file as one json line
+when it happens; fsync runs once per batch of events.
+
+On startup the journal is replayed on top of the loaded books and compacted
+into the books file. Events are numbered, and the books file stores the
+number of the last one it includes (its checkpoint), so a crash between the
+save and the truncation of the journal does not apply an event twice. A
+last line torn by a crash is cut off when the journal is opened.
+
+Classes included: Journal
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import json
+import os
+import threading
+import storage_utils
+from books_utils import BookShelf, save_books
+
+
+class Journal:
+    """ An append-only journal of book and bookshelf events.
+
+    Attributes:
+        filename (str): the journal file, json lines such as
+                        {"event": "rate", "id": 1, "rate": 5, "seq": 12}
+        sync_every (int): fsync after this many events, defaults to 32
+    """
+
+    def __init__(self, filename: str, sync_every: int = 32):
+        """ Constructor of the Journal object, opens the journal for appending
+
+        Args:
+            filename (str): the journal file
+            sync_every (int): fsync after this many events
+        """
+        self.filename = filename
+        self.sync_every = sync_every
+        # the sequence number of the last event, numbers go on across sessions
+        self._seq = 0
+        if os.path.exists(filename):
+            self._truncate_torn()
+        self._file = open(filename, 'a', encoding='utf-8')
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    def _truncate_torn(self) -> None:
+        """ Cut the journal file after its last complete line, so the events
+            appended next do not follow a line torn by a crash, and number
+            the events after the last one kept """
+        end = 0
+        with open(self.filename, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self._seq = max(self._seq, entry.get('seq', 0))
+                end += len(line)
+        if end < os.path.getsize(self.filename):
+            os.truncate(self.filename, end)
+
+    def _entries(self):
+        """ Yield the events of the journal file as dicts, in order """
+        with open(self.filename, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # a line torn by a crash, nothing after it was written
+                    return
+
+    def record(self, source, event: str, args: tuple) -> None:
+        """ Append one event, the listener for BookList.listeners and
+            BookShelf.listeners
+
+        Args:
+            source (Book or BookShelf): what changed
+            event (str): "rate", "ratings", "comment", "remove_comment" or "collect"
+            args (tuple): the arguments of the change
+        """
+        if event == 'rate':
+            entry = {'event': event, 'id': source.id, 'rate': args[0]}
+        elif event == 'ratings':
+            total, count = args
+            entry = {'event': event, 'id': source.id, 'total': total, 'count': count}
+        elif event == 'comment':
+            user, rate, comment = args
+            entry = {'event': event, 'id': source.id, 'user': user,
+                     'rate': rate, 'comment': comment}
+        elif event == 'remove_comment':
+            entry = {'event': event, 'id': source.id, 'user': args[0]}
+        else:
+            id, name = args
+            entry = {'event': event, 'shelf': source.name, 'id': id, 'name': name}
+        with self._lock:
+            self._seq += 1
+            entry['seq'] = self._seq
+            line = json.dumps(entry) + '\n'
+            # flush hands the line to the OS, so it survives a crash of the app;
+            # fsync (against power loss) is batched
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= self.sync_every:
+                self.sync()
+
+    def sync(self) -> None:
+        """ Force the events written so far to disk """
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self) -> None:
+        """ Sync and close the journal file """
+        with self._lock:
+            self.sync()
+            self._file.close()
+
+    def attach(self, books_list, shelf: BookShelf = None) -> None:
+        """ Start recording the events of books_list and shelf
+
+        Args:
+            books_list (BookList): the loaded books
+            shelf (BookShelf): the user's bookshelf
+        """
+        books_list.listeners.append(self.record)
+        if shelf is not None:
+            shelf.listeners.append(self.record)
+
+    def replay(self, books_list, shelf: BookShelf = None) -> int:
+        """ Apply the journaled events to books_list and shelf. Call it before
+            attach, so the replayed events are not journaled again. Book
+            events the books file already includes, up to its checkpoint,
+            are skipped.
+
+        Args:
+            books_list (BookList): the books loaded from the books file
+            shelf (BookShelf): the user's bookshelf, collects of other
+                               shelves are skipped
+
+        Return:
+            count (int): the number of events applied
+        """
+        checkpoint = 0
+        if books_list.source is not None:
+            checkpoint = storage_utils.read_checkpoint(books_list.source)
+        with self._lock:
+            # a journal emptied by hand still numbers its events after the books file
+            self._seq = max(self._seq, checkpoint)
+        count = 0
+        for entry in self._entries():
+            if entry['event'] == 'collect':
+                if shelf is not None and shelf.name == entry['shelf']:
+                    shelf.collects[entry['id']] = entry['name']
+                    count += 1
+                continue
+            if entry.get('seq', checkpoint + 1) <= checkpoint:
+                continue
+            result = books_list.find_by_id(entry['id'])
+            if len(result) == 0:
+                continue
+            if entry['event'] == 'rate':
+                result[0].change_rating(entry['rate'])
+            elif entry['event'] == 'ratings':
+                result[0].add_ratings(entry['total'], entry['count'])
+            elif entry['event'] == 'remove_comment':
+                result[0].remove_comment(entry['user'])
+            else:
+                result[0].add_comment(entry['user'], entry['rate'], entry['comment'])
+            count += 1
+        return count
+
+    def compact(self, books_list, books_file: str, format: str = None) -> None:
+        """ Save books_list to the books file with the number of the last
+            event as its checkpoint, then empty the journal. Collects are
+            dropped too, users_utils.UserStore keeps the bookshelves.
+
+        Args:
+            books_list (BookList): the books to save
+            books_file (str): the books file
+            format (str): forces a storage format instead of using the extension
+        """
+        with self._lock:
+            save_books(books_file, books_list, format, self._seq)
+            self._file.close()
+            # a crash before the truncation leaves events the checkpoint skips
+            self._file = open(self.filename, 'w', encoding='utf-8')
+            self._pending = 0
@@ -0,0 +1,344 @@
+"""
+metrics_utils measures where the time of a session goes. It records call
+counts and latency histograms (with p50 / p95 / p99) of:
+- the BookList methods;
+- the loaders and savers;
+- the run.py commands;
+- the server requests.
+It can also sample calls with cProfile. Results are written as a text
+table or in the Prometheus text format.
+
+Instrumentation is off by default and then costs nothing. enable() replaces
+the functions in TARGETS with timing wrappers, and disable() puts the
+originals back. Modules are not imported for it: the ones imported after
+enable() are instrumented by refresh(). run.py and server.py turn it on when the BOOKS_METRICS
+environment variable names a file to write the metrics to:
+
+    BOOKS_METRICS=metrics.prom python run.py        Prometheus text
+    BOOKS_METRICS=metrics.txt python run.py         a table
+    BOOKS_PROFILE=0.01 BOOKS_METRICS=...            also profile 1% of the calls,
+                                                    saved to <file>.pstats
+
+Classes included: Histogram, Metrics
+Functions included: enable, refresh, disable, enabled, timer, enable_from_env, write_metrics
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import bisect
+import contextlib
+import functools
+import math
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+METRICS_ENV = 'BOOKS_METRICS'
+PROFILE_ENV = 'BOOKS_PROFILE'
+PREFIX = 'books'
+
+# bucket upper bounds in seconds, 8 per power of ten from 1 us to 1000 s, so a
+# percentile is off by at most a third of itself
+BOUNDS = [10 ** (exponent / 8) for exponent in range(-48, 25)]
+# the bounds written to Prometheus, one per half power of ten
+EXPORTED_BOUNDS = BOUNDS[::4]
+
+LIST_METHODS = ['find_by_id', 'find_by_name', 'find_by_author', 'top_books',
+                'add_book', 'remove_book', 'apply_ratings']
+# the functions enable instruments, {module: [attribute path]}. A function
+# imported into other modules is listed with them too, they call their copy
+TARGETS = {
+    'books_utils': (['Book.change_rating', 'Book.add_comment', 'Book.remove_comment',
+                     'CommentIndex.comments_by_user', 'CommentIndex.average_rate',
+                     'CommentIndex.remove_user_comments', 'load_books', 'save_books']
+                    + [f"BookList.{method}" for method in LIST_METHODS]),
+    'columnar_utils': ([f"ColumnarBookList.{method}" for method in LIST_METHODS]
+                       + ['ColumnarBookList.from_frame', 'load_columnar']),
+    'snapshot_utils': ([f"SnapshotBookList.{method}" for method in LIST_METHODS]
+                       + ['load_books', 'load_snapshot', 'write_snapshot', 'load_catalog']),
+    'shard_utils': ([f"ShardedBookList.{method}" for method in LIST_METHODS]
+                    + ['load_sharded']),
+    'storage_utils': ['read_columns', 'write_columns', 'update_columns'],
+    'journal_utils': ['Journal.replay', 'Journal.compact', 'save_books'],
+    'search_utils': ['SearchEngine.search'],
+    'recommend_utils': ['Recommender.recommend', 'Recommender.add_rating',
+                        'Recommender.from_books', 'Recommender.from_store'],
+    'users_utils': ['UserStore.load', 'UserStore.save', 'UserStore.all_rates'],
+}
+
+
+class Histogram:
+    """ The latencies of one function or command, counted in BOUNDS buckets
+
+    Attributes:
+        counts (List[int]): calls per bucket, the last one above BOUNDS[-1]
+        count (int): the number of calls
+        sum (float): their total time in seconds
+        max (float): the slowest call
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """ Count one call """
+        with self._lock:
+            self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """ Estimate a quantile, e.g. 0.99, like Prometheus histogram_quantile
+            but interpolating on the log scale of the buckets """
+        with self._lock:
+            if self.count == 0:
+                return math.nan
+            rank = q * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                if count and seen + count >= rank:
+                    if i == len(BOUNDS):
+                        return self.max
+                    lower = BOUNDS[i - 1] if i > 0 else BOUNDS[0] / 10 ** (1 / 8)
+                    estimate = lower * (BOUNDS[i] / lower) ** ((rank - seen) / count)
+                    return min(estimate, self.max)
+                seen += count
+            return self.max
+
+
+class Metrics:
+    """ The histograms of every instrumented function and command
+
+    Attributes:
+        histograms (Dict[str, Histogram]): {name: histogram}
+        profile (pstats.Stats): the merged cProfile samples, None before the first one
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        """ Return the histogram of name, created on first use """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def add_profile(self, profile) -> None:
+        """ Merge one cProfile.Profile sample """
+        import pstats
+        with self._lock:
+            if self.profile is None:
+                self.profile = pstats.Stats(profile)
+            else:
+                self.profile.add(profile)
+
+    def clear(self) -> None:
+        """ Forget everything recorded """
+        with self._lock:
+            self.histograms = {}
+            self.profile = None
+
+    def _items(self) -> List[Tuple[str, Histogram]]:
+        """ Return the (name, histogram) pairs, by name """
+        with self._lock:
+            return sorted(self.histograms.items())
+
+    def summary(self) -> List[Tuple]:
+        """ Return (name, calls, p50, p95, p99, total seconds) per histogram,
+            the most total time first """
+        rows = [(name, histogram.count, histogram.quantile(0.5), histogram.quantile(0.95),
+                 histogram.quantile(0.99), histogram.sum)
+                for name, histogram in self._items() if histogram.count]
+        return sorted(rows, key=lambda row: -row[5])
+
+    def to_text(self) -> str:
+        """ Return the summary as a table, times in milliseconds """
+        lines = [f"{'name':40} {'calls':>9} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'total s':>10}"]
+        for name, count, p50, p95, p99, total in self.summary():
+            lines.append(f"{name:40} {count:9} {p50 * 1000:10.3f} {p95 * 1000:10.3f} "
+                         f"{p99 * 1000:10.3f} {total:10.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def to_prometheus(self) -> str:
+        """ Return every histogram in the Prometheus text format """
+        metric = f"{PREFIX}_call_duration_seconds"
+        lines = [f"# HELP {metric} Latency of the instrumented functions and commands.",
+                 f"# TYPE {metric} histogram"]
+        for name, histogram in self._items():
+            with histogram._lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            label = f'name="{name}"'
+            cumulative, i = 0, 0
+            for bound in EXPORTED_BOUNDS:
+                while i < len(BOUNDS) and BOUNDS[i] <= bound:
+                    cumulative += counts[i]
+                    i += 1
+                lines.append(f'{metric}_bucket{{{label},le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label}}} {total!r}")
+            lines.append(f"{metric}_count{{{label}}} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+# the metrics recorded while instrumentation is enabled
+METRICS = Metrics()
+_enabled = False
+# the targets of enable, and the modules instrumented so far
+_targets = {}
+_instrumented = set()
+# (owner, attribute, original) of every replaced function
+_patched = []
+_profile_rate = 0.0
+# one cProfile sample at a time, cProfile cannot nest
+_profile_lock = threading.Lock()
+
+
+def _instrument(function, name: str):
+    """ Return a wrapper of function recording its latency as name """
+    histogram = METRICS.histogram(name)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _profile_rate and random.random() < _profile_rate \
+                and _profile_lock.acquire(blocking=False):
+            import cProfile
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+                _profile_lock.release()
+                METRICS.add_profile(profile)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _patch(owner, attribute: str, name: str) -> None:
+    """ Replace owner.attribute, a function, method or classmethod, with its wrapper """
+    original = vars(owner)[attribute]
+    if getattr(original, 'instrumented', False):
+        # imported from a module instrumented before, disable restores the original
+        _patched.append((owner, attribute, original.__wrapped__))
+        return
+    if isinstance(original, (classmethod, staticmethod)):
+        wrapper = type(original)(_instrument(original.__func__, name))
+    else:
+        wrapper = _instrument(original, name)
+    setattr(owner, attribute, wrapper)
+    _patched.append((owner, attribute, original))
+
+
+def enable(targets: Dict[str, List[str]] = None, profile_rate: float = 0.0) -> None:
+    """ Start recording the latency of the target functions, see TARGETS
+
+    Args:
+        targets (dict): {module name: [attribute path]}, defaults to TARGETS
+        profile_rate (float): the share of calls run under cProfile, 0 for none
+    """
+    global _enabled, _profile_rate, _targets
+    disable()
+    _enabled = True
+    _profile_rate = profile_rate
+    _targets = TARGETS if targets is None else targets
+    refresh()
+
+
+def refresh() -> None:
+    """ Instrument the target modules imported since enable, e.g. by a
+        lazy import """
+    if not _enabled:
+        return
+    for module_name, attributes in _targets.items():
+        module = sys.modules.get(module_name)
+        if module is None or module_name in _instrumented:
+            continue
+        _instrumented.add(module_name)
+        for path in attributes:
+            *owners, attribute = path.split('.')
+            owner = functools.reduce(getattr, owners, module)
+            if attribute not in vars(owner):
+                continue
+            function = getattr(owner, attribute)
+            _patch(owner, attribute, function.__qualname__)
+
+
+def disable() -> None:
+    """ Put the original functions back, the metrics recorded are kept """
+    global _enabled, _profile_rate
+    while _patched:
+        owner, attribute, original = _patched.pop()
+        setattr(owner, attribute, original)
+    _instrumented.clear()
+    _enabled = False
+    _profile_rate = 0.0
+
+
+def enabled() -> bool:
+    """ Return True while instrumentation is enabled """
+    return _enabled
+
+
+class _Timer:
+    """ The context manager of timer """
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+def timer(name: str):
+    """ Return a context manager recording the time of its block as name, e.g.
+        a command. It does nothing while instrumentation is disabled """
+    if not _enabled:
+        return contextlib.nullcontext()
+    return _Timer(METRICS.histogram(name))
+
+
+def enable_from_env() -> str:
+    """ Enable instrumentation if the BOOKS_METRICS environment variable is set,
+        with the BOOKS_PROFILE sample rate
+
+    Return:
+        filename (str): the metrics file to write, None if disabled
+    """
+    filename = os.environ.get(METRICS_ENV)
+    if filename:
+        enable(profile_rate=float(os.environ.get(PROFILE_ENV) or 0))
+    return filename
+
+
+def write_metrics(filename: str, metrics: Metrics = METRICS) -> None:
+    """ Write the metrics, in the Prometheus text format for a .prom file and
+        as a table otherwise, and the cProfile samples to <filename>.pstats """
+    text = metrics.to_prometheus() if filename.endswith('.prom') else metrics.to_text()
+    temporary = filename + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temporary, filename)
+    if metrics.profile is not None:
+        metrics.profile.dump_stats(filename + '.pstats')
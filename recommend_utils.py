@@ -0,0 +1,334 @@
+"""
+recommend_utils makes personal recommendations with item-item collaborative
+filtering: two books are similar when the same users rate them alike (cosine
+similarity of their columns in the user x book rating matrix), and a user is
+recommended the books most similar to the ones they rated.
+
+The matrix is sparse, kept as NumPy arrays in both row (CSR, by user) and
+column (CSC, by book) order. New ratings update it in place, or are held in
+small dicts until merge_every of them are merged into the arrays. A removed
+rating is kept in the arrays as a rate of 0 until the next merge.
+Similar books are computed per book on first use and cached.
+
+Classes included: Recommender
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import threading
+from typing import Iterable, List, Tuple
+import numpy as np
+from books_utils import Book, parse_rate
+from users_utils import User, UserStore
+
+# rates above it count for the similar books, rates below against them
+NEUTRAL_RATE = 2.5
+
+
+class Recommender:
+    """ An item-item collaborative filtering recommender.
+
+    Attributes:
+        neighbors (int): the number of similar books kept per book
+        merge_every (int): new ratings held in dicts before they are merged
+                           into the arrays
+        users (dict): {user name: row}
+        user_names (list): the user name of every row
+        books (dict): {book id: column}
+        book_ids (list): the book id of every column
+
+    A new rating refreshes the similar books of the book rated and of the
+    other books of its user, the similarities that changed the most; other
+    books pick up the change when their own ratings do.
+    """
+
+    def __init__(self, neighbors: int = 50, merge_every: int = 100_000):
+        """ Constructor of the Recommender object, with no ratings
+
+        Args:
+            neighbors (int): the number of similar books kept per book
+            merge_every (int): new ratings held in dicts before a merge
+        """
+        self.neighbors = neighbors
+        self.merge_every = merge_every
+        self._lock = threading.RLock()
+        self.load([], [], [])
+
+    @classmethod
+    def from_store(cls, store: UserStore, **kwargs) -> 'Recommender':
+        """ Build a Recommender from the rates saved in a UserStore, one query
+            instead of decoding the comments of every book
+
+        Args:
+            store (UserStore): the users database
+            kwargs: the Recommender constructor arguments
+        """
+        recommender = cls(**kwargs)
+        recommender.load(*store.all_rates())
+        return recommender
+
+    @classmethod
+    def from_books(cls, books: Iterable[Book], **kwargs) -> 'Recommender':
+        """ Build a Recommender from the rates saved in Book.comments, for a
+            catalog without a UserStore
+
+        Args:
+            books (Iterable[Book]): e.g. BookList.books
+            kwargs: the Recommender constructor arguments
+        """
+        recommender = cls(**kwargs)
+        users, ids, rates = [], [], []
+        for book in books:
+            for user, comment in book.comments.items():
+                rate = parse_rate(comment)
+                if rate is not None:
+                    users.append(user)
+                    ids.append(book.id)
+                    rates.append(rate)
+        recommender.load(users, ids, rates)
+        return recommender
+
+    def load(self, users, ids, rates) -> None:
+        """ Replace all ratings, e.g. with a historical export
+
+        Args:
+            users: the user name of every rating, a sequence or an array
+            ids: the book id of every rating
+            rates: the rates, a later rating of a user for a book wins
+        """
+        user_names, rows = np.unique(np.asarray(users), return_inverse=True)
+        book_ids, cols = np.unique(np.asarray(ids, dtype=np.int64), return_inverse=True)
+        with self._lock:
+            self.user_names = user_names.tolist()
+            self.users = {name: row for row, name in enumerate(self.user_names)}
+            self.book_ids = book_ids.tolist()
+            self.books = {id: col for col, id in enumerate(self.book_ids)}
+            self._build(rows.astype(np.int32), cols.astype(np.int32),
+                        np.asarray(rates, dtype=np.float32))
+
+    def _build(self, rows: np.ndarray, cols: np.ndarray, rates: np.ndarray) -> None:
+        """ Build the CSR and CSC arrays from (row, column, rate) triples """
+        users, books = len(self.user_names), len(self.book_ids)
+        # by row, then column, the last rating of a pair wins. One int64 key
+        # sorts about twice as fast as np.lexsort on the two columns
+        keys = rows.astype(np.int64) * max(books, 1) + cols
+        order = np.argsort(keys, kind='stable')
+        keys, rows, cols, rates = keys[order], rows[order], cols[order], rates[order]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        # removed ratings are dropped
+        last &= rates != 0
+        rows, cols, rates = rows[last], cols[last], rates[last]
+        self._row_ptr = np.zeros(users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=users), out=self._row_ptr[1:])
+        self._row_cols, self._row_rates = cols, rates
+        # a stable sort keeps the rows of every column in order
+        order = np.argsort(cols, kind='stable')
+        self._col_ptr = np.zeros(books + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=books), out=self._col_ptr[1:])
+        self._col_rows, self._col_rates = rows[order], rates[order]
+        self._norms = np.bincount(cols, weights=rates.astype(np.float64) ** 2, minlength=books)
+        self._extra_rows = {}
+        self._extra_cols = {}
+        self._extra_count = 0
+        self._similar = {}
+
+    def compact(self) -> None:
+        """ Merge the ratings held in dicts into the arrays """
+        with self._lock:
+            rows = [np.repeat(np.arange(len(self._row_ptr) - 1, dtype=np.int32),
+                              np.diff(self._row_ptr))]
+            cols, rates = [self._row_cols], [self._row_rates]
+            for row, extras in self._extra_rows.items():
+                rows.append(np.full(len(extras), row, dtype=np.int32))
+                cols.append(np.fromiter(extras.keys(), dtype=np.int32, count=len(extras)))
+                rates.append(np.fromiter(extras.values(), dtype=np.float32, count=len(extras)))
+            similar = self._similar
+            self._build(np.concatenate(rows), np.concatenate(cols), np.concatenate(rates))
+            # merging moves ratings, it does not change them
+            self._similar = similar
+
+    def _row(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Return the columns and rates of a user """
+        cols, rates = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if row < len(self._row_ptr) - 1:
+            start, end = self._row_ptr[row], self._row_ptr[row + 1]
+            cols, rates = self._row_cols[start: end], self._row_rates[start: end]
+        extras = self._extra_rows.get(row)
+        if extras:
+            cols = np.concatenate([cols, np.fromiter(extras.keys(), dtype=np.int32)])
+            rates = np.concatenate([rates, np.fromiter(extras.values(), dtype=np.float32)])
+        rated = rates != 0
+        return cols[rated], rates[rated]
+
+    def _column(self, col: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Return the rows and rates of a book """
+        rows, rates = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if col < len(self._col_ptr) - 1:
+            start, end = self._col_ptr[col], self._col_ptr[col + 1]
+            rows, rates = self._col_rows[start: end], self._col_rates[start: end]
+        extras = self._extra_cols.get(col)
+        if extras:
+            rows = np.concatenate([rows, np.fromiter(extras.keys(), dtype=np.int32)])
+            rates = np.concatenate([rates, np.fromiter(extras.values(), dtype=np.float32)])
+        return rows, rates
+
+    def _update(self, row: int, col: int, rate: float) -> float:
+        """ Change a rating that is in the arrays, return the old rate or None """
+        if row >= len(self._row_ptr) - 1 or col >= len(self._col_ptr) - 1:
+            return None
+        start, end = self._row_ptr[row], self._row_ptr[row + 1]
+        i = start + np.searchsorted(self._row_cols[start: end], col)
+        if i == end or self._row_cols[i] != col:
+            return None
+        old = float(self._row_rates[i])
+        self._row_rates[i] = rate
+        start, end = self._col_ptr[col], self._col_ptr[col + 1]
+        self._col_rates[start + np.searchsorted(self._col_rows[start: end], row)] = rate
+        return old
+
+    def add_rating(self, user: str, id: int, rate: float) -> None:
+        """ Add or change one rating
+
+        Args:
+            user (str): user name
+            id (int): unique book id
+            rate (float): the rate, e.g. 1 to 5
+        """
+        with self._lock:
+            row = self.users.get(user)
+            if row is None:
+                row = self.users[user] = len(self.user_names)
+                self.user_names.append(user)
+            col = self.books.get(id)
+            if col is None:
+                col = self.books[id] = len(self.book_ids)
+                self.book_ids.append(id)
+                self._norms = np.append(self._norms, 0.0)
+            old = self._update(row, col, rate)
+            if old is None:
+                extras = self._extra_rows.setdefault(row, {})
+                old = extras.get(col)
+                if old is None:
+                    self._extra_count += 1
+                extras[col] = rate
+                self._extra_cols.setdefault(col, {})[row] = rate
+            self._norms[col] += rate * rate - (old or 0.0) ** 2
+            self._similar.pop(col, None)
+            for other in self._row(row)[0].tolist():
+                self._similar.pop(other, None)
+            if self._extra_count >= self.merge_every:
+                self.compact()
+
+    def remove_rating(self, user: str, id: int) -> None:
+        """ Remove the rating of a user for a book, if there is one
+
+        Args:
+            user (str): user name
+            id (int): unique book id
+        """
+        with self._lock:
+            row, col = self.users.get(user), self.books.get(id)
+            if row is None or col is None:
+                return
+            extras = self._extra_rows.get(row, {})
+            if col in extras:
+                old = extras.pop(col)
+                del self._extra_cols[col][row]
+                self._extra_count -= 1
+            else:
+                old = self._update(row, col, 0.0)
+                if not old:
+                    return
+            self._norms[col] -= old * old
+            self._similar.pop(col, None)
+            for other in self._row(row)[0].tolist():
+                self._similar.pop(other, None)
+
+    def add_user(self, user: User) -> None:
+        """ Add or change the ratings of a user, see users_utils.User.rates """
+        for id, rate in user.rates.items():
+            self.add_rating(user.name, id, rate)
+
+    def record(self, book: Book, event: str, args: tuple) -> None:
+        """ Learn the rates of new comments and forget those of removed
+            ones, a BookList listener like journal_utils.Journal.record """
+        if event == 'comment':
+            user, rate, _ = args
+            if str(rate).isnumeric():
+                self.add_rating(user, book.id, int(rate))
+        elif event == 'remove_comment':
+            self.remove_rating(args[0], book.id)
+
+    def _neighbors(self, col: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Return the most similar columns of a column and their similarity """
+        with self._lock:
+            cached = self._similar.get(col)
+            if cached is not None:
+                return cached
+            rows, rates = self._column(col)
+            # every user of the book adds rate x rate to each book they rated,
+            # the rows in the arrays are gathered in one pass
+            base = rows < len(self._row_ptr) - 1
+            starts, ends = self._row_ptr[rows[base]], self._row_ptr[rows[base] + 1]
+            lengths = ends - starts
+            gather = (np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                      + np.arange(lengths.sum()))
+            dots = np.bincount(self._row_cols[gather],
+                               weights=self._row_rates[gather] * np.repeat(rates[base], lengths),
+                               minlength=len(self.book_ids))
+            for row, rate in zip(rows.tolist(), rates.tolist()):
+                for other, other_rate in self._extra_rows.get(row, {}).items():
+                    dots[other] += rate * other_rate
+            dots[col] = 0
+            others = np.flatnonzero(dots)
+            sims = dots[others] / np.sqrt(self._norms[col] * self._norms[others])
+            if len(others) > self.neighbors:
+                top = np.argpartition(-sims, self.neighbors - 1)[: self.neighbors]
+                others, sims = others[top], sims[top]
+            self._similar[col] = (others, sims)
+            return others, sims
+
+    def similar_books(self, id: int, n: int = 10) -> List[Tuple[int, float]]:
+        """ Return the books most similar to a book
+
+        Args:
+            id (int): unique book id
+            n (int): the number of books, at most neighbors
+
+        Return:
+            similar (List[Tuple[int, float]]): (book id, cosine similarity),
+                                               most similar first
+        """
+        col = self.books.get(id)
+        if col is None:
+            return []
+        others, sims = self._neighbors(col)
+        order = np.lexsort((others, -sims))[: n]
+        return [(self.book_ids[other], float(sim)) for other, sim in
+                zip(others[order].tolist(), sims[order].tolist())]
+
+    def recommend(self, user: str, n: int = 10) -> List[int]:
+        """ Return the ids of the books recommended to a user
+
+        Args:
+            user (str): user name
+            n (int): the number of books
+
+        Return:
+            ids (List[int]): the best first, books the user rated are left
+                             out, empty for a user with no ratings
+        """
+        row = self.users.get(user)
+        if row is None:
+            return []
+        with self._lock:
+            cols, rates = self._row(row)
+            scores = np.zeros(len(self.book_ids))
+            for col, rate in zip(cols.tolist(), rates.tolist()):
+                others, sims = self._neighbors(col)
+                scores[others] += sims * (rate - NEUTRAL_RATE)
+            scores[cols] = 0
+        candidates = np.flatnonzero(scores > 0)
+        order = np.lexsort((candidates, -scores[candidates]))[: n]
+        return [self.book_ids[col] for col in candidates[order].tolist()]
@@ -1,21 +1,48 @@
 """ 
 This is the main entry point for the application. 
 
+The catalog loads in a background thread while the welcome message and the 
+user name prompt run, and the modules that need numpy are imported there, so 
+the first prompt shows up without waiting for them. 
+
+The catalog is kept in SQLite, so saving a session only writes the books 
+that changed. data/books.xlsx is the catalog shipped with the app, it is 
+imported once on the first start. 
+
 NAME: Tianzi Qin
 SEMESTER: Spring 23
 """
+import os
 import books_utils
+import journal_utils
+import metrics_utils
+import storage_utils
 import users_utils
 import view
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Tuple
+if TYPE_CHECKING:
+    import recommend_utils
+    import search_utils
+
+BOOKS_FILE = 'data/books.sqlite'
+# imported into BOOKS_FILE when it does not exist yet
+CATALOG_FILE = 'data/books.xlsx'
+JOURNAL_FILE = BOOKS_FILE + '.journal'
+# compiled from BOOKS_FILE, mapped instead of parsed while it is up to date
+SNAPSHOT_FILE = BOOKS_FILE + '.snapshot'
+USERS_FILE = 'data/users.sqlite'
 
 
-def run_search(books_list: books_utils.BookList, args: Tuple) -> books_utils.Book: 
+def run_search(books_list: books_utils.BookList, args: Tuple, 
+               engines: Dict[str, 'search_utils.SearchEngine'] = None) -> books_utils.Book: 
     """ Handle situations that show one search result and multiple search results
     
     Args:   
         books_list (books_utils.BookList)   
         args (tuple): search condition
+        engines (dict): {"name" / "author": search_utils.SearchEngine}, used for 
+                        the closest matches when nothing contains the search text
         
     Return: 
         book (books_utils.Book): Should always be one book, since the id is unique
@@ -25,14 +52,19 @@ def run_search(books_list: books_utils.BookList, args: Tuple) -> books_utils.Boo
         value = args[1]
         if type == "id":
             result = books_list.find_by_id(value)
+        # one result more than a page tells whether there are more pages
         if type == "name":
-            result = books_list.find_by_name(value)
+            result = books_list.find_by_name(value, limit=view.PAGE_SIZE + 1)
         if type == "author":
-            result = books_list.find_by_author(value)
+            result = books_list.find_by_author(value, limit=view.PAGE_SIZE + 1)
+        more = len(result) > view.PAGE_SIZE
+        if len(result) == 0 and engines is not None and type in engines: 
+            result = engines[type].search(value, view.PAGE_SIZE)
+        result = result[: view.PAGE_SIZE]
         if len(result) == 1:
             book = result[0]
         elif len(result) > 1:
-            view.display_search(result)
+            view.display_search(result, more)
             search_list = books_utils.BookList(result)
             book = view.multi_search(search_list)
         view.display_book(book)
@@ -42,6 +74,27 @@ def run_search(books_list: books_utils.BookList, args: Tuple) -> books_utils.Boo
             "No eligible results, please check your search condition. ")
 
 
+def run_recommend(books_list: books_utils.BookList, recommender: 'recommend_utils.Recommender', 
+                  user: users_utils.User, args: str) -> None: 
+    """ Show the top books of a genre, or the books recommended to the user for "me" 
+
+    Args:   
+        books_list (books_utils.BookList)   
+        recommender (recommend_utils.Recommender)   
+        user (users_utils.User)  
+        args (str): a genre or "me"
+    """
+    if args != "me":
+        view.display_board(books_list.top_books(args))
+        return
+    board = [book for id in recommender.recommend(user.name) 
+             for book in books_list.find_by_id(id)]
+    if len(board) == 0:
+        view.print_error("Rate a few books first, recommendations are based on your rates")
+    else:
+        view.display_board(board)
+
+
 def run_bookinfo(user: users_utils.User, book: books_utils.Book,
                  shelf: books_utils.BookShelf) -> None: 
     """ Handle all operations after enter the book profile, including adding rate and comment, 
@@ -74,15 +127,71 @@ def run_bookinfo(user: users_utils.User, book: books_utils.Book,
         shelf.add_collect(book)
 
 
+def import_catalog(books_file: str, catalog_file: str, 
+                   store: users_utils.UserStore = None) -> None: 
+    """ Create the books file from a catalog in another format, e.g. xlsx, 
+        unless it exists already 
+
+    Args: 
+        books_file (str): the books file the app reads and saves 
+        catalog_file (str): the catalog it starts from 
+        store (users_utils.UserStore): also gets the rates of the catalog's 
+                                       comments, which the recommender learns 
+    """
+    if not os.path.exists(books_file): 
+        columns = storage_utils.read_columns(catalog_file)
+        if store is not None: 
+            store.import_rates(books_utils.Book.from_columns(columns))
+        storage_utils.write_columns(books_file, columns)
+
+
+def load_session(books_file: str, snapshot_file: str, store: users_utils.UserStore) -> Tuple[
+        books_utils.BookList, Dict[str, 'search_utils.SearchEngine'], 'recommend_utils.Recommender']: 
+    """ Load the catalog, and build its search engines and its recommender 
+
+    Args: 
+        books_file (str): the books file 
+        snapshot_file (str): its snapshot, see snapshot_utils.load_catalog 
+        store (users_utils.UserStore): the saved rates the recommender starts from 
+
+    Return: 
+        books_list, engines, recommender: the recommender learns the rates of 
+                                          new comments 
+    """
+    import recommend_utils
+    import search_utils
+    import snapshot_utils
+    metrics_utils.refresh()
+    books_list = snapshot_utils.load_catalog(books_file, snapshot_file)
+    engines = {field: search_utils.SearchEngine(books_list, field) for field in ('name', 'author')}
+    recommender = recommend_utils.Recommender.from_store(store)
+    books_list.listeners.append(recommender.record)
+    return books_list, engines, recommender
+
+
 def main():  
     """
     This is the main entry point for the application.
     """
-    view.print_welcome()
-    user_name = view.get_user()
-    user = users_utils.User(user_name)
-    books_list = books_utils.load_books('data/books.xlsx')
-    shelf = books_utils.BookShelf(user.name)
+    # timings of the session, written to the file set in BOOKS_METRICS
+    metrics_file = metrics_utils.enable_from_env()
+    # the rates, comments and bookshelves saved in earlier sessions
+    store = users_utils.UserStore(USERS_FILE)
+    with ThreadPoolExecutor(max_workers=1) as executor: 
+        import_catalog(BOOKS_FILE, CATALOG_FILE, store)
+        session = executor.submit(load_session, BOOKS_FILE, SNAPSHOT_FILE, store)
+        view.print_welcome()
+        user_name = view.get_user()
+        user, shelf = store.load(user_name)
+        books_list, engines, recommender = session.result()
+    # ratings, comments and collects of a session that did not exit cleanly
+    journal = journal_utils.Journal(JOURNAL_FILE)
+    if journal.replay(books_list, shelf) > 0:
+        journal.compact(books_list, BOOKS_FILE)
+        store.save(user, shelf)
+    journal.attach(books_list, shelf)
+    store.attach(user, shelf)
+    books_list.listeners.append(user.book_changed)
     view.print_help()
     done = False
     while not done:
@@ -91,23 +200,28 @@ def main():
             command, args = commands
         else:
             command = commands
-        if command == view.Menu.SEARCH:
-            book = run_search(books_list, args)
-            if book:
-                run_bookinfo(user, book, shelf)
-        elif command == view.Menu.RECOMMEND:
-            board = books_list.top_books(args)
-            view.display_board(board)
-        elif command == view.Menu.BOOKSHELF:
-            view.display_shelf(user, shelf)
-        elif command == view.Menu.HELP:
-            view.print_menu()
-        elif command == view.Menu.EXIT:
-            done = True
-        else:
-            view.print_error(f"Unknown command")
-            view.print_menu()
-    books_utils.save_books('data/books.xlsx', books_list)
+        # the time of a command includes the prompts it shows
+        with metrics_utils.timer(f"command {getattr(command, 'name', 'unknown').lower()}"):
+            if command == view.Menu.SEARCH:
+                book = run_search(books_list, args, engines)
+                if book:
+                    run_bookinfo(user, book, shelf)
+            elif command == view.Menu.RECOMMEND:
+                run_recommend(books_list, recommender, user, args)
+            elif command == view.Menu.BOOKSHELF:
+                view.display_shelf(user, shelf)
+            elif command == view.Menu.HELP:
+                view.print_menu()
+            elif command == view.Menu.EXIT:
+                done = True
+            else:
+                view.print_error(f"Unknown command")
+                view.print_menu()
+    journal.compact(books_list, BOOKS_FILE)
+    journal.close()
+    store.close()
+    if metrics_file:
+        metrics_utils.write_metrics(metrics_file)
     view.print_goodbye()
 
 
@@ -0,0 +1,256 @@
+"""
+search_utils is a typo-tolerant search engine on top of a BookList. Book
+names (or authors) are split into words, and every query word is matched
+against the vocabulary by edit distance (a SymSpell-style index of deletes)
+and, for longer words, by prefix. Results are ranked by how well they match,
+with Book.score breaking near-ties, e.g. "hary poter" finds "Harry Potter".
+
+Classes included: SearchEngine
+Functions included: tokenize, edit_distance, max_edits
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import math
+import re
+import threading
+from bisect import bisect_left
+from itertools import combinations
+from typing import Dict, List, Set, Tuple
+import numpy as np
+from books_utils import RATING_EVENTS, Book
+
+# words longer than this are only indexed by their first PREFIX_LENGTH
+# characters in the deletes index, like SymSpell, which keeps it small
+PREFIX_LENGTH = 7
+# a query word of at least this many characters also matches longer words
+# starting with it, e.g. "hung" matches "hunger"
+MIN_PREFIX = 3
+# the share of the ranking decided by Book.score, a match that is better
+# by more than this always comes first
+SCORE_WEIGHT = 0.2
+
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """ Split a text into lowercased words
+
+    Args:
+        text (str): e.g. a book name
+
+    Return:
+        words (List[str]): the words in text order
+    """
+    return WORD.findall(text.lower())
+
+
+def max_edits(word: str) -> int:
+    """ Return the number of typos tolerated in a query word, none for very
+        short words, which would match almost anything otherwise """
+    if len(word) <= 2:
+        return 0
+    if len(word) <= 5:
+        return 1
+    return 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """ Return the edit distance between two words, counting insertions,
+        deletions, substitutions and swaps of adjacent characters
+
+    Args:
+        a (str), b (str): the words
+        limit (int): the largest distance of interest, larger ones are
+                     returned as limit + 1 without being computed exactly
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[len(b)], limit + 1)
+
+
+def _deletes(word: str, count: int) -> Set[str]:
+    """ Return the strings made by deleting up to count characters from the
+        first PREFIX_LENGTH characters of word, word's prefix included """
+    word = word[: PREFIX_LENGTH]
+    result = {word}
+    for n in range(1, min(count, len(word)) + 1):
+        for positions in combinations(range(len(word)), n):
+            result.add(''.join(char for i, char in enumerate(word) if i not in positions))
+    return result
+
+
+class SearchEngine:
+    """ A ranked, typo-tolerant search over one field of a BookList.
+
+    Attributes:
+        books_list (BookList or ColumnarBookList): the books searched
+        field (str): "name" or "author"
+        ids (np.ndarray): the id of every book indexed, a row per book
+        postings (dict): {word: array of the rows containing it}
+        vocabulary (List[str]): the sorted distinct words, for prefix matching
+        scores (np.ndarray): Book.score of every row
+
+    The index is built on the first search, so creating an engine costs
+    nothing at startup. It follows rating changes through
+    books_list.listeners, and is rebuilt on the next search after books are
+    added or removed. Lists with columns (ColumnarBookList, SnapshotBookList)
+    are indexed from them, Book objects are only looked up for the results.
+    """
+
+    def __init__(self, books_list, field: str = 'name'):
+        """ Constructor of the SearchEngine object, for books_list
+
+        Args:
+            books_list (BookList): the books to search
+            field (str): the Book attribute searched, "name" or "author"
+        """
+        self.books_list = books_list
+        self.field = field
+        self._lock = threading.Lock()
+        # not built yet, see _refresh
+        self._version = None
+        self._rows = {}
+        books_list.listeners.append(self._book_changed)
+
+    def _refresh(self) -> None:
+        """ Build the index on first use, and again after books are added or removed """
+        with self._lock:
+            if self._version != self.books_list.catalog_version:
+                self._build()
+
+    def _build(self) -> None:
+        """ Index the words of every book """
+        self._version = self.books_list.catalog_version
+        if hasattr(self.books_list, 'text_column'):
+            self.ids = np.array(self.books_list.ids, dtype=np.int64)
+            texts = self.books_list.text_column(self.field)
+            self.scores = np.array(self.books_list.scores, dtype=np.float64)
+        else:
+            books = list(self.books_list.books)
+            self.ids = np.array([book.id for book in books], dtype=np.int64)
+            texts = [getattr(book, self.field) for book in books]
+            self.scores = np.array([book.score for book in books], dtype=np.float64)
+        self._rows = {id: row for row, id in enumerate(self.ids.tolist())}
+        rows = {}
+        for row, text in enumerate(texts):
+            for word in set(tokenize(text)):
+                rows.setdefault(word, []).append(row)
+        self.postings = {word: np.array(ids, dtype=np.int32) for word, ids in rows.items()}
+        self.vocabulary = sorted(self.postings)
+        self._index = {}
+        for word in self.vocabulary:
+            for delete in _deletes(word, max_edits(word)):
+                self._index.setdefault(delete, []).append(word)
+
+    def _book_changed(self, book: Book, event: str, args: tuple) -> None:
+        """ Keep the score of a rated book current, a BookList listener """
+        if event in RATING_EVENTS:
+            row = self._rows.get(book.id)
+            if row is not None:
+                self.scores[row] = book.score
+
+    def _idf(self, word: str) -> float:
+        """ The inverse document frequency of an indexed word """
+        return math.log(1 + len(self.ids) / len(self.postings[word]))
+
+    def _idf_unknown(self) -> float:
+        """ The weight of a query word nothing matches, like the rarest word """
+        return math.log(1 + len(self.ids))
+
+    def match_word(self, query: str, prefix: bool = True) -> Dict[str, float]:
+        """ Return the vocabulary words matching one query word
+
+        Args:
+            query (str): a lowercased query word
+            prefix (bool): also match words starting with query
+
+        Return:
+            matches (Dict[str, float]): {word: similarity}, 1.0 for the word
+                                        itself and less for typos and prefixes
+        """
+        self._refresh()
+        limit = max_edits(query)
+        matches = {}
+        candidates = set()
+        for delete in _deletes(query, limit):
+            candidates.update(self._index.get(delete, ()))
+        for word in candidates:
+            distance = edit_distance(query, word, limit)
+            if distance <= limit:
+                matches[word] = 1 - distance / (len(query) + 1)
+        if prefix and len(query) >= MIN_PREFIX:
+            start = bisect_left(self.vocabulary, query)
+            for word in self.vocabulary[start:]:
+                if not word.startswith(query):
+                    break
+                # a completion is worth less than a typo-free whole word
+                matches[word] = max(matches.get(word, 0), 0.9 * len(query) / len(word))
+        return matches
+
+    def relevance(self, query: str) -> np.ndarray:
+        """ Return how well every row matches a query, from 0 (no query word
+            matches) to 1 (every query word is in the book) """
+        self._refresh()
+        relevance = np.zeros(len(self.ids), dtype=np.float64)
+        words = tokenize(query)
+        best = 0.0
+        for position, word in enumerate(words):
+            # only the last word may be unfinished
+            matches = self.match_word(word, prefix=position == len(words) - 1)
+            if len(matches) == 0:
+                best += self._idf_unknown()
+                continue
+            # the query word weighs as much as the word it most likely means,
+            # rare words tell more about a match than common ones
+            closest = max(matches, key=lambda match: (matches[match], len(self.postings[match])))
+            weight = self._idf(closest)
+            best += weight
+            # a book with several matches of one query word counts the best one
+            scores = np.zeros(len(self.ids), dtype=np.float64)
+            for match in sorted(matches, key=matches.get):
+                scores[self.postings[match]] = matches[match] * weight
+            relevance += scores
+        return relevance / best if best > 0 else relevance
+
+    def search(self, query: str, k: int = 10) -> List[Book]:
+        """ Return the k best matches of a query
+
+        Args:
+            query (str): one or more words, typos allowed
+            k (int): the number of results
+
+        Return:
+            result (List[Book]): the best matches first, ties in list order
+        """
+        return [book for book, _ in self.search_scored(query, k)]
+
+    def search_scored(self, query: str, k: int = 10) -> List[Tuple[Book, float]]:
+        """ Like search, with the ranking value of every result """
+        relevance = self.relevance(query)
+        rows = np.flatnonzero(relevance > 0)
+        if len(rows) == 0:
+            return []
+        popularity = np.log1p(np.maximum(self.scores[rows], 0))
+        if popularity.max() > 0:
+            popularity /= popularity.max()
+        ranking = relevance[rows] + SCORE_WEIGHT * popularity
+        if len(rows) > k:
+            # everything tied with the k-th best stays, for a stable order
+            kth = -np.partition(-ranking, k - 1)[k - 1]
+            top = ranking >= kth
+            rows, ranking = rows[top], ranking[top]
+        # best first, ties in list order
+        order = np.lexsort((rows, -ranking))[: k]
+        return [(self.books_list.find_by_id(id)[0], float(ranking[i])) for i, id in
+                zip(order, self.ids[rows[order]].tolist())]
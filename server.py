@@ -0,0 +1,280 @@
+"""
+A multi-user server mode for the application. It shares one BookList between
+many concurrent users and exposes the search, recommend, rate / comment and
+bookshelf operations of run.py as a local HTTP json API:
+
+    GET  /search?type=name&value=harry     search by id, name or author,
+                  &limit=20&offset=0      optional paging
+    GET  /book?id=1                        a book profile with comments
+    GET  /recommend?genre=fiction&rank=10  top books of a genre, &scorer=bayesian
+                                           ranks them by their Bayesian average
+    GET  /recommend?user=sophie&rank=10    books picked from a user's rates
+    GET  /shelf?user=sophie                a user's bookshelf
+    GET  /metrics                          request and function latencies in the
+                                           Prometheus text format, see metrics_utils
+    POST /rate     {"user": "sophie", "id": 1, "rate": "5", "comment": "..."}
+    POST /collect  {"user": "sophie", "id": 1}
+
+Usage: python server.py [port]   (defaults to 8000)
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+import books_utils
+import journal_utils
+import metrics_utils
+import recommend_utils
+import snapshot_utils
+import users_utils
+from run import (BOOKS_FILE, CATALOG_FILE, JOURNAL_FILE, SNAPSHOT_FILE, USERS_FILE,
+                 import_catalog)
+
+
+def book_info(book: books_utils.Book, details: bool = False) -> dict:
+    """ Return a book as a json-ready dict
+
+    Args:
+        book (books_utils.Book)
+        details (bool): add genre, intro and comments, like view.display_book
+    """
+    info = {'id': book.id, 'name': book.name, 'author': book.author,
+            'rating': book.rating, 'reviews': book.reviews}
+    if details:
+        info.update(genre=book.genre, intro=book.intro, comments=book.comments)
+    return info
+
+
+class BookService:
+    """ The operations of run.py for many users sharing one BookList.
+
+    Attributes:
+        books_list (books_utils.BookList): the shared books
+        journal (journal_utils.Journal): records every change, may be None
+        recommender (recommend_utils.Recommender): learns from every rate, may be None
+        store (users_utils.UserStore): loads and saves users, may be None
+        users (dict): {user name: (users_utils.User, books_utils.BookShelf)}
+    """
+
+    def __init__(self, books_list: books_utils.BookList,
+                 journal: journal_utils.Journal = None,
+                 recommender: recommend_utils.Recommender = None,
+                 store: users_utils.UserStore = None):
+        """ Constructor of the BookService object. """
+        self.books_list = books_list
+        self.journal = journal
+        self.recommender = recommender
+        self.store = store
+        if recommender is not None:
+            books_list.listeners.append(recommender.record)
+        self.users = {}
+        self._users_lock = threading.Lock()
+        if journal is not None:
+            journal.attach(books_list)
+        books_list.listeners.append(self._book_changed)
+
+    def get_user(self, name: str) -> Tuple[users_utils.User, books_utils.BookShelf]:
+        """ Return the user and bookshelf of a name, loaded from the store or
+            created on first use """
+        with self._users_lock:
+            if name not in self.users:
+                if self.store is not None:
+                    user, shelf = self.store.load(name)
+                    self.store.attach(user, shelf)
+                else:
+                    user, shelf = users_utils.User(name), books_utils.BookShelf(name)
+                if self.journal is not None:
+                    shelf.listeners.append(self.journal.record)
+                self.users[name] = (user, shelf)
+            return self.users[name]
+
+    def _book_changed(self, book: books_utils.Book, event: str, args: tuple) -> None:
+        """ Forget the rate and comment of a user whose comment was removed,
+            a BookList listener """
+        if event == 'remove_comment' and (self.store is not None or args[0] in self.users):
+            user, _ = self.get_user(args[0])
+            user.remove(book.id)
+
+    def get_book(self, id) -> books_utils.Book:
+        """ Return the book with an id, raises KeyError if there is none """
+        result = self.books_list.find_by_id(id)
+        if len(result) == 0:
+            raise KeyError(f"No book with id {id}")
+        return result[0]
+
+    def search(self, type: str, value: str, limit: int = None, offset: int = 0) -> List[dict]:
+        """ Search books like run.run_search, type is id, name or author,
+            limit and offset select one page of the name / author results """
+        if type == 'id':
+            result = self.books_list.find_by_id(value)
+        elif type == 'name':
+            result = self.books_list.find_by_name(value, limit, offset)
+        elif type == 'author':
+            result = self.books_list.find_by_author(value, limit, offset)
+        else:
+            raise ValueError(f"Unknown search type {type}")
+        return [book_info(book) for book in result]
+
+    def recommend(self, genre: str, rank: int = 10, scorer: str = 'score') -> List[dict]:
+        """ Return the top books of a genre, scorer names one of books_utils.SCORERS """
+        if scorer not in books_utils.SCORERS:
+            raise ValueError(f"Unknown scorer {scorer}")
+        # None reads the kept leaderboard of Book.score
+        scorer = None if scorer == 'score' else books_utils.SCORERS[scorer]
+        return [book_info(book) for book in self.books_list.top_books(genre, rank, scorer)]
+
+    def recommend_for(self, user_name: str, rank: int = 10) -> List[dict]:
+        """ Return the books recommended to a user, empty without a recommender
+            or before the user rates anything """
+        if self.recommender is None:
+            return []
+        return [book_info(self.get_book(id))
+                for id in self.recommender.recommend(user_name, rank)]
+
+    def rate(self, user_name: str, id, rate: str = '', comment: str = '') -> dict:
+        """ Rate and / or comment a book like run.run_bookinfo
+
+        Return:
+            dict: the updated book profile
+        """
+        user, _ = self.get_user(user_name)
+        book = self.get_book(id)
+        rate = str(rate)
+        if rate.isnumeric():
+            number = int(rate)
+            user.add_rate(book.id, number)
+            book.change_rating(number)
+        else:
+            rate = ''
+        if len(comment) > 0:
+            user.add_comment(book.id, comment)
+        if rate != '' or comment != '':
+            book.add_comment(user.name, rate, comment)
+        return book_info(book, details=True)
+
+    def collect(self, user_name: str, id) -> Dict[int, str]:
+        """ Add a book to a user's bookshelf, returns the bookshelf """
+        _, shelf = self.get_user(user_name)
+        shelf.add_collect(self.get_book(id))
+        return shelf.collects
+
+    def shelf(self, user_name: str) -> List[dict]:
+        """ Return a user's bookshelf like view.display_shelf """
+        user, shelf = self.get_user(user_name)
+        return [{'id': id, 'name': name, 'rate': user.rates.get(id)}
+                for id, name in shelf.collects.items()]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Maps the HTTP API to a BookService, set as the service class attribute """
+    service = None
+    # keep-alive connections, and no Nagle delay between headers and body
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status: int, body, content_type: str = 'application/json') -> None:
+        """ Send body as json, or as it is if it is text """
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method, name: str) -> None:
+        """ Run method and reply with its result, or with the error. The time 
+            of the request is recorded as name while metrics are enabled """
+        try:
+            with metrics_utils.timer(name):
+                result = method()
+            self._reply(200, result)
+        except KeyError as error:
+            self._reply(404, {'error': str(error.args[0])})
+        except (ValueError, TypeError) as error:
+            self._reply(400, {'error': str(error)})
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        routes = {
+            '/search': lambda: self.service.search(
+                query['type'], query['value'],
+                int(query['limit']) if 'limit' in query else None, int(query.get('offset', 0))),
+            '/book': lambda: book_info(self.service.get_book(query['id']), details=True),
+            '/recommend': lambda: (
+                self.service.recommend_for(query['user'], int(query.get('rank', 10)))
+                if 'user' in query else
+                self.service.recommend(query['genre'], int(query.get('rank', 10)),
+                                       query.get('scorer', 'score'))),
+            '/shelf': lambda: self.service.shelf(query['user'])}
+        if url.path == '/metrics':
+            self._reply(200, metrics_utils.METRICS.to_prometheus(), 'text/plain; version=0.0.4')
+            return
+        self._handle(routes.get(url.path, self._not_found),
+                     f"GET {url.path if url.path in routes else 'unknown'}")
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            body = None
+        if not isinstance(body, dict):
+            self._reply(400, {'error': 'The body must be a json object'})
+            return
+        routes = {
+            '/rate': lambda: self.service.rate(body['user'], body['id'],
+                                               body.get('rate', ''), body.get('comment', '')),
+            '/collect': lambda: self.service.collect(body['user'], body['id'])}
+        path = urlparse(self.path).path
+        self._handle(routes.get(path, self._not_found),
+                     f"POST {path if path in routes else 'unknown'}")
+
+    def _not_found(self):
+        raise KeyError(f"Unknown path {self.path}")
+
+    def log_message(self, format, *args) -> None:
+        """ Keep the console quiet, one line per request is too much under load """
+
+
+def make_server(service: BookService, port: int = 8000,
+                host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """ Return a threaded HTTP server for service, port 0 picks a free port """
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(port: int = 8000) -> None:
+    """ Serve data/books.sqlite until interrupted, then save it, users are
+        kept in data/users.sqlite """
+    metrics_file = metrics_utils.enable_from_env()
+    store = users_utils.UserStore(USERS_FILE)
+    import_catalog(BOOKS_FILE, CATALOG_FILE, store)
+    books_list = snapshot_utils.load_catalog(BOOKS_FILE, SNAPSHOT_FILE)
+    journal = journal_utils.Journal(JOURNAL_FILE)
+    if journal.replay(books_list) > 0:
+        journal.compact(books_list, BOOKS_FILE)
+    recommender = recommend_utils.Recommender.from_store(store)
+    server = make_server(BookService(books_list, journal, recommender, store), port)
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    journal.compact(books_list, BOOKS_FILE)
+    journal.close()
+    store.close()
+    if metrics_file:
+        metrics_utils.write_metrics(metrics_file)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
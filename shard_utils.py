@@ -0,0 +1,491 @@
+"""
+shard_utils splits a catalog too large for one process into shards, each a
+books_utils.BookList in its own worker process. Books are assigned to a
+shard by the hash of their id. Searches and leaderboards are scattered to
+every shard and their results gathered and merged in list order, and a
+book's changes are sent to the shard that owns it.
+
+Workers receive their columns packed like the shards of load_books, and
+each one builds the indexes of its own books, in parallel with the others.
+They are started like the workers of load_books, see
+storage_utils.worker_context.
+
+Classes included: ShardedBookList
+Functions included: shard_of, load_sharded
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import heapq
+import os
+import threading
+import weakref
+from array import array
+from itertools import chain, islice
+from typing import Dict, Iterator, List
+import storage_utils
+from books_utils import (RATING_EVENTS, Book, BookList, CacheInfo, CommentIndex, QueryCache,
+                         paginate, sum_ratings, unique_books, unique_columns, weighted_score)
+
+# the Book method that replays each event on the shard's copy of a book
+CHANGES = {'rate': 'change_rating', 'ratings': 'add_ratings',
+           'comment': 'add_comment', 'remove_comment': 'remove_comment'}
+
+
+def shard_of(id: int, shards: int) -> int:
+    """ Return the shard that owns a book id
+
+    Args:
+        id (int): unique book id
+        shards (int): the number of shards
+    """
+    return hash(int(id)) % shards
+
+
+class _Shard:
+    """ The books of one shard, served by a worker process. Books are sent
+    back as records, (position, total, row): the position of the book in
+    the whole catalog, its exact rating total and its values in COLUMNS
+    order. """
+
+    def __init__(self, packed: dict, positions: array):
+        columns = storage_utils.unpack_columns(packed)
+        books = Book.from_columns(columns)
+        # ShardedBookList caches the merged results
+        self.books_list = BookList(books, cache_size=0)
+        self.positions = dict(zip(columns['id'], positions))
+
+    def _record(self, book: Book) -> tuple:
+        """ Return the record of a book """
+        return self.positions[book.id], book.total, tuple(book.to_dict().values())
+
+    def books(self) -> list:
+        return [self._record(book) for book in self.books_list.books]
+
+    def find_by_id(self, id: int) -> list:
+        return [self._record(book) for book in self.books_list.find_by_id(id)]
+
+    def find_by_name(self, value: str, limit: int) -> list:
+        return [self._record(book) for book in self.books_list.find_by_name(value, limit)]
+
+    def find_by_author(self, value: str, limit: int) -> list:
+        return [self._record(book) for book in self.books_list.find_by_author(value, limit)]
+
+    def top_books(self, genre: str, rank: int, scorer) -> list:
+        return [self._record(book) for book in self.books_list.top_books(genre, rank, scorer)]
+
+    def add_book(self, position: int, total: float, row: tuple) -> None:
+        book = Book(*row)
+        book.total = total
+        self.positions[book.id] = position
+        self.books_list.add_book(book)
+
+    def remove_book(self, id: int) -> tuple:
+        record = self._record(self.books_list.remove_book(id))
+        del self.positions[id]
+        return record
+
+    def change(self, id: int, event: str, args: tuple) -> None:
+        getattr(self.books_list.index[id], CHANGES[event])(*args)
+
+    def apply_ratings(self, ids: list, totals: list, counts: list) -> list:
+        changed = []
+        for id, total, count in zip(ids, totals, counts):
+            book = self.books_list.index.get(id)
+            if book is not None:
+                book.add_ratings(total, count)
+                changed.append((self._record(book), total, count))
+        return changed
+
+
+def _serve(connection, packed: dict, positions: array) -> None:
+    """ The worker process of a shard: build it, then answer (method, args)
+        requests with (True, result) or (False, exception) until None """
+    shard = _Shard(packed, positions)
+    connection.send((True, None))
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            # the parent exited without close
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            reply = (True, getattr(shard, method)(*args))
+        except Exception as error:
+            reply = (False, error)
+        connection.send(reply)
+    connection.close()
+
+
+def _stop(connections: list, processes: list) -> None:
+    """ Ask the workers to exit and wait for them """
+    for connection in connections:
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+    for process in processes:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+
+class ShardedBookList(CommentIndex):
+    """ A drop-in replacement for books_utils.BookList whose books live in
+    worker processes, one BookList per shard.
+
+    Attributes:
+        shards (int): the number of shards and worker processes
+        source (str): the books file this list was last loaded from / saved to
+        dirty (set): ids of books added or changed since then
+        removed (set): ids of books removed since then
+        listeners (list): callables listener(book, event, args), called after
+                          an owned book changes
+        lock (threading.RLock): one request to the workers at a time
+        cache (QueryCache): recent merged query results, invalidated by
+                            versions and catalog_version like in BookList
+
+    Book objects handed out are cached by id and owned by this list, so
+    Book.change_rating on them is sent to their shard. The books property
+    gathers every book into this process, use it sparingly.
+    """
+
+    def __init__(self, books: List[Book], cache_size: int = 128, shards: int = None):
+        """ Constructor of the ShardedBookList object, starts the workers.
+
+        Args:
+            books (List[Book]): the books to store, they are kept as the
+                                cached objects of their ids, see unique_books
+                                for repeated ids
+            cache_size (int): the number of query results cached, 0 disables it
+            shards (int): the number of shards, defaults to the number of CPUs
+        """
+        books = unique_books(books)
+        columns = Book.to_columns(books)
+        self._start(columns, cache_size, shards)
+        for book in books:
+            self._claim(book)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, list], cache_size: int = 128,
+                     shards: int = None) -> 'ShardedBookList':
+        """ Build a ShardedBookList straight from the columns of a books file,
+            without creating any Book object in this process
+
+        Args:
+            columns (Dict[str, list]): see storage_utils.read_columns and
+                                       unique_columns for repeated ids
+            cache_size (int): the number of query results cached
+            shards (int): the number of shards, defaults to the number of CPUs
+        """
+        books_list = cls.__new__(cls)
+        books_list._start(unique_columns(columns), cache_size, shards)
+        return books_list
+
+    def _start(self, columns: Dict[str, list], cache_size: int, shards: int) -> None:
+        """ Partition the columns and start one worker per shard """
+        self._cache = {}
+        self.source = None
+        self.dirty = set()
+        self.removed = set()
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.cache = QueryCache(cache_size)
+        self.versions = {}
+        self.catalog_version = 0
+        self._start_comment_index()
+        self.shards = shards or os.cpu_count() or 1
+        rows = [array('q') for _ in range(self.shards)]
+        for row, id in enumerate(columns['id']):
+            rows[shard_of(id, self.shards)].append(row)
+        self._position = len(columns['id'])
+        context = storage_utils.worker_context()
+        self._connections, self._processes = [], []
+        for shard_rows in rows:
+            part = {name: [values[row] for row in shard_rows] for name, values in columns.items()}
+            connection, child = context.Pipe()
+            process = context.Process(target=_serve, daemon=True,
+                                      args=(child, storage_utils.pack_columns(part), shard_rows))
+            process.start()
+            child.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._finalizer = weakref.finalize(self, _stop, self._connections, self._processes)
+        # the shards build their indexes in parallel, wait for all of them
+        for connection in self._connections:
+            self._receive(connection)
+
+    def close(self) -> None:
+        """ Stop the worker processes, the list cannot be used afterwards """
+        self._finalizer()
+
+    def _receive(self, connection):
+        """ Return the reply of a worker, raise the exception it sent """
+        ok, result = connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def _call(self, id: int, method: str, *args):
+        """ Run a method on the shard that owns a book id """
+        connection = self._connections[shard_of(id, self.shards)]
+        with self.lock:
+            connection.send((method, args))
+            return self._receive(connection)
+
+    def _scatter(self, method: str, *args, parts: list = None) -> list:
+        """ Run a method on every shard in parallel, return their results
+
+        Args:
+            method (str): a _Shard method
+            args: its arguments
+            parts (list): the arguments of every shard instead of args
+        """
+        with self.lock:
+            for connection, shard_args in zip(self._connections, parts or [args] * self.shards):
+                connection.send((method, shard_args))
+            # every reply is read before raising, the next request gets its own
+            replies = [connection.recv() for connection in self._connections]
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for _, result in replies]
+
+    def _claim(self, book: Book) -> Book:
+        """ Cache a book and take ownership of it, see Book._notify """
+        if book._owner is None or book._owner() is None:
+            book._owner = weakref.ref(self)
+        self._cache[book.id] = book
+        return book
+
+    def _book(self, record: tuple) -> Book:
+        """ Return the Book object of a record, creating it on first access """
+        _, total, row = record
+        book = self._cache.get(row[0])
+        if book is None:
+            book = Book(*row)
+            book.total = total
+            self._claim(book)
+        return book
+
+    def _merge(self, parts: List[list]) -> Iterator[Book]:
+        """ Merge the records of every shard into Book objects, in list order """
+        return (self._book(record) for record in heapq.merge(*parts, key=lambda record: record[0]))
+
+    def _bump(self, genre: str) -> None:
+        """ Invalidate the cached top_books of a genre """
+        genre = genre.lower()
+        self.versions[genre] = self.versions.get(genre, 0) + 1
+
+    def _book_changed(self, book: Book, event: str, args: tuple) -> None:
+        """ Called by an owned book after it changes, see Book._notify. The
+            change is replayed on the shard's copy of the book """
+        self._call(book.id, 'change', book.id, event, args)
+        self.dirty.add(book.id)
+        self._index_comment(book, event, args)
+        if event in RATING_EVENTS:
+            self._bump(book.genre)
+        for listener in self.listeners:
+            listener(book, event, args)
+
+    @property
+    def books(self) -> List[Book]:
+        """ All books as Book objects, in list order """
+        return list(self._merge(self._scatter('books')))
+
+    def add_book(self, book: Book) -> None:
+        """ Add a book to the shard of its id
+
+        Args:
+            book (Book): the book to add, its id must not be in the list yet
+        """
+        with self.lock:
+            self._call(book.id, 'add_book', self._position, book.total,
+                       tuple(book.to_dict().values()))
+            self._position += 1
+        self._claim(book)
+        self._index_comments(book, True)
+        self.dirty.add(book.id)
+        self.removed.discard(book.id)
+        self._bump(book.genre)
+        self.catalog_version += 1
+
+    def remove_book(self, id: int) -> Book:
+        """ Remove a book from its shard
+
+        Args:
+            id (int): unique book id
+
+        Return:
+            book (Book): the removed book
+        """
+        id = int(id)
+        _, total, row = self._call(id, 'remove_book', id)
+        book = self._cache.pop(id, None)
+        if book is None:
+            book = Book(*row)
+            book.total = total
+        elif book._owner is not None and book._owner() is self:
+            book._owner = None
+        self._index_comments(book, False)
+        self.dirty.discard(id)
+        self.removed.add(id)
+        self._bump(book.genre)
+        self.catalog_version += 1
+        return book
+
+    def apply_ratings(self, ratings, chunk_size: int = 1_000_000) -> int:
+        """ Apply many ratings at once, the ratings of each shard are summed
+            here and sent to it in one request per chunk
+
+        Args:
+            ratings: an array of shape (n, 2) or any iterable of (book id, rate) pairs
+            chunk_size (int): pairs read from an iterable at a time
+
+        Return:
+            count (int): the number of ratings applied, pairs with an unknown
+                         book id are skipped
+        """
+        applied = 0
+        for ids, totals, counts in sum_ratings(ratings, chunk_size):
+            parts = [([], [], []) for _ in range(self.shards)]
+            for id, total, count in zip(ids.tolist(), totals.tolist(), counts.tolist()):
+                part = parts[shard_of(id, self.shards)]
+                part[0].append(id)
+                part[1].append(total)
+                part[2].append(count)
+            for record, total, count in chain.from_iterable(
+                    self._scatter('apply_ratings', parts=parts)):
+                _, book_total, row = record
+                id, _, _, rating, reviews, genre = row[:6]
+                book = self._cache.get(id)
+                if book is not None:
+                    book.total, book.reviews, book.rating = book_total, reviews, rating
+                self.dirty.add(id)
+                self._bump(genre)
+                applied += count
+                if self.listeners:
+                    book = self._book(record)
+                    for listener in self.listeners:
+                        listener(book, 'ratings', (total, count))
+        return applied
+
+    def top_books(self, genre: str, rank: int = 10, scorer=None) -> List[Book]:
+        """ Return a recommend list of top books in a genre, rank books by
+            scores. Every shard returns its own top rank, the best of them
+            are merged here.
+
+        Args:
+            genre (str): Fiction/Non Fiction
+            rank (int): top X books, defaults to top 10
+            scorer: a scorer such as bayesian_score, defaults to Book.score.
+                    It is sent to the workers, a lambda cannot be
+
+        Return:
+             board (List[Book]): A list of book objects
+        """
+        genre = genre.lower()
+
+        score = scorer or weighted_score
+
+        def compute() -> List[Book]:
+            boards = [[(self._book(record), record[0]) for record in part]
+                      for part in self._scatter('top_books', genre, rank, scorer)]
+            # highest score first, ties in list order like BookList.boards
+            merged = heapq.merge(*boards, key=lambda item: (-score(item[0].rating, item[0].reviews),
+                                                            item[1]))
+            return [book for book, _ in islice(merged, max(rank, 0))]
+        return self.cache.get(('top', genre, rank, scorer), self.versions.get(genre, 0), compute)
+
+    def find_by_id(self, id: str) -> List[Book]:
+        """ Search books by id, on the shard of the id only
+
+        Args:
+            id (int): unique book id
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        id = int(id)
+        book = self._cache.get(id)
+        if book is not None:
+            return [book]
+        return [self._book(record) for record in self._call(id, 'find_by_id', id)]
+
+    def iter_by_name(self, short_name: str) -> Iterator[Book]:
+        """ Search books by short name, every match is gathered from the
+            shards and read in list order
+
+        Args:
+            short name (str): short name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        return self._merge(self._scatter('find_by_name', short_name, None))
+
+    def iter_by_author(self, author: str) -> Iterator[Book]:
+        """ Search books by author name, see iter_by_name
+
+        Args:
+            author (str): short author name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        return self._merge(self._scatter('find_by_author', author, None))
+
+    def _find(self, method: str, value: str, limit: int, offset: int) -> List[Book]:
+        """ One page of a search, each shard returns its first offset + limit
+            matches """
+        parts = self._scatter(method, value, None if limit is None else offset + limit)
+        return paginate(self._merge(parts), limit, offset)
+
+    def find_by_name(self, short_name: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by short name
+
+        Args:
+            short name (str): short name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('name', short_name.lower(), limit, offset), self.catalog_version,
+                              lambda: self._find('find_by_name', short_name, limit, offset))
+
+    def find_by_author(self, author: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by author name
+
+        Args:
+            author (str): short author name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('author', author.lower(), limit, offset), self.catalog_version,
+                              lambda: self._find('find_by_author', author, limit, offset))
+
+    def cache_info(self) -> CacheInfo:
+        """ Return the statistics of the query cache, see QueryCache """
+        return self.cache.info()
+
+
+def load_sharded(filename: str, shards: int = None, format: str = None) -> ShardedBookList:
+    """ Read the file specified by filename, and return a ShardedBookList object.
+
+    Args:
+        filename (str): a books file name, see storage_utils.FORMATS
+        shards (int): the number of shards, defaults to the number of CPUs
+        format (str): forces a storage format instead of using the extension
+    """
+    books_list = ShardedBookList.from_columns(storage_utils.read_columns(filename, format),
+                                              shards=shards)
+    books_list.source = os.path.abspath(filename)
+    return books_list
@@ -0,0 +1,451 @@
+"""
+snapshot_utils compiles a books file into a binary snapshot that is opened
+with mmap instead of being parsed: numbers are fixed-width columns, texts are
+utf-8 blobs with an offset table. Opening a snapshot only reads its header,
+the pages are shared through the OS page cache by every process that maps
+the same file, and Book objects are created for the rows that are accessed.
+
+A snapshot stands for its books file at one checkpoint (see
+storage_utils.read_checkpoint), stored in the header: it is recompiled when the
+journal compacts new events into the books file.
+
+Layout: MAGIC, the header length (8 bytes), a json header and the sections
+it lists, each 8-byte aligned:
+    id, reviews (int64), rating, total (float64), genre (int32 codes into
+    the header's genre list), sorted_ids / id_rows (int64, the id lookup),
+    and for name, author, intro, comments and the lowercased name_lower /
+    author_lower: <column>.offsets (uint64, rows + 1) and <column>.data,
+    where every text ends with a NUL byte so searches never run across rows.
+
+Classes included: SnapshotBookList
+Functions included: write_snapshot, load_snapshot, load_catalog
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import weakref
+from typing import Iterator, List
+import numpy as np
+import storage_utils
+from books_utils import (RATING_EVENTS, Book, CacheInfo, CommentIndex, QueryCache,
+                         load_books, paginate, sum_ratings, top_rows, weighted_score)
+
+MAGIC = b'BOOKSNP1'
+TEXT_COLUMNS = ['name', 'author', 'intro', 'comments', 'name_lower', 'author_lower']
+
+
+def _align(size: int) -> int:
+    """ Round a size up to a multiple of 8 """
+    return (size + 7) // 8 * 8
+
+
+def _texts(values: List[str]) -> tuple:
+    """ Return the offsets and the NUL-terminated utf-8 blob of some texts """
+    encoded = [value.encode('utf-8') + b'\0' for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def write_snapshot(filename: str, books_list, source: str = None,
+                   checkpoint: int = None) -> None:
+    """ Compile the books of a list into a snapshot file. The file is replaced
+        atomically, processes that mapped the old one keep reading it.
+
+    Args:
+        filename (str): the snapshot file
+        books_list (BookList or ColumnarBookList): the books
+        source (str): the books file the snapshot stands for, defaults to
+                      books_list.source
+        checkpoint (int): the checkpoint of source the books include,
+                          defaults to the one stored in source
+    """
+    books = books_list.books
+    columns = Book.to_columns(books)
+    genres = sorted(set(columns['genre']))
+    codes = {genre: code for code, genre in enumerate(genres)}
+    ids = np.array(columns['id'], dtype='<i8')
+    order = np.argsort(ids, kind='stable')
+    sections = {
+        'id': ids,
+        'rating': np.array(columns['rating'], dtype='<f8'),
+        'reviews': np.array(columns['reviews'], dtype='<i8'),
+        'total': np.array([book.total for book in books], dtype='<f8'),
+        'genre': np.array([codes[genre] for genre in columns['genre']], dtype='<i4'),
+        'sorted_ids': ids[order],
+        'id_rows': order.astype('<i8')}
+    texts = {name: columns[name] for name in TEXT_COLUMNS[:4]}
+    texts['name_lower'] = [name.lower() for name in columns['name']]
+    texts['author_lower'] = [author.lower() for author in columns['author']]
+    for name, values in texts.items():
+        sections[name + '.offsets'], sections[name + '.data'] = _texts(values)
+    layout, position = {}, 0
+    for name, section in sections.items():
+        data = section.tobytes() if isinstance(section, np.ndarray) else section
+        sections[name] = data
+        layout[name] = [position, len(data)]
+        position = _align(position + len(data))
+    if source is None:
+        source = books_list.source
+    if checkpoint is None:
+        checkpoint = storage_utils.read_checkpoint(source) if source else 0
+    header = json.dumps({'count': len(books), 'genres': genres, 'source': source,
+                         'checkpoint': checkpoint, 'sections': layout}).encode('utf-8')
+    start = _align(len(MAGIC) + 8 + len(header))
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, data in sections.items():
+            file.seek(start + layout[name][0])
+            file.write(data)
+    os.replace(temp, filename)
+
+
+class SnapshotBookList(CommentIndex):
+    """ A read-only catalog backed by a memory-mapped snapshot, with the
+    searches and recommendations of books_utils.BookList.
+
+    Ratings and comments can change: the first rating change copies the
+    numeric columns into private memory, and changed books stay in the Book
+    cache. Adding or removing books needs the books file.
+
+    Attributes:
+        filename (str): the snapshot file
+        ids (np.ndarray): book ids
+        ratings (np.ndarray): book ratings rounded to one decimal
+        reviews (np.ndarray): number of reviews
+        totals (np.ndarray): exact sums of the ratings
+        genres (List[str]): the genres, genre_codes indexes them
+        genre_codes (np.ndarray): the genre of every row
+        source (str): the books file the snapshot was compiled from
+        checkpoint (int): the checkpoint of source the snapshot includes
+        dirty (set): ids of books changed since then
+        removed (set): always empty
+        listeners (list): callables listener(book, event, args), called after
+                          an owned book changes
+        lock (threading.RLock): guards the Book cache and the numeric columns
+                                when several threads share the list, see server.py
+        cache (QueryCache): recent query results
+    """
+
+    def __init__(self, filename: str, cache_size: int = 128):
+        """ Constructor of the SnapshotBookList object, maps the file
+
+        Args:
+            filename (str): a file written by write_snapshot
+            cache_size (int): the number of query results cached, 0 disables it
+        """
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a books snapshot: {filename}")
+        size, = struct.unpack_from('<Q', self._map, len(MAGIC))
+        header = json.loads(self._map[len(MAGIC) + 8: len(MAGIC) + 8 + size])
+        self._start = _align(len(MAGIC) + 8 + size)
+        self._sections = header['sections']
+        self._count = header['count']
+        self.ids = self._array('id', '<i8')
+        self.ratings = self._array('rating', '<f8')
+        self.reviews = self._array('reviews', '<i8')
+        self.totals = self._array('total', '<f8')
+        self.genres = header['genres']
+        self.genre_codes = self._array('genre', '<i4')
+        self._sorted_ids = self._array('sorted_ids', '<i8')
+        self._id_rows = self._array('id_rows', '<i8')
+        self._offsets = {name: self._array(name + '.offsets', '<u8') for name in TEXT_COLUMNS}
+        self._cache = {}
+        self.source = header['source']
+        # snapshots written before checkpoints were stored
+        self.checkpoint = header.get('checkpoint')
+        self.dirty = set()
+        self.removed = set()
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.cache = QueryCache(cache_size)
+        self.versions = {}
+        self.catalog_version = 0
+        self._start_comment_index()
+
+    def _array(self, name: str, dtype: str) -> np.ndarray:
+        """ A read-only array over a section of the file, nothing is copied """
+        offset, size = self._sections[name]
+        return np.frombuffer(self._map, dtype=dtype, count=size // np.dtype(dtype).itemsize,
+                             offset=self._start + offset)
+
+    def _text(self, column: str, row: int) -> str:
+        """ Decode the text of a column in a row """
+        offsets = self._offsets[column]
+        start = self._start + self._sections[column + '.data'][0]
+        return self._map[start + int(offsets[row]): start + int(offsets[row + 1]) - 1].decode('utf-8')
+
+    def _book(self, row: int) -> Book:
+        """ Return the Book object for a row, creating it on first access """
+        id = int(self.ids[row])
+        book = self._cache.get(id)
+        if book is not None:
+            return book
+        with self.lock:
+            # two threads must not create two books for one id
+            book = self._cache.get(id)
+            if book is None:
+                book = Book(id, self._text('name', row), self._text('author', row),
+                            float(self.ratings[row]), int(self.reviews[row]),
+                            self.genres[self.genre_codes[row]], self._text('intro', row),
+                            self._text('comments', row))
+                book.total = float(self.totals[row])
+                book._owner = weakref.ref(self)
+                self._cache[id] = book
+        return book
+
+    def _row(self, id: int) -> int:
+        """ Return the row of a book id, or -1 """
+        position = np.searchsorted(self._sorted_ids, id)
+        if position < self._count and self._sorted_ids[position] == id:
+            return int(self._id_rows[position])
+        return -1
+
+    def _make_writable(self) -> None:
+        """ Copy the numeric columns out of the shared pages before a change """
+        with self.lock:
+            if not self.ratings.flags.writeable:
+                self.ratings = self.ratings.copy()
+                self.reviews = self.reviews.copy()
+                self.totals = self.totals.copy()
+
+    def _bump(self, genre: str) -> None:
+        """ Invalidate the cached top_books of a genre """
+        genre = genre.lower()
+        self.versions[genre] = self.versions.get(genre, 0) + 1
+
+    def _book_changed(self, book: Book, event: str, args: tuple) -> None:
+        """ Called by an owned book after it changes, see Book._notify """
+        with self.lock:
+            self.dirty.add(book.id)
+            self._index_comment(book, event, args)
+            if event in RATING_EVENTS:
+                self._make_writable()
+                row = self._row(book.id)
+                self.ratings[row] = book.rating
+                self.reviews[row] = book.reviews
+                self.totals[row] = book.total
+                self._bump(book.genre)
+        for listener in self.listeners:
+            listener(book, event, args)
+
+    @property
+    def books(self) -> List[Book]:
+        """ All books as Book objects, in list order """
+        return [self._book(row) for row in range(self._count)]
+
+    def text_column(self, field: str) -> List[str]:
+        """ Return the names or the authors of every row, decoded in one pass
+            without creating Book objects, see search_utils.SearchEngine
+
+        Args:
+            field (str): "name" or "author"
+        """
+        start, size = self._sections[field + '.data']
+        start += self._start
+        # every text ends with a NUL byte
+        return self._map[start: start + size].decode('utf-8').split('\0')[: self._count]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """ Book.score for every row """
+        return weighted_score(self.ratings, self.reviews)
+
+    def add_book(self, book: Book) -> None:
+        """ Snapshots are read-only catalogs, add books to the books file """
+        raise TypeError("Books cannot be added to a snapshot, load the books file instead")
+
+    def remove_book(self, id: int) -> Book:
+        """ Snapshots are read-only catalogs, remove books from the books file """
+        raise TypeError("Books cannot be removed from a snapshot, load the books file instead")
+
+    def apply_ratings(self, ratings, chunk_size: int = 1_000_000) -> int:
+        """ Apply many ratings at once, see ColumnarBookList.apply_ratings
+
+        Return:
+            count (int): the number of ratings applied
+        """
+        self._make_writable()
+        applied = 0
+        for ids, totals, counts in sum_ratings(ratings, chunk_size):
+            positions = np.minimum(np.searchsorted(self._sorted_ids, ids), self._count - 1)
+            known = self._sorted_ids[positions] == ids
+            rows = self._id_rows[positions[known]]
+            totals, counts = totals[known], counts[known]
+            with self.lock:
+                self.totals[rows] += totals
+                self.reviews[rows] += counts
+                # python round, like Book.rating
+                self.ratings[rows] = [round(mean, 1) for mean in
+                                      (self.totals[rows] / self.reviews[rows]).tolist()]
+                self.dirty.update(self.ids[rows].tolist())
+                for code in set(self.genre_codes[rows].tolist()):
+                    self._bump(self.genres[code])
+                for row in rows.tolist():
+                    book = self._cache.get(int(self.ids[row]))
+                    if book is not None:
+                        book.total = float(self.totals[row])
+                        book.reviews = int(self.reviews[row])
+                        book.rating = float(self.ratings[row])
+            applied += int(counts.sum())
+            for row, total, count in zip(rows.tolist(), totals.tolist(), counts.tolist()):
+                if self.listeners:
+                    book = self._book(row)
+                    for listener in self.listeners:
+                        listener(book, 'ratings', (total, count))
+        return applied
+
+    def top_books(self, genre: str, rank: int = 10, scorer=None) -> List[Book]:
+        """ Return a recommend list of top books in a genre, rank books by scores
+            selected with top_rows
+
+        Args:
+            genre (str): Fiction/Non Fiction
+            rank (int): top X books, defaults to top 10
+            scorer: a scorer such as bayesian_score, defaults to Book.score
+
+        Return:
+             board (List[Book]): A list of book objects
+        """
+        genre = genre.lower()
+
+        def compute() -> List[Book]:
+            codes = [code for code, name in enumerate(self.genres) if name.lower() == genre]
+            rows = np.flatnonzero(np.isin(self.genre_codes, codes))
+            scores = (scorer or weighted_score)(self.ratings[rows], self.reviews[rows])
+            # highest score first, ties in list order like a stable sort
+            return [self._book(row) for row in rows[top_rows(scores, rank)]]
+        return self.cache.get(('top', genre, rank, scorer), self.versions.get(genre, 0), compute)
+
+    def find_by_id(self, id: str) -> List[Book]:
+        """ Search books by id
+
+        Args:
+            id (int): unique book id
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        row = self._row(int(id))
+        return [self._book(row)] if row >= 0 else []
+
+    def _search(self, column: str, value: str) -> Iterator[Book]:
+        """ Case-insensitive substring search, run by mmap.find over the
+            lowercased texts of a column, in list order """
+        query = value.lower().encode('utf-8')
+        offsets = self._offsets[column]
+        start, size = self._sections[column + '.data']
+        start += self._start
+        position = self._map.find(query, start, start + size)
+        # an empty query also matches at the very end of the texts
+        while start <= position < start + size:
+            row = int(np.searchsorted(offsets, position - start, side='right')) - 1
+            yield self._book(row)
+            # the next match is in a later row
+            position = self._map.find(query, start + int(offsets[row + 1]), start + size)
+
+    def iter_by_name(self, short_name: str) -> Iterator[Book]:
+        """ Search books by short name, lazily
+
+        Args:
+            short name (str): short name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        return self._search('name_lower', short_name)
+
+    def iter_by_author(self, author: str) -> Iterator[Book]:
+        """ Search books by author name, lazily
+
+        Args:
+            author (str): short author name of books
+
+        Yields:
+             book (Book): the matching books, in list order
+        """
+        return self._search('author_lower', author)
+
+    def find_by_name(self, short_name: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by short name
+
+        Args:
+            short name (str): short name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('name', short_name.lower(), limit, offset), self.catalog_version,
+                              lambda: paginate(self.iter_by_name(short_name), limit, offset))
+
+    def find_by_author(self, author: str, limit: int = None, offset: int = 0) -> List[Book]:
+        """ Search books by author name
+
+        Args:
+            author (str): short author name of books
+            limit (int): return at most limit books, defaults to all
+            offset (int): skip the first offset matches, for the next pages
+
+        Return:
+             result (List[Book]): A list of book objects
+        """
+        return self.cache.get(('author', author.lower(), limit, offset), self.catalog_version,
+                              lambda: paginate(self.iter_by_author(author), limit, offset))
+
+    def cache_info(self) -> CacheInfo:
+        """ Return the statistics of the query cache, see QueryCache """
+        return self.cache.info()
+
+
+def load_snapshot(filename: str, cache_size: int = 128) -> SnapshotBookList:
+    """ Map a snapshot file and return it as a SnapshotBookList
+
+    Args:
+        filename (str): a file written by write_snapshot
+        cache_size (int): the number of query results cached
+    """
+    return SnapshotBookList(filename, cache_size)
+
+
+def load_catalog(books_file: str, snapshot_file: str, format: str = None):
+    """ Load the books from the snapshot when it was compiled from the books
+        file at its current checkpoint, otherwise load the books file and
+        compile a new snapshot for the next start. A books file without a
+        checkpoint, never compacted by a journal, is compared by modification
+        time instead
+
+    Args:
+        books_file (str): a books file name, see storage_utils.FORMATS
+        snapshot_file (str): the snapshot of books_file
+        format (str): forces a storage format instead of using the extension
+
+    Return:
+        books_list (SnapshotBookList or BookList)
+    """
+    checkpoint = storage_utils.read_checkpoint(books_file, format)
+    if os.path.exists(snapshot_file):
+        books_list = load_snapshot(snapshot_file)
+        if (books_list.source == os.path.abspath(books_file)
+                and books_list.checkpoint == checkpoint
+                and (checkpoint or os.path.getmtime(snapshot_file) >= os.path.getmtime(books_file))):
+            return books_list
+    books_list = load_books(books_file, format)
+    write_snapshot(snapshot_file, books_list, checkpoint=checkpoint)
+    return books_list
+
+
+if __name__ == "__main__":
+    # compile a snapshot, e.g. python snapshot_utils.py data/books.xlsx data/books.snapshot
+    import sys
+    write_snapshot(sys.argv[2], load_books(sys.argv[1]))
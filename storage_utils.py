@@ -0,0 +1,346 @@
+"""
+storage_utils reads and writes books files. The format is chosen by the file
+extension (or the format argument): Excel workbooks, SQLite databases and the
+columnar Parquet / Feather formats. Every format is exchanged as columns,
+{column name: list of values}, in the order of COLUMNS, followed by the
+OPTIONAL_COLUMNS the file has.
+
+A catalog can be split into shards, several books files read together (see
+books_utils.load_books). Shards are read in worker processes, which send
+their columns back packed (pack_columns) rather than as one pickled object
+per value. Worker processes are forked while the parent runs a single thread.
+A fork copies the locks of the other threads (run.py loads the catalog in a
+thread) in whatever state they are, so workers then come from a fork server
+instead, or are spawned where there is none (worker_context).
+
+A books file can also hold a checkpoint, the sequence number of the last
+journal event it includes (see journal_utils), written together with the rows.
+
+Functions included: read_columns, write_columns, update_columns, read_checkpoint,
+                    write_checkpoint, get_format, find_shards, pack_columns, unpack_columns,
+                    read_packed_columns, worker_context
+
+NAME: Tianzi Qin
+SEMESTER: Spring 23
+"""
+import glob
+import multiprocessing
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Union
+
+# the columns of a books file, in Book constructor order
+COLUMNS = ['id', 'name', 'author', 'rating', 'reviews', 'genre', 'intro', 'comments']
+# written with COLUMNS when given, except to xlsx, which keeps the layout of
+# the shipped catalog. Files written before they existed lack them.
+# total: the exact sum of the ratings (Book.total)
+OPTIONAL_COLUMNS = ['total']
+# the SQLite type of the OPTIONAL_COLUMNS, added to older files when written
+OPTIONAL_TYPES = {'total': 'REAL'}
+
+# file extension -> format name
+FORMATS = {'.xlsx': 'xlsx', '.sqlite': 'sqlite', '.db': 'sqlite',
+           '.parquet': 'parquet', '.feather': 'feather'}
+
+# formats that can update single rows, see update_columns
+INCREMENTAL_FORMATS = {'sqlite'}
+
+# the array typecode of the numeric columns, see pack_columns
+NUMERIC_COLUMNS = {'id': 'q', 'rating': 'd', 'reviews': 'q', 'total': 'd'}
+# joins the values of a text column, it cannot be part of a value
+SEPARATOR = '\x00'
+
+SQLITE_SCHEMA = """CREATE TABLE IF NOT EXISTS books (
+    id INTEGER NOT NULL UNIQUE, name TEXT, author TEXT, rating REAL,
+    reviews INTEGER, genre TEXT, intro TEXT, comments TEXT)"""
+# settings of a SQLite books file, such as the checkpoint
+SQLITE_META = """CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)"""
+
+
+def get_format(filename: str, format: str = None) -> str:
+    """ Return the storage format of a books file
+
+    Args:
+        filename (str): a books file name
+        format (str): forces a format, one of the FORMATS values
+
+    Return:
+        format (str): the format name
+    """
+    if format is None:
+        format = FORMATS.get(os.path.splitext(filename)[1].lower())
+    if format not in FORMATS.values():
+        raise ValueError(f"Unsupported books file: {filename}")
+    return format
+
+
+def find_shards(filenames: Union[str, Iterable[str]]) -> List[str]:
+    """ Return the books files of a catalog: a file name, a glob pattern such
+        as "data/books_*.parquet", or a list of file names
+
+    Args:
+        filenames: a file name, a glob pattern or a list of file names
+
+    Return:
+        filenames (List[str]): the files, a pattern's matches sorted by name
+    """
+    if not isinstance(filenames, str):
+        return list(filenames)
+    if not any(char in filenames for char in '*?['):
+        return [filenames]
+    shards = sorted(glob.glob(filenames))
+    if len(shards) == 0:
+        raise FileNotFoundError(f"No books file matches {filenames}")
+    return shards
+
+
+def pack_columns(columns: Dict[str, list]) -> dict:
+    """ Pack columns to be sent to another process: numeric columns become
+        arrays and text columns one string, both pickled as a single buffer.
+        A column that cannot be packed, e.g. with empty cells, stays a list.
+    """
+    packed = {}
+    for name, values in columns.items():
+        try:
+            if name in NUMERIC_COLUMNS:
+                packed[name] = array(NUMERIC_COLUMNS[name], values)
+                continue
+            text = SEPARATOR.join(values)
+            if text.count(SEPARATOR) == max(len(values) - 1, 0):
+                packed[name] = (len(values), text)
+                continue
+        except (TypeError, OverflowError):
+            pass
+        packed[name] = values
+    return packed
+
+
+def unpack_columns(packed: dict) -> Dict[str, list]:
+    """ The reverse of pack_columns """
+    columns = {}
+    for name, values in packed.items():
+        if isinstance(values, array):
+            values = values.tolist()
+        elif isinstance(values, tuple):
+            count, text = values
+            values = text.split(SEPARATOR) if count else []
+        columns[name] = values
+    return columns
+
+
+def read_packed_columns(filename: str, format: str = None) -> dict:
+    """ read_columns then pack_columns, run by the worker processes """
+    return pack_columns(read_columns(filename, format))
+
+
+def worker_context():
+    """ Return the multiprocessing context to start worker processes with,
+        see the module docstring """
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _names(columns) -> List[str]:
+    """ Return COLUMNS and the OPTIONAL_COLUMNS found in columns, a dict,
+        a DataFrame or a list of names """
+    return COLUMNS + [name for name in OPTIONAL_COLUMNS if name in columns]
+
+
+def _frame_columns(df) -> Dict[str, list]:
+    """ Return the columns of a DataFrame as plain python lists """
+    return {name: df[name].tolist() for name in _names(df)}
+
+
+def _sqlite_columns(connection: sqlite3.Connection) -> List[str]:
+    """ Return the column names of the books table """
+    return [row[1] for row in connection.execute("PRAGMA table_info(books)")]
+
+
+def _add_sqlite_columns(connection: sqlite3.Connection, names: List[str]) -> None:
+    """ Add the optional columns in names the books table lacks, the rows
+        already there get NULL """
+    existing = _sqlite_columns(connection)
+    for name in names:
+        if name not in existing:
+            connection.execute(f"ALTER TABLE books ADD COLUMN {name} {OPTIONAL_TYPES[name]}")
+
+
+def read_columns(filename: str, format: str = None) -> Dict[str, list]:
+    """ Read a books file
+
+    Args:
+        filename (str): a books file name
+        format (str): forces a format instead of using the extension
+
+    Return:
+        columns (Dict[str, list]): {column name: values} for every name in COLUMNS
+                                   and the OPTIONAL_COLUMNS of the file
+    """
+    format = get_format(filename, format)
+    if format == 'sqlite':
+        connection = sqlite3.connect(filename)
+        try:
+            names = _names(_sqlite_columns(connection))
+            rows = connection.execute(
+                f"SELECT {', '.join(names)} FROM books ORDER BY rowid").fetchall()
+        finally:
+            connection.close()
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return {name: list(column) for name, column in zip(names, values)}
+    import pandas as pd
+    if format == 'xlsx':
+        return _frame_columns(pd.read_excel(filename))
+    if format == 'parquet':
+        return _frame_columns(pd.read_parquet(filename))
+    return _frame_columns(pd.read_feather(filename))
+
+
+def write_columns(filename: str, columns: Dict[str, List], format: str = None,
+                  checkpoint: int = None) -> None:
+    """ Write a books file, replacing its content
+
+    Args:
+        filename (str): a books file name
+        columns (Dict[str, list]): {column name: values} for every name in COLUMNS,
+                                   and optionally in OPTIONAL_COLUMNS (not
+                                   written to xlsx)
+        format (str): forces a format instead of using the extension
+        checkpoint (int): the last journal event the columns include, none
+                          by default
+    """
+    format = get_format(filename, format)
+    names = COLUMNS if format == 'xlsx' else _names(columns)
+    if format == 'sqlite':
+        connection = sqlite3.connect(filename)
+        try:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS books")
+                connection.execute(SQLITE_SCHEMA)
+                _add_sqlite_columns(connection, names)
+                connection.executemany(
+                    f"INSERT INTO books ({', '.join(names)}) "
+                    f"VALUES ({', '.join('?' * len(names))})",
+                    zip(*(columns[name] for name in names)))
+                _write_sqlite_checkpoint(connection, checkpoint or 0)
+        finally:
+            connection.close()
+        return
+    import pandas as pd
+    df = pd.DataFrame({name: columns[name] for name in names}, columns=names)
+    if format == 'xlsx':
+        df.to_excel(filename, index=False)
+    elif format == 'parquet':
+        df.to_parquet(filename, index=False)
+    else:
+        df.to_feather(filename)
+    _write_checkpoint_file(filename, checkpoint or 0)
+
+
+def update_columns(filename: str, columns: Dict[str, List], removed: Iterable[int] = (),
+                   format: str = None, checkpoint: int = None) -> None:
+    """ Update some rows of an existing books file in place, rows are matched
+        by id, new ids are added at the end. Only INCREMENTAL_FORMATS support it.
+
+    Args:
+        filename (str): a books file name
+        columns (Dict[str, list]): {column name: values} of the changed rows
+        removed (Iterable[int]): ids of the rows to delete
+        format (str): forces a format instead of using the extension
+        checkpoint (int): the last journal event the file includes after the
+                          update, in the same transaction, unchanged by default
+    """
+    format = get_format(filename, format)
+    if format not in INCREMENTAL_FORMATS:
+        raise ValueError(f"{format} files can only be written as a whole")
+    names = _names(columns)
+    updates = ', '.join(f"{name} = excluded.{name}" for name in names[1:])
+    connection = sqlite3.connect(filename)
+    try:
+        with connection:
+            _add_sqlite_columns(connection, names)
+            connection.executemany(
+                f"INSERT INTO books ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                zip(*(columns[name] for name in names)))
+            connection.executemany("DELETE FROM books WHERE id = ?",
+                                   ((id,) for id in removed))
+            if checkpoint is not None:
+                _write_sqlite_checkpoint(connection, checkpoint)
+    finally:
+        connection.close()
+
+
+def _write_sqlite_checkpoint(connection: sqlite3.Connection, checkpoint: int) -> None:
+    """ Store the checkpoint in the meta table, within the caller's transaction """
+    connection.execute(SQLITE_META)
+    connection.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)", (checkpoint,))
+
+
+def _write_checkpoint_file(filename: str, checkpoint: int) -> None:
+    """ Store the checkpoint of a file written as a whole next to it, in
+        filename + ".checkpoint", replaced atomically """
+    path = filename + '.checkpoint'
+    if checkpoint == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(str(checkpoint))
+    os.replace(path + '.tmp', path)
+
+
+def write_checkpoint(filename: str, checkpoint: int, format: str = None) -> None:
+    """ Store the checkpoint of an existing books file without writing its rows
+
+    Args:
+        filename (str): a books file name
+        checkpoint (int): the last journal event the file includes
+        format (str): forces a format instead of using the extension
+    """
+    if get_format(filename, format) != 'sqlite':
+        _write_checkpoint_file(filename, checkpoint)
+        return
+    connection = sqlite3.connect(filename)
+    try:
+        with connection:
+            _write_sqlite_checkpoint(connection, checkpoint)
+    finally:
+        connection.close()
+
+
+def read_checkpoint(filename: str, format: str = None) -> int:
+    """ Return the checkpoint of a books file, the sequence number of the
+        last journal event it includes, 0 when it has none
+
+    Args:
+        filename (str): a books file name
+        format (str): forces a format instead of using the extension
+    """
+    if not os.path.exists(filename):
+        return 0
+    if get_format(filename, format) == 'sqlite':
+        connection = sqlite3.connect(filename)
+        try:
+            row = connection.execute(
+                "SELECT value FROM meta WHERE name = 'checkpoint'").fetchone()
+        except sqlite3.OperationalError:
+            # written before checkpoints were stored
+            row = None
+        finally:
+            connection.close()
+        return int(row[0]) if row else 0
+    try:
+        with open(filename + '.checkpoint', encoding='utf-8') as file:
+            return int(file.read())
+    except FileNotFoundError:
+        return 0
+
+
+if __name__ == "__main__":
+    # convert between formats, e.g. python storage_utils.py data/books.xlsx data/books.sqlite
+    import sys
+    write_columns(sys.argv[2], read_columns(sys.argv[1]))
@@ -1,13 +1,33 @@
 """ 
 user_utils handles user related classes and functions,   
 we can use them to save a user name, record user's rates and comments 
-to different books.
+to different books, and keep them with the user's bookshelf between sessions.
 
-Classes included: User
+Classes included: User, UserStore
 
 NAME: Tianzi Qin
 SEMESTER: Spring 23
 """
+import sqlite3
+import threading
+from typing import Iterable, List, Tuple
+from books_utils import Book, BookShelf, parse_rate
+
+# one table per dict, clustered by user name, so one user's rows are read 
+# with one index lookup however many users there are 
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    user TEXT NOT NULL, id INTEGER NOT NULL, rate INTEGER, 
+    PRIMARY KEY (user, id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS comments (
+    user TEXT NOT NULL, id INTEGER NOT NULL, comment TEXT, 
+    PRIMARY KEY (user, id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS collects (
+    user TEXT NOT NULL, id INTEGER NOT NULL, name TEXT, 
+    UNIQUE (user, id));
+"""
+
+
 class User:
     """A user class contains the following properties:
 
@@ -15,7 +35,12 @@ class User:
         name (str) - a name for the user
         rates (dict): An empty dict, save users'rates, format: {book id: rate}  
         comments (dict): An empty dict, save users'comments, format: {book id: comment} 
+        listeners (list): callables listener(user, event, args), called after a 
+                          rate ("rate", (book id, rate)) or a comment 
+                          ("comment", (book id, comment)) is added, or both are 
+                          removed ("remove", (book id,)) 
     """
+    __slots__ = ('name', 'rates', 'comments', 'listeners')
 
     def __init__(self, name: str):
         """ Constructor of the User object. 
@@ -26,6 +51,7 @@ class User:
         self.name = name
         self.rates = {}
         self.comments = {}
+        self.listeners = []
 
     def add_rate(self, id: int, value: int, min: int = 1, max: int = 5) -> None: 
         """ Add rate to rates dict 
@@ -41,6 +67,8 @@ class User:
         if value > max:
             value = max
         self.rates[id] = value
+        for listener in self.listeners: 
+            listener(self, 'rate', (id, value))
 
     def add_comment(self, id: int, comment: str) -> None: 
         """ Add comment to comments dict 
@@ -50,3 +78,140 @@ class User:
             comment (str): user's comment
         """ 
         self.comments[id] = comment
+        for listener in self.listeners: 
+            listener(self, 'comment', (id, comment))
+
+    def remove(self, id: int) -> None: 
+        """ Forget the rate and the comment of a book 
+
+        Args: 
+            id (int): unique book id 
+        """
+        self.rates.pop(id, None)
+        self.comments.pop(id, None)
+        for listener in self.listeners: 
+            listener(self, 'remove', (id,))
+
+    def book_changed(self, book: Book, event: str, args: tuple) -> None: 
+        """ Forget a book whose comment by this user was removed, e.g. by 
+            BookList.remove_user_comments, a BookList listener """
+        if event == 'remove_comment' and args[0] == self.name: 
+            self.remove(book.id)
+
+
+class UserStore: 
+    """ Keeps users and their bookshelves in a SQLite database, keyed by user 
+    name. Loading a user reads only that user's rows. 
+
+    Attributes: 
+        filename (str): the database file 
+    """
+
+    def __init__(self, filename: str): 
+        """ Constructor of the UserStore object, opens or creates the database 
+
+        Args: 
+            filename (str): the database file 
+        """
+        self.filename = filename
+        # shared by the threads of server.py, guarded by the lock
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(USERS_SCHEMA)
+        self._lock = threading.Lock()
+
+    def load(self, name: str) -> Tuple[User, BookShelf]: 
+        """ Return the user and the bookshelf saved under a name, empty ones 
+            for a new name 
+
+        Args: 
+            name (str): user name 
+        """
+        user = User(name)
+        shelf = BookShelf(name)
+        with self._lock: 
+            user.rates = dict(self._connection.execute(
+                "SELECT id, rate FROM rates WHERE user = ?", (name,)))
+            user.comments = dict(self._connection.execute(
+                "SELECT id, comment FROM comments WHERE user = ?", (name,)))
+            shelf.collects = dict(self._connection.execute(
+                "SELECT id, name FROM collects WHERE user = ? ORDER BY rowid", (name,)))
+        return user, shelf
+
+    def record(self, source, event: str, args: tuple) -> None: 
+        """ Save one change, the listener for User.listeners and BookShelf.listeners 
+
+        Args: 
+            source (User or BookShelf): what changed 
+            event (str): "rate", "comment", "remove" or "collect" 
+            args (tuple): (book id, rate / comment / book name), (book id,) 
+                          for "remove" 
+        """
+        if event == 'remove': 
+            with self._lock, self._connection: 
+                for table in ('rates', 'comments'): 
+                    self._connection.execute(f"DELETE FROM {table} WHERE user = ? AND id = ?", 
+                                             (source.name, *args))
+            return
+        statements = {
+            'rate': "INSERT OR REPLACE INTO rates VALUES (?, ?, ?)", 
+            'comment': "INSERT OR REPLACE INTO comments VALUES (?, ?, ?)", 
+            # a book collected again keeps its place on the shelf
+            'collect': "INSERT OR IGNORE INTO collects VALUES (?, ?, ?)"}
+        with self._lock, self._connection: 
+            self._connection.execute(statements[event], (source.name, *args))
+
+    def attach(self, user: User, shelf: BookShelf = None) -> None: 
+        """ Start saving the changes of a user and a bookshelf as they happen """
+        user.listeners.append(self.record)
+        if shelf is not None: 
+            shelf.listeners.append(self.record)
+
+    def save(self, user: User, shelf: BookShelf = None) -> None: 
+        """ Save all rates, comments and collects of a user and a bookshelf, 
+            e.g. the collects a journal replay restored 
+        """
+        with self._lock, self._connection: 
+            self._connection.executemany("INSERT OR REPLACE INTO rates VALUES (?, ?, ?)", 
+                                         ((user.name, id, rate) for id, rate in user.rates.items()))
+            self._connection.executemany("INSERT OR REPLACE INTO comments VALUES (?, ?, ?)", 
+                                         ((user.name, id, comment) 
+                                          for id, comment in user.comments.items()))
+            if shelf is not None: 
+                self._connection.executemany("INSERT OR IGNORE INTO collects VALUES (?, ?, ?)", 
+                                             ((shelf.name, id, name) 
+                                              for id, name in shelf.collects.items()))
+
+    def all_rates(self) -> Tuple[List[str], List[int], List[int]]: 
+        """ Return the rates of every user as columns, (user names, book ids, 
+            rates), e.g. for recommend_utils.Recommender.from_store 
+        """
+        with self._lock: 
+            rows = self._connection.execute("SELECT user, id, rate FROM rates").fetchall()
+        users, ids, rates = zip(*rows) if rows else ((), (), ())
+        return list(users), list(ids), list(rates)
+
+    def import_rates(self, books: Iterable[Book]) -> int: 
+        """ Save the rates found in Book.comments under their users, e.g. the 
+            comments of a catalog imported into the app. Rates saved before 
+            are kept. 
+
+        Args: 
+            books (Iterable[Book]): the books 
+
+        Return: 
+            count (int): the number of rates found 
+        """
+        rows = [(user, book.id, rate) for book in books 
+                for user, rate in ((user, parse_rate(comment)) 
+                                   for user, comment in book.comments.items()) 
+                if rate is not None]
+        with self._lock, self._connection: 
+            self._connection.executemany("INSERT OR IGNORE INTO rates VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def close(self) -> None: 
+        """ Close the database """
+        with self._lock: 
+            self._connection.close()
@@ -12,6 +12,10 @@ from enum import Enum
 import sys
 
 
+# the number of search results shown at once
+PAGE_SIZE = 20
+
+
 class Menu(Enum):
     """ The options for the menu """
     SEARCH = 1
@@ -52,6 +56,7 @@ def print_menu() -> None:
     print('Type any of the following commands, or you can type the number.')
     print('1. Search - search your target book by id, author or name. For example - search name harry potter')
     print('2. Recommend - show books with best reviews in non fiction and fiction genres. For example - recommend fiction)')
+    print('   Type "recommend me" for books picked from your rates.')
     print('3. Bookshelf - show books you collect.')
     print('4. Help - Type "help" to get a list of commands.')
     print('5. Exit - exit the program. It will automatically update books info.')
@@ -163,13 +168,17 @@ def display_board(board: List[books_utils.Book], rank: int = 10) -> None:
         print()
 
 
-def display_search(result: List[books_utils.Book]) -> None:
+def display_search(result: List[books_utils.Book], more: bool = False) -> None:
     """ Display search results
 
     Args:   
         result (List[books_utils.Book]) 
+        more (bool): defaults to False, True when result is only the first page 
     """
-    print(f"{len(result)} results found")
+    if more:
+        print(f"Showing the first {len(result)} results, refine your search to see more")
+    else:
+        print(f"{len(result)} results found")
     for book in result:
         print(book)
         print()